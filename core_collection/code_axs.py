@@ -3,51 +3,539 @@
 """ This entry knows how to make other entries.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import deepcopy
+import json
 import logging
+import operator
 import os
+import threading
+import kernel_lease
+import kernel_scheduler
+import kernel_store
+import kernel_trace
+import stored_entry
 import ufun
 
-def walk(__entry__, skip_entry_names=None):
+try:
+    import fcntl
+except ImportError:             # no cross-process locking on Windows
+    fcntl = None
+
+numpy = None                    # imported by columnar_index() once an index is large enough to need it (False if NumPy is not available)
+
+FILENAME_entry_index    = 'index_axs.json'
+VERSION_entry_index     = 1
+FILENAME_membership_lock = '.membership_axs.lock'
+JOURNAL_compaction_min_size = 65536     # bytes
+PREFETCH_min_entries    = 8     # fewer uncached entries than this are not worth a thread pool
+PREFETCH_chunks_per_thread = 4  # the entries are probed in chunks, as a task per entry costs more than a local stat()
+COLUMNAR_min_entries    = 64    # smaller indices are matched record by record
+FLOAT_exact_int_limit   = 2**53 # larger integers may not survive the conversion to a float column
+STORE_chunk_entries     = 256   # the entries kept in a collection's store are loaded this many at a time
+
+loaded_entry_indices    = {}    # index_path -> { entry_name: index_record }, shared by all the collections using this code
+columnar_indices        = {}    # index_path -> ColumnarIndex of the loaded index (rebuilt once the index is reloaded or re-saved)
+pending_membership_records = {} # journal_path -> [ membership_record, ... ] not appended yet (in the write-behind mode)
+held_membership_locks   = {}    # (lock_path, thread_id) -> [ lock_fd, whether_exclusive ] , so that the membership locks are re-entrant
+
+
+def entry_index(__entry__):
+    """An internal method that lazy-loads and caches the collection's on-disk index of contained entries
+    """
+    index_path = __entry__.get_path( FILENAME_entry_index )
+
+    if index_path not in loaded_entry_indices:
+        try:
+            index_data = ufun.load_json( index_path )
+        except OSError:
+            index_data = {}
+
+        if type(index_data)==dict and index_data.get('index_version')==VERSION_entry_index:
+            loaded_entry_indices[index_path] = index_data.get('entries', {})
+        else:
+            loaded_entry_indices[index_path] = {}
+
+    return loaded_entry_indices[index_path]
+
+
+def save_entry_index(__entry__):
+    """An internal method that stores the collection's index of contained entries next to its data_axs.json
+    """
+    index_path          = __entry__.get_path( FILENAME_entry_index )
+    contained_entries   = __entry__.get('contained_entries', {})
+    indexed_entries     = { entry_name: index_record for entry_name, index_record in entry_index(__entry__).items() if entry_name in contained_entries }
+
+    loaded_entry_indices[index_path] = indexed_entries
+    try:
+        ufun.save_json( { "index_version": VERSION_entry_index, "entries": indexed_entries }, index_path, atomic=True )
+    except OSError as e:
+        kernel_trace.trace( lambda: f"collection({__entry__.get_name()}): could not store the index to {index_path} : {e}" )
+
+
+def entry_stamp(entry_path, __entry__):
+    """An internal method that returns a cheap fingerprint of an entry's data_axs.json , or None if there is no such file
+    """
+    return ufun.file_stamp( os.path.join( entry_path, __entry__.FILENAME_parameters ) )
+
+
+def make_index_record(contained_entry, entry_path, stamp):
+    """An internal method that summarizes an entry's own data for the index:
+        scalar params and tags are kept verbatim, only the names of other params are kept.
+    """
+    own_data        = contained_entry.own_data()
+    known_values    = {}
+    opaque_names    = []
+    for param_name, param_value in own_data.items():
+        if kernel_store.index_kind( param_name, param_value )==kernel_store.KIND_opaque:
+            opaque_names.append( param_name )
+        else:
+            known_values[param_name] = param_value
+
+    return {
+        "path":         entry_path,
+        "stamp":        stamp,
+        "collection":   'contained_entries' in own_data,
+        "values":       known_values,
+        "opaque":       opaque_names,
+    }
+
+
+def up_to_date_index_record(entry_name, real_entry_path, indexed_entries, __entry__, stamp=None):
+    """An internal method that returns the contained entry's index record (rebuilding it if it is missing or stale)
+        and whether it had to be rebuilt. The record is None if the entry is not stored as a directory with data_axs.json
+    """
+    stamp           = stamp or entry_stamp( real_entry_path, __entry__ )
+    index_record    = indexed_entries.get( entry_name )
+
+    if not stamp:
+        return None, False
+    elif index_record and index_record["stamp"]==stamp and index_record["path"]==real_entry_path:
+        return index_record, False
+    else:
+        contained_entry = __entry__.get_kernel().bypath(path=real_entry_path, name=entry_name, container=__entry__)
+        index_record    = indexed_entries[entry_name] = make_index_record( contained_entry, real_entry_path, stamp )
+        return index_record, True
+
+
+class ColumnarIndex:
+    """A column-wise view of a collection's index, for evaluating query conditions on all the indexed entries at once as NumPy boolean masks.
+        Each tag gets a bitset, and each scalar param gets typed columns. Both are built from the index records on first use.
+        A row stands for the index record it was built from. Once that record has been replaced, the row is stale and the record is matched on its own.
+    """
+
+    COMPARISONS = { '<': operator.lt, '>': operator.gt, '<=': operator.le, '>=': operator.ge }
+
+    def __init__(self, indexed_entries):
+        self.indexed_entries    = indexed_entries
+        self.records            = list( indexed_entries.values() )
+        self.positions          = { entry_name: position for position, entry_name in enumerate( indexed_entries ) }
+        self.tag_positions      = {}    # tag -> [ position, ... ]
+        self.value_positions    = {}    # param_name -> [ (position, value), ... ]
+        self.opaque_positions   = {}    # param_name -> [ position, ... ]
+        self.bitsets            = {}
+        self.columns            = {}
+
+        for position, index_record in enumerate( self.records ):
+            for param_name, param_value in index_record["values"].items():
+                self.value_positions.setdefault( param_name, [] ).append( (position, param_value) )
+                if param_name=='tags' and type(param_value)==list:
+                    for tag in param_value:
+                        self.tag_positions.setdefault( tag, [] ).append( position )
+            for param_name in index_record["opaque"]:
+                self.opaque_positions.setdefault( param_name, [] ).append( position )
+
+
+    def bitset(self, tag):
+        "Whether each entry is tagged with the given tag"
+
+        if tag not in self.bitsets:
+            tagged = numpy.zeros( len(self.records), dtype=bool )
+            tagged[ self.tag_positions.get( tag, [] ) ] = True
+            self.bitsets[tag] = tagged
+
+        return self.bitsets[tag]
+
+
+    def param_columns(self, param_name):
+        """The typed columns of the given param: which entries have it set to None, to a number (and which one), or to a string (and which one),
+            which ones have it set to a list, and which ones have it set to something the index cannot decide on (opaque values, lists, huge integers).
+        """
+        if param_name not in self.columns:
+            row_count   = len(self.records)
+            is_none     = numpy.zeros( row_count, dtype=bool )
+            is_number   = numpy.zeros( row_count, dtype=bool )
+            is_string   = numpy.zeros( row_count, dtype=bool )
+            is_list     = numpy.zeros( row_count, dtype=bool )
+            undecidable = numpy.zeros( row_count, dtype=bool )
+            numbers     = numpy.full( row_count, numpy.nan )
+            strings     = numpy.full( row_count, '', dtype=object )
+
+            for position, param_value in self.value_positions.get( param_name, [] ):
+                if param_value is None:
+                    is_none[position] = True
+                elif type(param_value)==str:
+                    is_string[position], strings[position] = True, param_value
+                elif type(param_value) in (bool, float) or (type(param_value)==int and abs(param_value)<=FLOAT_exact_int_limit):
+                    is_number[position], numbers[position] = True, param_value
+                else:
+                    is_list[position] = type(param_value)==list
+                    undecidable[position] = True
+
+            undecidable[ self.opaque_positions.get( param_name, [] ) ] = True
+            self.columns[param_name] = ( is_none, is_number, numbers, is_string, strings, is_list, undecidable )
+
+        return self.columns[param_name]
+
+
+    def matching_mask(self, filter_list):
+        """Which of the indexed entries may match the pre-parsed query conditions, returned as a list of booleans.
+            Like FilterPile.matches_index_record() , it may pass some entries that do not match, but never rules out one that does
+        """
+        mask = numpy.ones( len(self.records), dtype=bool )
+
+        for condition in filter_list:
+            decidable = kernel_store.index_condition( *condition )
+            if not decidable:
+                continue
+
+            if decidable[0]=='tags':
+                _, op, val  = decidable
+                tagged      = self.bitset( val )
+                _, _, _, _, _, tags_listed, tags_undecidable = self.param_columns( 'tags' )
+                if op=='tag+':
+                    mask &= tagged | (tags_undecidable & ~tags_listed)
+                elif op=='tag-':
+                    mask &= ~tagged
+                else:
+                    mask &= tags_listed & ~tagged | (tags_undecidable & ~tags_listed)
+                continue
+
+            _, op, val, missing_ok = decidable
+            if type(val)==int and abs(val)>FLOAT_exact_int_limit:
+                continue
+
+            is_none, is_number, numbers, is_string, strings, _, undecidable = self.param_columns( condition[0] )
+            if op=='.':
+                hit = ~is_none
+            elif op=='!.':
+                hit = is_none
+            elif op in ('=', '!='):
+                hit = (is_string & (strings==val)) if type(val)==str else (is_number & (numbers==val))
+                if op=='!=':
+                    hit = ~hit
+            elif type(val)==str:
+                hit = is_number | (is_string & self.COMPARISONS[op]( strings, val ).astype(bool))    # comparing a number to a string is left to the proper matching
+            else:
+                hit = is_string | (is_number & self.COMPARISONS[op]( numbers, val ))
+
+            mask &= numpy.where( is_none | is_number | is_string, hit, undecidable | missing_ok )
+
+        return mask.tolist()
+
+
+    def verdict(self, entry_name, index_record, index_mask):
+        "The entry's element of the mask, or None if the entry has no row or its row is stale"
+
+        position = self.positions.get( entry_name )
+        if position is not None and self.records[position] is index_record:
+            return index_mask[position]
+        else:
+            return None
+
+
+def columnar_index(__entry__):
+    """An internal method that returns the ColumnarIndex of the collection's index,
+        or None if NumPy is not available or the index is too small to bother
+    """
+    global numpy
+
+    index_path      = __entry__.get_path( FILENAME_entry_index )
+    indexed_entries = entry_index(__entry__)
+
+    if len(indexed_entries)<COLUMNAR_min_entries:
+        return None
+
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:     # the index records are matched one at a time then
+            numpy = False
+    if numpy is False:
+        return None
+
+    columnar = columnar_indices.get( index_path )
+    if columnar is None or columnar.indexed_entries is not indexed_entries or len(columnar.records)!=len(indexed_entries):
+        columnar = columnar_indices[index_path] = ColumnarIndex( indexed_entries )
+        kernel_trace.trace( lambda: f"collection({__entry__.get_name()}): built the columnar view of {len(indexed_entries)} index records" )
+
+    return columnar
+
+
+def resolve_entry_path(real_collection_path, relative_entry_path):
+    """An internal method that returns the real path of a contained entry given the (already resolved) real path of its collection.
+        Only the components of the relative path are checked for symbolic links, which saves most of the system calls of os.path.realpath()
+    """
+    if os.path.isabs( relative_entry_path ):
+        return os.path.realpath( relative_entry_path )
+
+    base_path   = real_collection_path.rstrip( os.path.sep )
+    entry_path  = base_path + os.path.sep + relative_entry_path
+    prefix_end  = len( base_path )
+    for path_component in relative_entry_path.split( os.path.sep ):
+        prefix_end += 1 + len( path_component )
+        if path_component in ('', '.', '..') or os.path.islink( entry_path[:prefix_end] ):
+            return os.path.realpath( entry_path )
+
+    return entry_path
+
+
+def prefetch_threads():
+    "The number of threads reading the contained entries concurrently (AXS_LOAD_THREADS, 16 by default, 1 switches the prefetching off)"
+
+    try:
+        return int( os.getenv('AXS_LOAD_THREADS') or 16 )
+    except ValueError:
+        return 16
+
+
+def prefetch_contained_entries(contained_entries, indexed_entries, __entry__):
+    """An internal method for the cold start: resolves the paths of the contained entries that are not cached yet
+        and reads their data_axs.json files on a thread pool (skipping the ones whose index records are up to date),
+        then adds them to the kernel's entry_cache in one go. On a network file system the round trips then overlap.
+        Returns { entry_name: ( real_entry_path, stamp, whether_it_has_just_been_loaded ) } for the entries probed, or {} if there were too few to bother.
+    """
+    ak              = __entry__.get_kernel()
+    collection_path = __entry__.get_path()
+    real_collection_path = os.path.realpath( collection_path )
+    threads         = prefetch_threads()
+
+    uncached_paths  = {}
+    for entry_name, relative_entry_path in contained_entries.items():
+        entry_path = os.path.join( collection_path, relative_entry_path )
+        if entry_path not in ak.entry_cache:
+            uncached_paths[entry_name] = entry_path
+
+    if threads<=1 or len(uncached_paths)<PREFETCH_min_entries:
+        return {}
+
+    def probe(entry_name):
+        real_entry_path = resolve_entry_path( real_collection_path, contained_entries[entry_name] )
+        stamp           = entry_stamp( real_entry_path, __entry__ )
+        index_record    = indexed_entries.get( entry_name ) if indexed_entries else None
+        loaded_data     = None
+        if stamp and real_entry_path not in ak.entry_cache and not (index_record and index_record["stamp"]==stamp and index_record["path"]==real_entry_path):
+            try:
+                loaded_data = ufun.load_json( os.path.join( real_entry_path, __entry__.FILENAME_parameters ) )
+            except OSError:
+                pass    # to be reported when (if) the entry is actually loaded
+        return entry_name, real_entry_path, stamp, loaded_data
+
+    def probe_chunk(entry_names):
+        return [ probe( entry_name ) for entry_name in entry_names ]
+
+    uncached_names  = list( uncached_paths )
+    chunk_size      = -(-len(uncached_names) // (threads*PREFETCH_chunks_per_thread))
+    with ThreadPoolExecutor( max_workers=threads ) as pool:
+        probed_entries = [ probed_entry for probed_chunk in pool.map( probe_chunk, [ uncached_names[chunk_start:chunk_start+chunk_size] for chunk_start in range(0, len(uncached_names), chunk_size) ] )
+                                            for probed_entry in probed_chunk ]
+
+    ak.encache_prefetched( { real_entry_path: (entry_name, loaded_data) for entry_name, real_entry_path, _, loaded_data in probed_entries if type(loaded_data)==dict }, container=__entry__ )
+
+    kernel_trace.trace( lambda: f"collection({__entry__.get_name()}): prefetched {len(probed_entries)} contained entries on {threads} threads" )
+
+    return { entry_name: (real_entry_path, stamp, type(loaded_data)==dict) for entry_name, real_entry_path, stamp, loaded_data in probed_entries }
+
+
+def walk_store(store, skip_entry_names, index_filter, __entry__):
+    """An internal generator that yields the entries kept in the collection's store (see kernel_store), in the order of their creation.
+        If index_filter (a FilterPile) is given, only the ones that may match it according to the store are loaded,
+        plus the ones already in memory, as they may differ from their stored versions.
+    """
+    ak              = __entry__.get_kernel()
+    collection_path = os.path.realpath( __entry__.get_path() )
+
+    if index_filter:
+        cached_names    = [ cached_entry.get_name() for cached_entry in list( ak.entry_cache.values() ) if cached_entry.get_container() is __entry__ ]
+        entry_names     = store.matching_names( index_filter.filter_list, cached_names )
+    else:
+        entry_names     = store.names()
+
+    entry_names = [ entry_name for entry_name in entry_names if not (skip_entry_names and entry_name in skip_entry_names) ]
+    for chunk_start in range(0, len(entry_names), STORE_chunk_entries):
+        entry_paths     = { entry_name: os.path.join( collection_path, __entry__.fanned_out_path( entry_name ) ) for entry_name in entry_names[chunk_start:chunk_start+STORE_chunk_entries] }
+        uncached_names  = [ entry_name for entry_name, entry_path in entry_paths.items() if entry_path not in ak.entry_cache ]
+        if uncached_names:
+            ak.encache_prefetched( { entry_paths[entry_name]: (entry_name, loaded_data) for entry_name, loaded_data in store.load_many( uncached_names ).items() }, container=__entry__ )
+
+        for entry_name, entry_path in entry_paths.items():
+            yield ak.bypath(path=entry_path, name=entry_name, container=__entry__)
+
+
+def walk(__entry__, skip_entry_names=None, index_filter=None):
     """An internal recursive generator not to be called directly
+
+        If index_filter (a FilterPile) is given, the contained entries that are not loaded yet
+        and whose up-to-date index records rule them out are skipped without being loaded.
+        The entries kept in the collection's store (if it has one) are filtered by the store itself.
     """
     ak = __entry__.get_kernel()
     assert ak != None, "__entry__'s kernel should be defined"
     collection_own_name = __entry__.get_name()
 
+    indexed_entries = entry_index(__entry__) if index_filter else None
+    real_collection_path = os.path.realpath( __entry__.get_path() ) if index_filter else None
+    columnar        = columnar_index(__entry__) if index_filter else None
+    index_mask      = columnar.matching_mask( index_filter.filter_list ) if columnar else None
+    index_changed   = False
+
     seen_entry_names = set()
     try:
-        logging.debug(f"collection({collection_own_name}): yielding the collection itself")
+        kernel_trace.trace( lambda: f"collection({collection_own_name}): yielding the collection itself" )
         yield __entry__
 
-        logging.debug(f"collection({collection_own_name}): walking contained_entries:")
+        kernel_trace.trace( lambda: f"collection({collection_own_name}): walking contained_entries:" )
         contained_entries = __entry__.get('contained_entries', {})
+        prefetched_paths  = prefetch_contained_entries( contained_entries, indexed_entries, __entry__ ) if not skip_entry_names else {}
         for entry_name in contained_entries:
             if skip_entry_names and (entry_name in skip_entry_names):
                 continue
 
             relative_entry_path = contained_entries[entry_name]
-            logging.debug(f"collection({collection_own_name}): mapping {entry_name} to relative_entry_path={relative_entry_path}")
+            if kernel_trace.enabled:
+                logging.debug(f"collection({collection_own_name}): mapping {entry_name} to relative_entry_path={relative_entry_path}")
+
+            real_entry_path, stamp, prefetched = prefetched_paths.get( entry_name, (None, None, False) )
+
+            if index_filter:
+                real_entry_path = real_entry_path or resolve_entry_path( real_collection_path, relative_entry_path )
+
+                if prefetched or real_entry_path not in ak.entry_cache:     # entries already in memory are matched directly, as they may differ from their stored versions
+                    index_record, rebuilt = up_to_date_index_record( entry_name, real_entry_path, indexed_entries, __entry__, stamp )
+                    index_changed = index_changed or rebuilt
 
-            contained_entry = ak.bypath(path=__entry__.get_path(relative_entry_path), name=entry_name, container=__entry__)
+                    if index_record and not rebuilt and not index_record["collection"]:
+                        index_verdict = columnar.verdict( entry_name, index_record, index_mask ) if columnar else None
+                        if index_verdict is None:
+                            index_verdict = index_filter.matches_index_record( index_record )
+                    else:
+                        index_verdict = True
+
+                    if not index_verdict:
+                        if kernel_trace.enabled:
+                            logging.debug(f"collection({collection_own_name}): skipping {entry_name} as ruled out by the index")
+                        seen_entry_names.add( entry_name )
+                        continue
+
+            entry_path      = real_entry_path or __entry__.get_path(relative_entry_path)
+            contained_entry = ak.bypath(path=entry_path, name=entry_name, container=__entry__)
 
             # Have to resort to duck typing to avoid triggering dependencies by testing if contained_entry.can('walk'):
             if 'contained_entries' in contained_entry.own_data():
-                logging.debug(f"collection({collection_own_name}): recursively walking collection {entry_name}...")
-                yield from walk(contained_entry)
+                kernel_trace.trace( lambda: f"collection({collection_own_name}): recursively walking collection {entry_name}..." )
+                yield from walk(contained_entry, index_filter=index_filter)
                 contained_entry.touch('_BEFORE_CODE_LOADING')
             else:
-                logging.debug(f"collection({collection_own_name}): yielding non-collection {entry_name}")
+                if kernel_trace.enabled:
+                    logging.debug(f"collection({collection_own_name}): yielding non-collection {entry_name}")
                 yield contained_entry
             seen_entry_names.add( entry_name )
 
+        store = kernel_store.store_for( __entry__ )
+        if store:
+            kernel_trace.trace( lambda: f"collection({collection_own_name}): walking the entries kept in {store.store_path}" )
+            yield from walk_store( store, skip_entry_names, index_filter, __entry__ )
+
     except RuntimeError as e:
         if str(e)=="dictionary changed size during iteration":
             print(f"Collection {__entry__.get_name()} modified under iteration, checking the new ones")
-            yield from walk(__entry__, seen_entry_names)
+            yield from walk(__entry__, seen_entry_names, index_filter)
         else:
             raise e
 
+    finally:
+        if index_changed:
+            save_entry_index(__entry__)
+
+
+def update_index(__entry__):
+    """Bring the on-disk indices of the collection and its sub-collections up to date with the entries' data_axs.json files.
+        Normally the indices are updated on the fly by queries, so this is only a way to warm them up.
+
+Usage examples :
+                axs work_collection , update_index
+    """
+    return len([ indexed_entry for indexed_entry in walk(__entry__, index_filter=FilterPile([], "Index update")) ])
+
+
+def collect_entry_names(collection_entry, container_path, name_table, duplicate_names, collection_stamps):
+    """An internal recursive method not to be called directly: maps the names of the collection and its contained entries
+        to their real paths and the real paths of their containers, keeping the first occurrence in walk() order.
+        Only the sub-collections (and the entries missing from the index) need to be loaded.
+    """
+    ak                  = collection_entry.get_kernel()
+    collection_path     = os.path.realpath( collection_entry.get_path() )
+    parameters_path     = collection_entry.get_parameters_path()
+
+    def register_name(entry_name, entry_path, container_path):
+        if entry_name in name_table:
+            duplicate_names.add( entry_name )
+        else:
+            name_table[entry_name] = [ entry_path, container_path ]
+
+    collection_stamps[parameters_path] = collection_entry.data_stamp( parameters_path )
+    register_name( collection_entry.get_name(), collection_path, container_path )
+
+    indexed_entries     = entry_index( collection_entry )
+    index_changed       = False
+    contained_entries   = collection_entry.get('contained_entries', {})
+    prefetched_paths    = prefetch_contained_entries( contained_entries, indexed_entries, collection_entry )
+    for entry_name in contained_entries:
+        real_entry_path, stamp, prefetched = prefetched_paths.get( entry_name, (None, None, False) )
+        real_entry_path = real_entry_path or resolve_entry_path( collection_path, contained_entries[entry_name] )
+
+        if real_entry_path in ak.entry_cache and not prefetched:
+            is_collection = 'contained_entries' in ak.entry_cache[real_entry_path].own_data()
+        else:
+            index_record, rebuilt = up_to_date_index_record( entry_name, real_entry_path, indexed_entries, collection_entry, stamp )
+            index_changed = index_changed or rebuilt
+            if index_record:
+                is_collection = index_record["collection"]
+            else:
+                is_collection = 'contained_entries' in ak.bypath(path=real_entry_path, name=entry_name, container=collection_entry).own_data()
+
+        if is_collection:
+            contained_collection = ak.bypath(path=real_entry_path, name=entry_name, container=collection_entry)
+            collect_entry_names( contained_collection, collection_path, name_table, duplicate_names, collection_stamps )
+        else:
+            register_name( entry_name, real_entry_path, collection_path )
+
+    store = kernel_store.store_for( collection_entry )
+    if store:
+        collection_stamps[store.stamp_path] = collection_entry.data_stamp( store.stamp_path )
+        for entry_name in store.names():
+            register_name( entry_name, os.path.join( collection_path, collection_entry.fanned_out_path( entry_name ) ), collection_path )
+
+    if index_changed:
+        save_entry_index( collection_entry )
+
+
+def entry_name_table(__entry__):
+    """Map the names of the collection and all the entries in it (recursively) to their paths and the paths of their containers.
+        Also returns the names found more than once and the fingerprints of all the walked collections' data_axs.json files.
+        Used by the kernel's byname() .
+
+Usage examples :
+                axs work_collection , entry_name_table , get names , keys ,0 func len
+    """
+    name_table, duplicate_names, collection_stamps = {}, set(), {}
+
+    collect_entry_names( __entry__, None, name_table, duplicate_names, collection_stamps )
+
+    return { "names": name_table, "duplicates": sorted(duplicate_names), "stamps": collection_stamps }
+
+
 def attached_entry(entry_path=None, own_data=None, generated_name_prefix=None, __entry__=None):
     """Create a new entry with the given name and attach it to this collection
 
@@ -207,9 +695,40 @@ class FilterPile:
         return candidate_still_ok
 
 
-def all_byquery(query, pipeline=None, template=None, parent_recursion=False, __entry__=None):
+    def matches_index_record(self, index_record):
+        """Pre-match the entry's index record (own scalar params and tags only, no parent recursion).
+            Returns False only if the entry certainly does not match, otherwise it has to be loaded and matched properly.
+        """
+        known_values    = index_record["values"]
+        opaque_names    = index_record["opaque"]
+
+        for key_path, op, val, query_comparison_lambda, split_key_path in self.filter_list:
+            param_name = split_key_path[0]
+
+            if (not param_name) or (param_name in opaque_names) or param_name=='__entry__':
+                continue                                # cannot be decided from the index
+            elif param_name in known_values:
+                if len(split_key_path)>1:
+                    continue                            # digging into a scalar is left to the proper matching
+                candidate_value = known_values[param_name]
+            else:
+                candidate_value = None                  # the same as what dig(safe=True) returns for a missing param
+
+            try:
+                if not query_comparison_lambda( candidate_value ):
+                    return False
+            except TypeError:
+                continue                                # let the proper matching deal with incomparable values
+
+        return True
+
+
+def all_byquery(query, pipeline=None, template=None, parent_recursion=False, jobs=None, __entry__=None):
     """Returns a list of ALL entries matching the query.
         Empty list if nothing matched.
+        With --jobs=N the pipeline (or the template) is applied to the matched entries in up to N worker processes,
+        the results are returned in the same order, and the entries that failed are reported individually
+        (leaving None in their place in the list of results, but left out of the text joined with --template).
 
 Usage examples :
                 axs all_byquery onnx_model
@@ -218,80 +737,152 @@ Usage examples :
                 axs all_byquery python_package --template="python_#{python_version}# package #{package_name}#"
                 axs all_byquery tags. --template="tags=#{tags}#"
                 axs all_byquery deleteme+ ---='[["remove"]]'
+                axs all_byquery git_repo ---='[["pull"]]' --jobs=8
     """
     assert __entry__ != None, "__entry__ should be defined"
 
     parsed_query        = FilterPile( query, "Query" )
 
-    # trying to match the Query in turn against each existing and walkable entry, gathering them all:
-    result_list = []
-    for candidate_entry in walk(__entry__):
-        if parsed_query.matches_entry( candidate_entry, parent_recursion ):
-            if pipeline:
-                single_result = candidate_entry.execute(pipeline)
-            elif template is not None:
-                single_result = str(candidate_entry.substitute(template))
-            else:
-                single_result = candidate_entry
+    if jobs and (pipeline or template is not None) and kernel_scheduler.can_fork():
+        matched_entries = [ candidate_entry for candidate_entry in walk(__entry__, index_filter=None if parent_recursion else parsed_query)
+                                                if parsed_query.matches_entry( candidate_entry, parent_recursion ) ]
+        result_list     = apply_in_workers( matched_entries, pipeline, template, None if jobs is True else int(jobs), __entry__ )
+
+    else:
+        # trying to match the Query in turn against each existing and walkable entry, gathering them all:
+        result_list = []
+        for candidate_entry in walk(__entry__, index_filter=None if parent_recursion else parsed_query):
+            if parsed_query.matches_entry( candidate_entry, parent_recursion ):
+                if pipeline:
+                    single_result = candidate_entry.execute(pipeline)
+                elif template is not None:
+                    single_result = str(candidate_entry.substitute(template))
+                else:
+                    single_result = candidate_entry
 
-            result_list.append( single_result )
+                result_list.append( single_result )
 
     if template is not None:
-        return "\n".join( result_list )
+        return "\n".join( str(single_result) for single_result in result_list )
     else:
         return result_list
 
 
+def apply_in_workers(matched_entries, pipeline, template, jobs, __entry__):
+    """An internal method that applies the pipeline (or the template) to each of the matched entries in worker processes.
+        The entries among the results are passed back by reference and looked up again, after picking up the changes made by the workers.
+    """
+    def apply_to(candidate_entry):
+        single_result = candidate_entry.execute(pipeline) if pipeline else str(candidate_entry.substitute(template))
+        if single_result is candidate_entry:
+            return { "same_entry": True }
+        else:
+            pickled_result = candidate_entry.pickle_struct( single_result )
+            return { "value": pickled_result, "has_entries": pickled_result!=single_result }
+
+    ak          = __entry__.get_kernel()
+    stamps      = kernel_scheduler.cached_data_stamps( ak )
+    outcomes    = kernel_scheduler.map_in_workers( apply_to, matched_entries, jobs )
+    kernel_scheduler.reload_changed_entries( ak, stamps )
+
+    result_list = []
+    for candidate_entry, (succeeded, details) in zip(matched_entries, outcomes):
+        if not succeeded:
+            logging.error(f"[{__entry__.get_name()}] Applying {pipeline or template} to {candidate_entry.get_name()} has failed: {details}")
+            if template is None:
+                result_list.append( None )      # keeping the positions of the results, but a joined text would show it as if substituted
+        elif details.get("same_entry"):
+            result_list.append( candidate_entry )
+        elif details["has_entries"]:
+            result_list.append( ak.nested_calls( details["value"] ) )
+        else:
+            result_list.append( details["value"] )
+
+    failed_count = sum( 1 for succeeded, _ in outcomes if not succeeded )
+    if failed_count:
+        logging.error(f"[{__entry__.get_name()}] {failed_count} out of {len(matched_entries)} entries have failed")
+
+    return result_list
+
+
+def producer_rule_index(__entry__):
+    """Pre-parse all the _producer_rules advertised within the collection (recursively), grouping them by their positive tag sets.
+        Also returns the fingerprints of the walked collections' and the advertising entries' data_axs.json files.
+        Used by find_matching_rules() via the kernel's rule_index() .
+
+Usage examples :
+                axs work_collection , producer_rule_index , get rules_by_tags , keys ,0 func len
+    """
+    rules_by_tags   = {}
+    stamps          = {}
+    rule_order      = 0     # the order of advertisement, to be retained among the matching rules
+
+    for advertising_entry in walk(__entry__, index_filter=FilterPile("_producer_rules.", "Rule indexing")):
+        own_data = advertising_entry.own_data()
+
+        if ('contained_entries' in own_data) or ('_producer_rules' in own_data):
+            parameters_path = advertising_entry.get_parameters_path()
+            stamps[parameters_path] = advertising_entry.data_stamp( parameters_path )
+
+        for unprocessed_rule in own_data.get('_producer_rules', []):        # block processing some params until they are really needed
+            parsed_rule     = FilterPile( advertising_entry.nested_calls( unprocessed_rule[0] ), f"Entry: {advertising_entry.get_name()}" )
+
+            rules_by_tags.setdefault( frozenset(parsed_rule.posi_tag_set), [] ).append( (rule_order, advertising_entry, unprocessed_rule, parsed_rule) )
+            rule_order += 1
+
+    return { "rules_by_tags": rules_by_tags, "stamps": stamps }
+
+
 def find_matching_rules(parsed_query, __entry__):
     """An internal method for finding matching rules given a query, not to be called directly
     """
-    matching_rules = []
-    for advertising_entry in walk(__entry__):
-        for unprocessed_rule in advertising_entry.own_data().get('_producer_rules', []):        # block processing some params until they are really needed
-            parsed_rule     = FilterPile( advertising_entry.nested_calls( unprocessed_rule[0] ), f"Entry: {advertising_entry.get_name()}" )
+    rules_by_tags   = __entry__.get_kernel().rule_index( __entry__ )
+    candidate_rules = sorted( (indexed_rule  for rule_tag_set in rules_by_tags if rule_tag_set.issubset(parsed_query.posi_tag_set)    # FIXME:  parsed_rule.posi_tag_set should include it
+                                             for indexed_rule in rules_by_tags[rule_tag_set]), key = lambda x: x[0] )
 
-            if parsed_rule.posi_tag_set.issubset(parsed_query.posi_tag_set):  # FIXME:  parsed_rule.posi_tag_set should include it
-                qr_conditions_ok  = True
+    matching_rules = []
+    for _, advertising_entry, unprocessed_rule, parsed_rule in candidate_rules:
+        qr_conditions_ok  = True
 
-                # first matching rule's conditions against query's values:
-                for key_path, op, rule_val, rule_comparison_lambda, _ in parsed_rule.filter_list:
+        # first matching rule's conditions against query's values:
+        for key_path, op, rule_val, rule_comparison_lambda, _ in parsed_rule.filter_list:
 
-                    if op=='tag+': continue     # we have matched them directly above
+            if op=='tag+': continue     # we have matched them directly above
 
-                    if op=='tag-':  # rule doesn't want the query to contain a certain tag
-                        qr_conditions_ok = rule_val not in parsed_query.posi_tag_set
-                        break
+            if op=='tag-':  # rule doesn't want the query to contain a certain tag
+                qr_conditions_ok = rule_val not in parsed_query.posi_tag_set
+                break
 
-                    # we allow (only) equalities on the rule side not to have a match on the query side
-                    elif (key_path in parsed_query.posi_val_dict):    # does the query contain a specific value for this rule condition's key_path?
-                        qr_conditions_ok = rule_comparison_lambda( parsed_query.posi_val_dict[key_path] )       # if so, use this value in evaluating this rule condition
-                    else:
-                        qr_conditions_ok = (((op=='?=') and (key_path not in parsed_query.mentioned_set)) or    # ignore optional(selective) matches
-                                            ((op=='!.') and (key_path not in parsed_query.mentioned_set)) or
-                                            ((op=='=') and (key_path in parsed_query.mentioned_set)))           # otherwise if this rule condition sets a value, the query should have a corresponding condition to check (later)
+            # we allow (only) equalities on the rule side not to have a match on the query side
+            elif (key_path in parsed_query.posi_val_dict):    # does the query contain a specific value for this rule condition's key_path?
+                qr_conditions_ok = rule_comparison_lambda( parsed_query.posi_val_dict[key_path] )       # if so, use this value in evaluating this rule condition
+            else:
+                qr_conditions_ok = (((op=='?=') and (key_path not in parsed_query.mentioned_set)) or    # ignore optional(selective) matches
+                                    ((op=='!.') and (key_path not in parsed_query.mentioned_set)) or
+                                    ((op=='=') and (key_path in parsed_query.mentioned_set)))           # otherwise if this rule condition sets a value, the query should have a corresponding condition to check (later)
 
-                    if not qr_conditions_ok: break
+            if not qr_conditions_ok: break
 
-                if qr_conditions_ok:
-                    # then matching query's conditions against rule's values:
-                    for key_path, op, query_val, query_comparison_lambda, _ in parsed_query.filter_list:
+        if qr_conditions_ok:
+            # then matching query's conditions against rule's values:
+            for key_path, op, query_val, query_comparison_lambda, _ in parsed_query.filter_list:
 
-                        if op=='tag+': continue     # we have matched them directly above
+                if op=='tag+': continue     # we have matched them directly above
 
-                        if op=='tag-':  # query doesn't want the rule to contain a certain tag
-                            qr_conditions_ok = query_val not in parsed_rule.posi_tag_set
-                            break
+                if op=='tag-':  # query doesn't want the rule to contain a certain tag
+                    qr_conditions_ok = query_val not in parsed_rule.posi_tag_set
+                    break
 
-                        # we allow (only) equalities on the query side not to have a match on the rule side
-                        elif (key_path in parsed_rule.posi_val_dict): # does the rule contain a specific value for this query condition's key_path?
-                            qr_conditions_ok = query_comparison_lambda( parsed_rule.posi_val_dict[key_path] )   # if so, use this value in evaluating this query condition
-                        else:
-                            qr_conditions_ok = (op=='=')                                                        # otherwise this query condition must set a value
+                # we allow (only) equalities on the query side not to have a match on the rule side
+                elif (key_path in parsed_rule.posi_val_dict): # does the rule contain a specific value for this query condition's key_path?
+                    qr_conditions_ok = query_comparison_lambda( parsed_rule.posi_val_dict[key_path] )   # if so, use this value in evaluating this query condition
+                else:
+                    qr_conditions_ok = (op=='=')                                                        # otherwise this query condition must set a value
 
-                        if not qr_conditions_ok: break
+                if not qr_conditions_ok: break
 
-                if qr_conditions_ok:
-                    matching_rules.append( (advertising_entry, unprocessed_rule, parsed_rule) )
+        if qr_conditions_ok:
+            matching_rules.append( (advertising_entry, unprocessed_rule, parsed_rule) )
 
     return sorted( matching_rules, key = lambda x: len(x[1][0]), reverse=True)
 
@@ -329,81 +920,273 @@ Usage examples :
 
     parsed_query        = FilterPile( query, "Query" )
     if not parsed_query.filter_list:
-        logging.debug(f"[{__entry__.get_name()}] the query was empty => returning None")
+        kernel_trace.trace( lambda: f"[{__entry__.get_name()}] the query was empty => returning None" )
         return None
 
-    # trying to match the Query in turn against each existing and walkable entry, first match returns:
-    for candidate_entry in walk(__entry__):
-        if parsed_query.matches_entry( candidate_entry, parent_recursion ):
-            if candidate_entry.get('__completed', True):    # either explicitly completed, or not carrying this attribute at all, probably a static Entry
-                return candidate_entry
-            else:
-                logging.info(f"[{__entry__.get_name()}] byquery({query}) found incomplete Entry {candidate_entry.get_name()} in {candidate_entry.get_path()} , which may either be in progress or dead - PLEASE INVESTIGATE")
-                return None     # FIXME: we cannot yet distinguish between a botched installation and a still-running one
-
-    # if a matching entry does not exist, see if we can produce it with a matching Rule
-    if produce_if_not_found and len(parsed_query.posi_tag_set):
-        logging.info(f"[{__entry__.get_name()}] byquery({query}) did not find anything, but there are tags: {parsed_query.posi_tag_set} , trying to find a producer...")
-
-        matching_rules = find_matching_rules(parsed_query, __entry__)
-        logging.info(f"[{__entry__.get_name()}] A total of {len(matching_rules)} matched rules found.\n")
-
-        match_idx = 0
-        for advertising_entry, unprocessed_rule, parsed_rule in matching_rules:
-            match_idx += 1  # matches are 1-based
-            logging.info(f"Matched Rule #{match_idx}/{len(matching_rules)}: {unprocessed_rule[0]} from Entry '{advertising_entry.get_name()}'...")
-
-            rule_vector         = advertising_entry.nested_calls(unprocessed_rule)
-            producer_pipeline   = rule_vector[1]
-            extra_params        = rule_vector[2] if len(rule_vector)>2 else {}
-            export_params       = rule_vector[3] if len(rule_vector)>3 else []
-
-            cumulative_params = advertising_entry.slice( *export_params )   # default slice
-            cumulative_params["__query"] = query                            # NB: unparsed query in its original format, DANGER!
-            cumulative_params.update( parsed_rule.opti_val_dict )           # optional matches on top (may override some defaults)
-            cumulative_params.update( deepcopy( extra_params ) )            # extra_params on top (may override some defaults)
-            cumulative_params.update( parsed_rule.posi_val_dict )           # rules on top (may override some defaults)
-            cumulative_params.update( parsed_query.posi_val_dict )          # query on top (may override some defaults)
-            cumulative_params["tags"] = list(parsed_query.posi_tag_set)     # FIXME:  parsed_rule.posi_tag_set should include it
-            if type(produce_if_not_found)==dict:
-                cumulative_params.update( produce_if_not_found )            # highest priority override only in case there was no match and we are generating
-            cumulative_params["__cumulative_param_names"] = list( cumulative_params.keys() )
-            logging.info(f"Pipeline: {producer_pipeline}, Cumulative params: {cumulative_params}")
-
-            if type(producer_pipeline[0])==list:
-                new_entry = advertising_entry.execute(producer_pipeline, cumulative_params)
-            elif len(producer_pipeline)<3:
-                producer_call_params_iter   = iter(producer_pipeline)
-                producer_action_name        = next(producer_call_params_iter)
-                producer_pos_params         = next(producer_call_params_iter, [])
-                new_entry                   = advertising_entry.call( producer_action_name, producer_pos_params, cumulative_params )
-            else:
-                raise SyntaxError(f"Rule parsing error: a single-call action with its own named parameters is ambiguous: {producer_pipeline}")
-
-            if new_entry:
-                if not isinstance(new_entry, type(__entry__)):
-                    raise RuntimeError( f"Matched Rule #{match_idx}/{len(matching_rules)} produced something ( {repr(new_entry)} ), which is not an Entry - PLEASE INVESTIGATE" )
-                elif parsed_query.matches_entry( new_entry, parent_recursion ):
-                    logging.info(f"Matched Rule #{match_idx}/{len(matching_rules)} produced an entry, which matches the original query, finalizing...\n")
-                    new_entry.save( on_collision="force", completed=ufun.generate_current_timestamp() )   # we expect a collision
-                    return new_entry
-                else:
-                    raise RuntimeError( f"Matched Rule #{match_idx}/{len(matching_rules)} produced an entry, but it failed to match the original query {query} - PLEASE INVESTIGATE" )
+    lease_token = None
+    lease_path  = None      # held while producing, so that the other processes needing the same entry wait for it rather than race
+    try:
+        while True:
+            waiting_for = None
+
+            # trying to match the Query in turn against each existing and walkable entry, first match returns:
+            for candidate_entry in walk(__entry__, index_filter=None if parent_recursion else parsed_query):
+                if parsed_query.matches_entry( candidate_entry, parent_recursion ):
+                    if candidate_entry.get('__completed', True):    # either explicitly completed, or not carrying this attribute at all, probably a static Entry
+                        return candidate_entry
+
+                    candidate_lease = candidate_entry.get('__lease')
+                    if not candidate_lease:
+                        logging.info(f"[{__entry__.get_name()}] byquery({query}) found incomplete Entry {candidate_entry.get_name()} in {candidate_entry.get_path()} , which may either be in progress or dead - PLEASE INVESTIGATE")
+                        return None     # produced without a lease, so we cannot tell a botched installation from a still-running one
+                    elif not kernel_lease.is_live( *candidate_lease ):
+                        logging.warning(f"[{__entry__.get_name()}] byquery({query}) skips incomplete Entry {candidate_entry.get_name()} in {candidate_entry.get_path()} , whose producer is no longer running - PLEASE INVESTIGATE")
+                    elif candidate_lease[0] in kernel_lease.held_leases:
+                        logging.info(f"[{__entry__.get_name()}] byquery({query}) found incomplete Entry {candidate_entry.get_name()} , which this process is still producing")
+                        return None
+                    else:
+                        waiting_for = candidate_lease[0]
+                        break
+
+            if waiting_for is None:
+                if lease_path or not (produce_if_not_found and len(parsed_query.posi_tag_set)):
+                    break
+
+                matching_rules = find_matching_rules(parsed_query, __entry__)
+                if not matching_rules:
+                    break
+
+                lease_path  = kernel_lease.lease_path_for( parsed_query.conditions, __entry__.get_path() )
+                lease_token = kernel_lease.acquire( lease_path, f"byquery({query})" )
+                if lease_token==kernel_lease.TOKEN_unleased:
+                    break
+                elif lease_token:
+                    __entry__.reload()  # one more look: the previous holder may have just attached the entry
+                    continue
+
+                waiting_for, lease_path = lease_path, None
+
+            stamps = kernel_scheduler.cached_data_stamps( __entry__.get_kernel() )
+            kernel_lease.wait_for_release( waiting_for )
+            kernel_scheduler.reload_changed_entries( __entry__.get_kernel(), stamps )
+
+        # if a matching entry does not exist, see if we can produce it with a matching Rule
+        if lease_token==kernel_lease.TOKEN_unleased:
+            return produce_byquery(query, parsed_query, matching_rules, produce_if_not_found, parent_recursion, None, __entry__)
+        elif lease_path:
+            return produce_byquery(query, parsed_query, matching_rules, produce_if_not_found, parent_recursion, [ lease_path, lease_token ], __entry__)
+        else:
+            kernel_trace.trace( lambda: f"[{__entry__.get_name()}] byquery({query}) did not find anything, and no matching _producer_rules => returning None" )
+            return None
+    finally:
+        if lease_path:
+            __entry__.get_kernel().sync()   # the completed entry should be on disk before the waiting processes look for it
+            kernel_lease.release( lease_path )
+
+
+def produce_byquery(query, parsed_query, matching_rules, produce_if_not_found, parent_recursion, lease, __entry__):
+    """An internal method that applies the matching producer_rules in turn until one of them produces an entry matching the query.
+        The lease (if there is one) is passed on to the new entry, so that the others can tell whether its production is still going on.
+    """
+    logging.info(f"[{__entry__.get_name()}] byquery({query}) did not find anything, but there are tags: {parsed_query.posi_tag_set} , trying to find a producer...")
+    logging.info(f"[{__entry__.get_name()}] A total of {len(matching_rules)} matched rules found.\n")
+
+    match_idx = 0
+    for advertising_entry, unprocessed_rule, parsed_rule in matching_rules:
+        match_idx += 1  # matches are 1-based
+        logging.info(f"Matched Rule #{match_idx}/{len(matching_rules)}: {unprocessed_rule[0]} from Entry '{advertising_entry.get_name()}'...")
+
+        rule_vector         = advertising_entry.nested_calls(unprocessed_rule)
+        producer_pipeline   = rule_vector[1]
+        extra_params        = rule_vector[2] if len(rule_vector)>2 else {}
+        export_params       = rule_vector[3] if len(rule_vector)>3 else []
+
+        cumulative_params = advertising_entry.slice( *export_params )   # default slice
+        cumulative_params["__query"] = query                            # NB: unparsed query in its original format, DANGER!
+        if lease:
+            cumulative_params["__lease"] = lease                        # the incomplete entry tells the others who is producing it
+        cumulative_params.update( parsed_rule.opti_val_dict )           # optional matches on top (may override some defaults)
+        cumulative_params.update( deepcopy( extra_params ) )            # extra_params on top (may override some defaults)
+        cumulative_params.update( parsed_rule.posi_val_dict )           # rules on top (may override some defaults)
+        cumulative_params.update( parsed_query.posi_val_dict )          # query on top (may override some defaults)
+        cumulative_params["tags"] = list(parsed_query.posi_tag_set)     # FIXME:  parsed_rule.posi_tag_set should include it
+        if type(produce_if_not_found)==dict:
+            cumulative_params.update( produce_if_not_found )            # highest priority override only in case there was no match and we are generating
+        cumulative_params["__cumulative_param_names"] = list( cumulative_params.keys() )
+        logging.info(f"Pipeline: {producer_pipeline}, Cumulative params: {cumulative_params}")
+
+        if type(producer_pipeline[0])==list:
+            new_entry = advertising_entry.execute(producer_pipeline, cumulative_params)
+        elif len(producer_pipeline)<3:
+            producer_call_params_iter   = iter(producer_pipeline)
+            producer_action_name        = next(producer_call_params_iter)
+            producer_pos_params         = next(producer_call_params_iter, [])
+            new_entry                   = advertising_entry.call( producer_action_name, producer_pos_params, cumulative_params )
+        else:
+            raise SyntaxError(f"Rule parsing error: a single-call action with its own named parameters is ambiguous: {producer_pipeline}")
+
+        if new_entry:
+            if not isinstance(new_entry, type(__entry__)):
+                raise RuntimeError( f"Matched Rule #{match_idx}/{len(matching_rules)} produced something ( {repr(new_entry)} ), which is not an Entry - PLEASE INVESTIGATE" )
+            elif parsed_query.matches_entry( new_entry, parent_recursion ):
+                logging.info(f"Matched Rule #{match_idx}/{len(matching_rules)} produced an entry, which matches the original query, finalizing...\n")
+                new_entry.save( on_collision="force", completed=ufun.generate_current_timestamp() )   # we expect a collision
+                return new_entry
             else:
-                logging.info(f"Matched Rule #{match_idx}/{len(matching_rules)} didn't produce a result, {len(matching_rules)-match_idx} more matched rules to try...\n")
+                raise RuntimeError( f"Matched Rule #{match_idx}/{len(matching_rules)} produced an entry, but it failed to match the original query {query} - PLEASE INVESTIGATE" )
+        else:
+            logging.info(f"Matched Rule #{match_idx}/{len(matching_rules)} didn't produce a result, {len(matching_rules)-match_idx} more matched rules to try...\n")
+
+    return None
+
 
+@contextmanager
+def membership_lock(__entry__, exclusive=False):
+    """An internal context manager that coordinates the processes updating the collection's membership:
+        appending to the journal takes a shared lock, folding the journal into data_axs.json takes an exclusive one.
+        The lock is re-entrant within a thread: taking it again is free, except that a shared lock is upgraded for the duration.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    lock_key    = ( __entry__.get_path( FILENAME_membership_lock ), threading.get_ident() )
+    held_lock   = held_membership_locks.get( lock_key )
+    if held_lock:
+        upgrade = exclusive and not held_lock[1]
+        if upgrade:
+            fcntl.flock( held_lock[0], fcntl.LOCK_EX )
+            held_lock[1] = True
+        try:
+            yield
+        finally:
+            if upgrade:
+                fcntl.flock( held_lock[0], fcntl.LOCK_SH )
+                held_lock[1] = False
+        return
+
+    with open( lock_key[0], 'a' ) as lock_fd:
+        fcntl.flock( lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH )
+        held_membership_locks[ lock_key ] = [ lock_fd, exclusive ]
+        try:
+            yield
+        finally:
+            del held_membership_locks[ lock_key ]
+            fcntl.flock( lock_fd, fcntl.LOCK_UN )
+
+
+def append_membership_record(membership_record, __entry__, durable=False):
+    """An internal method that appends one attach/detach record to the collection's membership journal.
+        In the write-behind mode the records are collected and appended together at the next sync point,
+        unless the record is durable, which is appended (and synced to the disk) at once, together with any records still pending.
+    """
+    journal_path    = __entry__.get_path( __entry__.FILENAME_membership_journal )
+    pending_records = pending_membership_records.setdefault( journal_path, [] )
+    pending_records.append( membership_record )
+
+    if durable:
+        write_membership_records(__entry__, compact_if_large=False, durable=True)
+    elif stored_entry.write_behind():
+        if len(pending_records)==1:
+            stored_entry.defer_write( journal_path, lambda: write_membership_records(__entry__) )
     else:
-        logging.debug(f"[{__entry__.get_name()}] byquery({query}) did not find anything, and no matching _producer_rules => returning None")
-        return None
+        write_membership_records(__entry__)
+
+
+def write_membership_records(__entry__, compact_if_large=True, durable=False):
+    """An internal method that appends the pending membership records to the journal in one go (synced to the disk if durable or flushing the deferred writes),
+        and folds the journal into data_axs.json once it has outgrown the latter (keeping the cost of the rewrites linear overall).
+    """
+    journal_path    = __entry__.get_path( __entry__.FILENAME_membership_journal )
+    pending_records = pending_membership_records.pop( journal_path, None )
+    stored_entry.discard_deferred_write( journal_path )
+    if not pending_records:
+        return
+
+    with membership_lock(__entry__):
+        journal_fd = os.open( journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644 )
+        try:
+            os.write( journal_fd, "".join( json.dumps( membership_record )+"\n" for membership_record in pending_records ).encode('utf-8') )  # a single write in append mode does not interleave with the others'
+            if durable or stored_entry.flushing_deferred:
+                os.fsync( journal_fd )
+        finally:
+            os.close( journal_fd )
+
+    if not compact_if_large:
+        return
+
+    journal_stamp       = ufun.file_stamp( journal_path )
+    parameters_stamp    = ufun.file_stamp( __entry__.get_parameters_path() )
+    if journal_stamp and parameters_stamp and journal_stamp[1] > max( JOURNAL_compaction_min_size, parameters_stamp[1] ):
+        compact_membership(__entry__)
+
+
+def compact_membership(__entry__):
+    """Fold the membership journal into the collection's data_axs.json .
+        This also happens automatically whenever the journal grows larger than data_axs.json .
+
+Usage examples :
+                axs work_collection , compact_membership
+    """
+    parameters_path = __entry__.get_parameters_path()
+    journal_path    = __entry__.get_path( __entry__.FILENAME_membership_journal )
+
+    write_membership_records(__entry__, compact_if_large=False)     # the records still pending would be lost otherwise
+
+    with membership_lock(__entry__, exclusive=True):
+        if os.path.exists( journal_path ):
+            stored_data = ufun.load_json( parameters_path )
+            if not stored_data:
+                raise RuntimeError( f"Could not load {parameters_path} in order to fold {journal_path} into it - PLEASE INVESTIGATE" )
+
+            __entry__.replay_membership_journal( stored_data )
+            ufun.save_json( stored_data, parameters_path, indent=4, atomic=True, durable=True )  # the journal is removed next, so its records must be on the disk first
+            os.remove( journal_path )
+            logging.info(f"[{__entry__.get_name()}] The membership journal has been folded into {parameters_path}")
+
+            __entry__.plant( 'contained_entries', stored_data['contained_entries'] )    # including the changes made by other processes
+
+    return __entry__
+
+
+def write_collection_data(parameters_path, __entry__):
+    """An internal method that writes the data of a stored collection (on behalf of Entry.write_parameters()).
+        Other processes may have attached or detached entries (and even folded the journal) since the collection was loaded,
+        so its contained_entries are first brought up to date with data_axs.json and the journal on disk, which gets folded in.
+        The membership of a stored collection is therefore only changed by attaching and detaching entries, not by editing contained_entries.
+    """
+    journal_path    = __entry__.get_path( __entry__.FILENAME_membership_journal )
+
+    write_membership_records(__entry__, compact_if_large=False)     # including this process' own records still pending
+
+    with membership_lock(__entry__, exclusive=True):
+        stored_data = ufun.load_json( parameters_path )
+        if 'contained_entries' in stored_data:      # otherwise the collection is being saved as one for the first time
+            __entry__.replay_membership_journal( stored_data )
+            __entry__.plant( 'contained_entries', stored_data['contained_entries'] )
+
+        folding_journal = os.path.exists( journal_path )
+        __entry__.write_data_file( parameters_path, durable=folding_journal or None )   # the journal is removed next, so its records must be on the disk first
+        if folding_journal:
+            os.remove( journal_path )
+
+    return __entry__
 
 
 def add_entry_path(new_entry_path, new_entry_name=None, __entry__=None):
-    """Add a new entry to the collection given the path
+    """Add a new entry to the collection given the path.
+        A stored collection only gets a record appended to its membership journal, rather than its whole data_axs.json rewritten.
+        An entry kept in the collection's store (see kernel_store) needs no record at all.
     """
     assert __entry__ != None, "__entry__ should be defined"
 
     trimmed_new_entry_path  = __entry__.trim_path( new_entry_path )
     new_entry_name          = new_entry_name or os.path.basename( trimmed_new_entry_path )
+
+    store = kernel_store.store_for( __entry__ )
+    if store and trimmed_new_entry_path==__entry__.fanned_out_path( new_entry_name ) and store.contains( new_entry_name ):
+        return __entry__
+
     existing_rel_path       = __entry__.dig(['contained_entries', new_entry_name], safe=True)
 
     if existing_rel_path:
@@ -412,14 +1195,91 @@ def add_entry_path(new_entry_path, new_entry_name=None, __entry__=None):
         else:
             raise(KeyError(f"There was already another entry named {new_entry_name} with path {existing_rel_path}, remove it first"))
     else:
+        was_collection = 'contained_entries' in __entry__.own_data()     # the journal is only replayed for the stored collections
         __entry__.plant(['contained_entries', new_entry_name], trimmed_new_entry_path)
-        return __entry__.save( on_collision="force", completed=ufun.generate_current_timestamp() )   # we expect a collision
+        entry_index(__entry__).pop( new_entry_name, None )  # a stale record under the same name; the new entry gets indexed by the next query
+        if was_collection and __entry__.is_stored and os.path.exists( __entry__.get_parameters_path() ):
+            append_membership_record( [ "+", new_entry_name, trimmed_new_entry_path ], __entry__ )
+            return __entry__
+        else:
+            return __entry__.save( on_collision="force", completed=ufun.generate_current_timestamp() )   # we expect a collision
 
 
 def remove_entry_name(old_entry_name, __entry__):
 
+    store = kernel_store.store_for( __entry__ )
+    if store and store.remove( old_entry_name ):
+        stored_entry.commit_entry_store( store )
+        return __entry__
+
     contained_entries       = __entry__.pluck(['contained_entries', old_entry_name])
-    return __entry__.save( on_collision="force", completed=ufun.generate_current_timestamp() )   # we expect a collision
+    if entry_index(__entry__).pop( old_entry_name, None ):
+        save_entry_index(__entry__)
+    if __entry__.is_stored and os.path.exists( __entry__.get_parameters_path() ):
+        append_membership_record( [ "-", old_entry_name ], __entry__ )
+        return __entry__
+    else:
+        return __entry__.save( on_collision="force", completed=ufun.generate_current_timestamp() )   # we expect a collision
+
+
+def reshard(fan_out_levels=2, keep_symlinks=False, __entry__=None):
+    """Move the entries stored inside the collection's directory into the hashed fan-out layout with the given number of levels
+        (0 moves them back into the flat layout), and keep placing the new entries that way. Returns the number of entries moved.
+        NB: absolute paths pointing into the moved entries that other entries may have stored are not rewritten;
+            --keep_symlinks leaves a symbolic link at each old location to keep them valid.
+
+Usage examples :
+                axs work_collection , reshard 2
+                axs work_collection , reshard 0
+    """
+    ak              = __entry__.get_kernel()
+    collection_path = os.path.realpath( __entry__.get_path() )
+    indexed_entries = entry_index(__entry__)
+    moved_entries   = 0
+
+    compact_membership(__entry__)       # so that contained_entries are complete in data_axs.json
+
+    with membership_lock(__entry__, exclusive=True):
+        contained_entries = __entry__.get('contained_entries', {})
+        for entry_name, rel_path in list( contained_entries.items() ):
+            if os.path.isabs( rel_path ) or rel_path.startswith('..') or os.path.basename( rel_path )!=entry_name:
+                continue        # stored outside of the collection's directory or under a different name
+
+            new_rel_path = __entry__.fanned_out_path( entry_name, fan_out_levels )
+            if new_rel_path==rel_path:
+                continue
+
+            old_path, new_path = os.path.join( collection_path, rel_path ), os.path.join( collection_path, new_rel_path )
+            if os.path.islink( old_path ) or not os.path.isdir( old_path ) or os.path.lexists( new_path ):
+                logging.warning(f"collection({__entry__.get_name()}): cannot move {old_path} to {new_path}, skipping")
+                continue
+
+            os.makedirs( os.path.dirname( new_path ), exist_ok=True )
+            os.rename( old_path, new_path )
+            if keep_symlinks:
+                os.symlink( new_path, old_path )
+            else:
+                ufun.remove_empty_dirs( os.path.dirname( old_path ), collection_path )
+
+            contained_entries[entry_name] = new_rel_path
+            append_membership_record( [ "+", entry_name, new_rel_path ], __entry__, durable=True )  # at once, even in the write-behind mode: the entry has already moved
+            if entry_name in indexed_entries:
+                indexed_entries[entry_name]["path"] = new_path      # the stamp of data_axs.json does not change when its directory is renamed
+
+            cached_entry = ak.entry_cache.pop( old_path, None )
+            if cached_entry:
+                ak.entry_cache[ new_path ] = cached_entry.set_path( new_path )
+            moved_entries += 1
+
+        __entry__.plant( __entry__.PARAMNAME_fan_out_levels, fan_out_levels, 'contained_entries', contained_entries )
+        __entry__.save( completed=ufun.generate_current_timestamp() )
+        parameters_path = __entry__.get_parameters_path()
+        if stored_entry.discard_deferred_write( parameters_path ):
+            __entry__.write_parameters( parameters_path )           # not left for the next sync point either (folding the journal in durably)
+        save_entry_index(__entry__)
+
+    logging.info(f"collection({__entry__.get_name()}): moved {moved_entries} entries into the {fan_out_levels}-level layout")
+    return moved_entries
 
 
 if __name__ == '__main__':
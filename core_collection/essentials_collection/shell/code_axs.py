@@ -63,6 +63,10 @@ Usage examples:
     if env:
         env = { k: str(env[k]) for k in env }   # cast all env's values to strings
 
+    ak = __entry__ and __entry__.get_kernel()
+    if ak:
+        ak.sync()   # the command may run axs itself, so the deferred writes have to be on disk by then
+
     while n_attempts:
         logging.warning(f"shell.run() about to execute (with in_dir={in_dir}, env={env}, capture_output={capture_output}, errorize_output={errorize_output}, capture_stderr={capture_stderr}, split_to_lines={split_to_lines}):\n\t{shell_cmd}\n" + (' '*8 + '^'*len(shell_cmd)) )
 
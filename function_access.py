@@ -7,45 +7,112 @@
 #       https://stackoverflow.com/questions/196960/can-you-list-the-keyword-arguments-a-python-function-receives
 
 import inspect      # to obtain a random function's signature
+import kernel_trace # to skip formatting debug messages when tracing is off
 import logging      # for non-obtrusive logging
 import sys          # to obtain Python's version
+import weakref      # to forget the call structures of functions that are gone (e.g. after reloading an entry's code)
+
+
+call_structure_cache    = weakref.WeakKeyDictionary()   # function -> { is_method: expected call structure }
+dotted_name_cache       = {}                            # dotted name -> ( top module, its __spec__, resolved callable )
+dispatch_cache_counters = { "call_structure_hits": 0, "call_structure_misses": 0, "dotted_name_hits": 0, "dotted_name_misses": 0 }
 
 
 def list_function_names(module_like_object):
     """Return the list of functions of a given Module/Class/Namespace
     """
     function_names = [name for name, function_object in inspect.getmembers(module_like_object, inspect.isfunction)]
-    logging.debug(f"Module/Class/Namespace {module_like_object.__name__ if hasattr(module_like_object, '__name__') else ''} contains the following functions: {function_names}")
+    if kernel_trace.enabled:
+        logging.debug(f"Module/Class/Namespace {module_like_object.__name__ if hasattr(module_like_object, '__name__') else ''} contains the following functions: {function_names}")
     return function_names
 
 
 def expected_call_structure(action_object):
     """Get the expected parameters of a function and their default values.
+        The structure is cached per function object, so a reloaded function is introspected anew.
     """
+    underlying_function = getattr(action_object, '__func__', action_object)   # bound methods are created afresh on every access
+    is_method           = inspect.ismethod(action_object)
+
+    try:
+        structures_by_kind  = call_structure_cache.get( underlying_function )
+    except TypeError:                   # some built-ins cannot be weakly referenced, so cannot be cached
+        structures_by_kind  = None
+
+    if structures_by_kind and is_method in structures_by_kind:
+        dispatch_cache_counters["call_structure_hits"] += 1
+        required_arg_names, optional_arg_names, defaults, varargs, varkw = structures_by_kind[is_method]
+        return list(required_arg_names), list(optional_arg_names), defaults, varargs, varkw     # fresh lists, as callers may extend them
+
+    dispatch_cache_counters["call_structure_misses"] += 1
+
+    introspected_object = inspect.unwrap(underlying_function) if is_method else inspect.unwrap(action_object)   # see through decorators (e.g. profiling)
 
     if sys.version_info[0] < 3:
-        supported_arg_names, varargs, varkw, defaults = inspect.getargspec(action_object)
+        supported_arg_names, varargs, varkw, defaults = inspect.getargspec(introspected_object)
         kwonlyargs = tuple()
         kwonlydefaults = {}
     else:
-        supported_arg_names, varargs, varkw, defaults, kwonlyargs, kwonlydefaults, annotations = inspect.getfullargspec(action_object)
+        supported_arg_names, varargs, varkw, defaults, kwonlyargs, kwonlydefaults, annotations = inspect.getfullargspec(introspected_object)
 
     defaults = defaults or tuple()
     if varargs:
         supported_arg_names += kwonlyargs
         defaults += tuple(kwonlydefaults.values() if kwonlydefaults else [])
 
-    if inspect.ismethod(action_object):
+    if is_method:
         supported_arg_names.pop(0)
 
     num_required        = len(supported_arg_names) - len(defaults)
     required_arg_names  = supported_arg_names[:num_required]
     optional_arg_names  = supported_arg_names[num_required:]
 
-    logging.debug(f"{action_object.__name__}() required={required_arg_names}, optional={optional_arg_names}, defaults={defaults}, varargs={varargs}, varkw={varkw}")
+    try:
+        call_structure_cache.setdefault( underlying_function, {} )[ is_method ] = ( tuple(required_arg_names), tuple(optional_arg_names), defaults, varargs, varkw )
+    except TypeError:
+        pass
+
+    if kernel_trace.enabled:
+        logging.debug(f"{action_object.__name__}() required={required_arg_names}, optional={optional_arg_names}, defaults={defaults}, varargs={varargs}, varkw={varkw}")
     return required_arg_names, optional_arg_names, defaults, varargs, varkw
 
 
+def resolve_dotted_name(dotted_name, resolver):
+    """Resolve a dotted name of a callable via resolver(dotted_name) once, and reuse the result
+        for as long as the top-level module stays the same (importlib.reload() also refreshes its __spec__).
+    """
+    top_module  = sys.modules.get( dotted_name.split('.', 1)[0] )
+    cached      = dotted_name_cache.get( dotted_name )
+
+    if cached and top_module is not None and cached[0] is top_module and cached[1] is getattr(top_module, '__spec__', None):
+        dispatch_cache_counters["dotted_name_hits"] += 1
+        return cached[2]
+
+    dispatch_cache_counters["dotted_name_misses"] += 1
+    resolved_callable = resolver( dotted_name )
+
+    top_module  = sys.modules.get( dotted_name.split('.', 1)[0] )     # may have just been imported by the resolver
+    if callable(resolved_callable) and top_module is not None:
+        dotted_name_cache[ dotted_name ] = ( top_module, getattr(top_module, '__spec__', None), resolved_callable )
+
+    return resolved_callable
+
+
+def dispatch_cache_stats(reset=False):
+    """Report the hits and misses of the call dispatch caches (optionally resetting the counters)
+
+Usage examples :
+                axs func function_access.dispatch_cache_stats
+                axs byname pip , available_versions --package_name=numpy , , func function_access.dispatch_cache_stats
+    """
+    stats = dict( dispatch_cache_counters, call_structures_cached=len(call_structure_cache), dotted_names_cached=len(dotted_name_cache) )
+    if reset:
+        for counter_name in dispatch_cache_counters:
+            dispatch_cache_counters[counter_name] = 0
+
+    return stats
+
+
 def prep(action_object, given_arg_list, dict_like_object, mapping_used=None):
     """Prepare to call a given action_object and feed it with arguments from given list and dictionary-like object (must support []).
 
@@ -104,16 +171,19 @@ def prep(action_object, given_arg_list, dict_like_object, mapping_used=None):
             if varargs:
                 mapping_used[varargs] = listed_vararg_values
 
-        logging.debug(f"Prepared to call `{action_object.__name__}` with tuple={joint_arg_tuple}, dict={optional_arg_dict}")
+        if kernel_trace.enabled:
+            logging.debug(f"Prepared to call `{action_object.__name__}` with tuple={joint_arg_tuple}, dict={optional_arg_dict}")
 
         return action_object, joint_arg_tuple, optional_arg_dict
 
 
 def feed(action_object, joint_arg_tuple, optional_arg_dict):
 
-    logging.debug(f"Feeding {getattr(action_object, '__name__', 'Unknown')} with {joint_arg_tuple} and {optional_arg_dict} ...")
+    if kernel_trace.enabled:
+        logging.debug(f"Feeding {getattr(action_object, '__name__', 'Unknown')} with {joint_arg_tuple} and {optional_arg_dict} ...")
     ret_values = action_object(*joint_arg_tuple, **optional_arg_dict)
-    logging.debug(f"Just fed {getattr(action_object, '__name__', 'Unknown')} , ret_values = {ret_values}")
+    if kernel_trace.enabled:
+        logging.debug(f"Just fed {getattr(action_object, '__name__', 'Unknown')} , ret_values = {ret_values}")
 
     return ret_values
 
@@ -121,14 +191,16 @@ def feed(action_object, joint_arg_tuple, optional_arg_dict):
 def four_param_example_func(alpha, beta, gamma=333, delta=4444):
     "Just an example function for testing purposes"
 
-    logging.debug(f'alpha = {alpha}, beta = {beta}, gamma = {gamma}, delta = {delta}')
+    if kernel_trace.enabled:
+        logging.debug(f'alpha = {alpha}, beta = {beta}, gamma = {gamma}, delta = {delta}')
     return alpha, beta, gamma, delta
 
 
 def vararg_supporting_example_func(alpha, beta, *others, gamma=333, delta=4444):
     "Another example function for testing purposes"
 
-    logging.debug(f'alpha = {alpha}, beta = {beta}, others = {others}, gamma = {gamma}, delta = {delta}')
+    if kernel_trace.enabled:
+        logging.debug(f'alpha = {alpha}, beta = {beta}, others = {others}, gamma = {gamma}, delta = {delta}')
     return alpha, beta, others, gamma, delta
 
 
@@ -142,16 +214,19 @@ def to_num_or_not_to_num(x):
     try:
         x_int = int(x)
         if type(x_int)==int:
-            logging.debug(f"converting {repr(x)} to int")
+            if kernel_trace.enabled:
+                logging.debug(f"converting {repr(x)} to int")
             return x_int
     except:
         try:
             x_float = float(x)
             if type(x_float)==float:
-                logging.debug(f"converting {repr(x)} to float")
+                if kernel_trace.enabled:
+                    logging.debug(f"converting {repr(x)} to float")
                 return x_float
         except:
-            logging.debug(f"keeping {repr(x)} as it was")
+            if kernel_trace.enabled:
+                logging.debug(f"keeping {repr(x)} as it was")
             pass
 
     return x
@@ -160,6 +235,7 @@ def to_num_or_not_to_num(x):
 if __name__ == '__main__':
 
     logging.basicConfig(level=logging.DEBUG, format="%(levelname)s:%(funcName)s: %(message)s")
+    kernel_trace.refresh()
 
     print('-'*40 + ' four_param_example_func() calls: ' + '-'*40)
 
@@ -223,7 +299,9 @@ if __name__ == '__main__':
     print('-'*40 + ' expected_call_structure() calls: ' + '-'*40)
 
     assert expected_call_structure(four_param_example_func)==(['alpha', 'beta'], ['gamma', 'delta'], (333, 4444), None, None)
+    assert expected_call_structure(four_param_example_func)==(['alpha', 'beta'], ['gamma', 'delta'], (333, 4444), None, None), "Same structure taken from the cache"
+    assert dispatch_cache_stats()["call_structure_hits"]>=1, "The repeated introspection was a cache hit"
 
     print('-'*40 + ' list_function_names() calls: ' + '-'*40)
 
-    assert sorted(list_function_names(sys.modules[__name__]))==['expected_call_structure', 'feed', 'four_param_example_func', 'list_function_names', 'prep', 'to_num_or_not_to_num', 'vararg_supporting_example_func'], "Functions defined in this module"
+    assert sorted(list_function_names(sys.modules[__name__]))==['dispatch_cache_stats', 'expected_call_structure', 'feed', 'four_param_example_func', 'list_function_names', 'prep', 'resolve_dotted_name', 'to_num_or_not_to_num', 'vararg_supporting_example_func'], "Functions defined in this module"
@@ -10,16 +10,20 @@ else:
     from kernel import default as ak
 """
 
-__version__ = '0.2.418'     # TODO: update with every kernel change
+__version__ = '0.2.454'     # TODO: update with every kernel change
 
+import json
 import logging
 import os
 import sys
 
+import kernel_profile
+import kernel_store
+import kernel_trace
 import ufun
 
 from runnable import Runnable
-from stored_entry import Entry
+from stored_entry import Entry, flush_deferred_writes, prefetched_data
 
 
 class MicroKernel(Runnable):
@@ -34,8 +38,37 @@ Usage examples :
     def __init__(self, entry_cache=None, **kwargs):
         self.entry_cache            = entry_cache or {}
         self.record_container_value = None
+        self.name_table_cache       = None
+        self.rule_index_cache       = {}
+        self.adopt_environment()
         super().__init__(kernel=self, **kwargs)
-        logging.debug(f"[{self.get_name()}] Initializing the MicroKernel with entry_cache={self.entry_cache}")
+        kernel_trace.trace( lambda: f"[{self.get_name()}] Initializing the MicroKernel with entry_cache={self.entry_cache}" )
+
+
+    def adopt_environment(self):
+        "(Re)read the kernel state that is set by environment variables; also called by a daemon's child after taking over its client's environment"
+
+        self.call_store_mode        = os.getenv('AXS_CALL_STORE') or 'on'
+
+
+    def forget_cached_state(self):
+        "Drop all the entries, tables and call results cached so far, so that everything gets reloaded from disk on demand"
+
+        self.entry_cache            = {}
+        self.record_container_value = None
+        self.name_table_cache       = None
+        self.rule_index_cache       = {}
+        self.call_cache             = None
+
+
+    def sync(self):
+        """Perform the writes deferred in the write-behind mode (AXS_WRITE_BEHIND=1), returning their number.
+            Called automatically at the end of every pipeline, before forking workers and before running shell commands.
+
+Usage examples :
+                AXS_WRITE_BEHIND=1 axs byname counter , plant n 1 , save , plant n 2 , save , sync
+        """
+        return flush_deferred_writes()
 
 
     def version(self):
@@ -104,17 +137,35 @@ Usage examples :
     def uncache(self, old_path):
         if old_path and old_path in self.entry_cache:
             del self.entry_cache[ old_path ]
-            logging.debug(f"[{self.get_name()}] Uncaching from under {old_path}")
+            kernel_trace.trace( lambda: f"[{self.get_name()}] Uncaching from under {old_path}" )
+
+
+    def encache_prefetched(self, prefetched_entries, container=None):
+        """Add the entries whose data_axs.json files have been read in advance (concurrently, by a cold-start loader) to entry_cache in one go.
+            prefetched_entries maps the real paths of the entries to their ( name, loaded_data ) pairs.
+            The entries already cached are kept as they are. Returns the number of entries added.
+        """
+        new_entries = {}
+        for real_path, (entry_name, loaded_data) in prefetched_entries.items():
+            if real_path not in self.entry_cache:
+                prefetched_data[ os.path.join( real_path, Entry.FILENAME_parameters ) ] = loaded_data     # consumed by the first own_data()
+                new_entries[ real_path ] = Entry(name=entry_name, entry_path=real_path, container=container, is_stored=True, kernel=self)
+
+        self.entry_cache.update( new_entries )
+        kernel_trace.trace( lambda: f"[{self.get_name()}] Caching {len(new_entries)} prefetched entries" )
+
+        return len(new_entries)
 
 
     def encache(self, new_path, entry):
         new_path = os.path.realpath( new_path )
         self.entry_cache[ new_path ] = entry
-        logging.debug(f"[{self.get_name()}] Caching under {new_path}")
+        kernel_trace.trace( lambda: f"[{self.get_name()}] Caching under {new_path}" )
 
         return entry
 
 
+    @kernel_profile.profiled('load', lambda self, args, kwargs: (kwargs.get('name') or os.path.basename( str(args[0] if args else kwargs.get('path')) ), 'bypath'))
     def bypath(self, path, name=None, container=None, own_data=None, parent_objects=None):
         """Fetch an entry by its path, cached by the path
             Ad-hoc entries built either form a data file (.json) or functions' file (.py) can also be created, and even manually stacked
@@ -126,14 +177,20 @@ Usage examples :
                 axs elem: bypath only_data/carbon.json , get_kernel , code: bypath only_code/iterative.py --parent_objects,:=^:get:elem , factorial --:=^^:get:number
                 axs elem: bypath only_data/oxygen.json , get_kernel , lat: bypath latin --parent_objects,:=^:get:elem , get weight
         """
-        path = os.path.realpath( path )
+        cache_hit = self.entry_cache.get(path)     # the keys are real paths, so a hit means the path needs no resolving
+        if cache_hit is None:
+            path = os.path.realpath( path )
+            cache_hit = self.entry_cache.get(path)
 
-        cache_hit = self.entry_cache.get(path)
+        if kernel_profile.enabled:
+            kernel_profile.annotate(cache="hit" if cache_hit else "miss", path=path)
 
         if cache_hit:
-            logging.debug(f"[{self.get_name()}] bypath: cache HIT for path={path}")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}] bypath: cache HIT for path={path}")
         else:
-            logging.debug(f"[{self.get_name()}] bypath: cache MISS for path={path}")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}] bypath: cache MISS for path={path}")
 
             if path.endswith('.json'):      # ad-hoc data entry from a .json file
                 entry_object = Entry(name=name, parameters_path=path, own_functions=False, parent_objects=parent_objects or [], is_stored=True, kernel=self)
@@ -144,7 +201,8 @@ Usage examples :
                 entry_object = Entry(name=name, entry_path=path, own_data=own_data, container=container, parent_objects=parent_objects or None, kernel=self)
 
             cache_hit = self.encache( path, entry_object )
-            logging.debug(f"[{self.get_name()}] bypath: successfully CACHED {cache_hit.get_name()} under path={path}")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}] bypath: successfully CACHED {cache_hit.get_name()} under path={path}")
 
         return cache_hit
 
@@ -195,17 +253,167 @@ Usage examples :
         return work_collection_object
 
 
+    def call_store_path(self, persistent_key=None):
+        """The directory (inside the work_collection unless overridden) where the results of persistent_calls are stored across processes,
+            or the file path of one stored result.
+
+Usage examples :
+                axs call_store_path
+                AXS_CALL_STORE_DIR=/tmp/alt_call_store axs call_store_path
+        """
+        call_store_dir = os.getenv('AXS_CALL_STORE_DIR') or self.work_collection().get_path( '.call_store' )
+        if persistent_key:
+            return os.path.join( call_store_dir, persistent_key[:2], persistent_key+'.json' )
+        else:
+            return call_store_dir
+
+
+    def call_store(self, mode=None):
+        """Switch the persistent store of the results of persistent_calls for the rest of the pipeline (or query the current mode):
+                "on"      - reuse the stored results and store the new ones (default, also taken from AXS_CALL_STORE environment variable)
+                "bypass"  - neither reuse nor store anything
+                "refresh" - recompute and overwrite the stored results
+                "clear"   - remove all the stored results and carry on as "on"
+
+Usage examples :
+                axs call_store
+                axs call_store bypass , , byname base_imagenet_experiment , get class_names
+                axs call_store clear
+                AXS_CALL_STORE=refresh axs byname base_imagenet_experiment , get class_names
+        """
+        if mode=='clear':
+            call_store_dir = self.call_store_path()
+            if os.path.exists( call_store_dir ):
+                logging.warning(f"[{self.get_name()}] Removing the call store at {call_store_dir}")
+                ufun.rmdir( call_store_dir )
+            mode = 'on'
+
+        if mode:
+            if mode not in ('on', 'bypass', 'refresh'):
+                raise ValueError(f"Unknown call_store mode '{mode}', expected one of: on, bypass, refresh, clear")
+            self.call_store_mode = mode
+
+        return self.call_store_mode
+
+
+    def call_store_load(self, persistent_key):
+        "Return a (found, value) pair for a result stored by a previous process"
+
+        try:
+            stored_record = ufun.load_json( self.call_store_path(persistent_key) )
+        except OSError:
+            return False, None
+
+        if stored_record.get("kernel_version")==__version__ and "result" in stored_record:
+            return True, stored_record["result"]
+        else:
+            return False, None
+
+
+    def call_store_save(self, persistent_key, result, call_title):
+        "Store the result for other processes, but only if it survives the JSON round trip unchanged"
+
+        try:
+            faithful = json.loads( json.dumps( result ) )==result
+        except (TypeError, ValueError):
+            faithful = False
+
+        if not faithful:
+            kernel_trace.trace( lambda: f"[{self.get_name()}] The result of {call_title} is not JSON-able, so not storing it" )
+            return
+
+        stored_result_path = self.call_store_path(persistent_key)
+        try:
+            os.makedirs( os.path.dirname(stored_result_path), exist_ok=True )
+            ufun.save_json( { "call": call_title, "kernel_version": __version__, "result": result }, stored_result_path, atomic=True )
+        except OSError as e:
+            kernel_trace.trace( lambda: f"[{self.get_name()}] Could not store the result of {call_title} in {stored_result_path}: {e}" )
+
+
+    def name_table(self):
+        """Lazy-build and cache the mapping of entry names to their paths (and their containers' paths) across all the nested collections.
+            It is rebuilt when the work_collection is switched or any of the collections' data_axs.json changes on disk.
+
+Usage examples :
+                axs name_table , keys ,0 func len
+                axs name_table , get shell
+        """
+        work_collection_object  = self.work_collection()
+        work_collection_path    = work_collection_object.get_path()
+        name_table              = self.name_table_cache
+
+        if (name_table is None) or (name_table["root"]!=work_collection_path) or any( Entry.data_stamp(parameters_path)!=stamp for parameters_path, stamp in name_table["stamps"].items() ):
+            kernel_trace.trace( lambda: f"[{self.get_name()}] (re)building the name table" )
+            name_table          = work_collection_object.call('entry_name_table', deterministic=False)
+            name_table["root"]  = work_collection_path
+            self.name_table_cache = name_table
+
+        return name_table["names"]
+
+
+    def restamp_container(self, name_table, container):
+        "Refresh the fingerprints of the container's data files in the cached name table, after the container has been changed by this process"
+
+        container_parameters_path = container.get_parameters_path()
+        name_table["stamps"][container_parameters_path] = Entry.data_stamp( container_parameters_path )
+
+        store = kernel_store.store_for( container )
+        if store and store.stamp_path in name_table["stamps"]:
+            name_table["stamps"][store.stamp_path] = Entry.data_stamp( store.stamp_path )
+
+
+    def name_table_add(self, entry, container):
+        "Keep the cached name table in sync after the entry has been attached to the container"
+
+        name_table = self.name_table_cache
+        container_parameters_path = container.get_parameters_path()
+
+        if name_table and container_parameters_path in name_table["stamps"]:    # only the walked collections matter
+            entry_name  = entry.get_name()
+            entry_path  = os.path.realpath( entry.get_path() )
+            name_record = name_table["names"].get( entry_name )
+
+            if ('contained_entries' in entry.own_data()) or (name_record and name_record[0]!=entry_path):
+                self.name_table_cache = None    # a new sub-collection or a name clash: rebuild from scratch next time
+            else:
+                name_table["names"][entry_name] = [ entry_path, os.path.realpath( container.get_path() ) ]
+                self.restamp_container( name_table, container )
+
+
+    def name_table_discard(self, entry, container):
+        "Keep the cached name table in sync after the entry has been detached from the container"
+
+        name_table = self.name_table_cache
+        container_parameters_path = container.get_parameters_path()
+
+        if name_table and container_parameters_path in name_table["stamps"]:    # only the walked collections matter
+            entry_name  = entry.get_name()
+
+            if ('contained_entries' in entry.own_data()) or (entry_name in name_table["duplicates"]):
+                self.name_table_cache = None    # a sub-collection or a shadowed name may have gone: rebuild from scratch next time
+            else:
+                name_table["names"].pop( entry_name, None )
+                self.restamp_container( name_table, container )
+
+
     def byname(self, entry_name):
-        """Fetch an entry by its name (delegated to work_collection)
+        """Fetch an entry by its name (looked up in the name table of the work_collection)
 
 Usage examples :
                 axs byname pip , help
         """
-        logging.debug(f"[{self.get_name()}] byname({entry_name})")
-        return self.work_collection().call('byname', [entry_name])
+        kernel_trace.trace( lambda: f"[{self.get_name()}] byname({entry_name})" )
+
+        name_record = self.name_table().get( entry_name )
+        if name_record:
+            entry_path, container_path = name_record
+            container_object = self.bypath( container_path ) if container_path else None
+            return self.bypath( entry_path, name=entry_name, container=container_object )
+        else:
+            return None
 
 
-    def all_byquery(self, query, pipeline=None, template=None, parent_recursion=False):
+    def all_byquery(self, query, pipeline=None, template=None, parent_recursion=False, jobs=None):
         """Returns a list of ALL entries matching the query.
             Empty list if nothing matched.
 
@@ -217,9 +425,28 @@ Usage examples :
                 axs all_byquery tags. --template="tags=#{tags}#"
                 axs all_byquery deleteme+ ---='[["remove"]]'
                 axs all_byquery git_repo ---='[["pull"]]'
+                axs all_byquery git_repo ---='[["pull"]]' --jobs=8
         """
-        logging.debug(f"[{self.get_name()}] all_byquery({query}, {pipeline}, {template})")
-        return self.work_collection().call('all_byquery', [query, pipeline, template, parent_recursion])
+        kernel_trace.trace( lambda: f"[{self.get_name()}] all_byquery({query}, {pipeline}, {template}, jobs={jobs})" )
+        return self.work_collection().call('all_byquery', [query, pipeline, template, parent_recursion, jobs])
+
+
+    def rule_index(self, collection=None):
+        """Lazy-build and cache the pre-parsed _producer_rules advertised within a collection (the work_collection by default), keyed by their positive tag sets.
+            It is rebuilt when any of the collections' or the advertising entries' data_axs.json changes on disk.
+
+Usage examples :
+                axs rule_index , keys ,0 func len
+        """
+        collection      = collection or self.work_collection()
+        collection_path = collection.get_path()
+        rule_index      = self.rule_index_cache.get( collection_path )
+
+        if (rule_index is None) or any( Entry.data_stamp(parameters_path)!=stamp for parameters_path, stamp in rule_index["stamps"].items() ):
+            kernel_trace.trace( lambda: f"[{self.get_name()}] (re)building the rule index of {collection_path}" )
+            rule_index = self.rule_index_cache[ collection_path ] = collection.call('producer_rule_index', deterministic=False)
+
+        return rule_index["rules_by_tags"]
 
 
     def show_matching_rules(self, query):
@@ -228,7 +455,7 @@ Usage examples :
 Usage examples :
                 axs show_matching_rules shell_tool,can_download_url_from_zenodo
         """
-        logging.debug(f"[{self.get_name()}] show_matching_rules({query})")
+        kernel_trace.trace( lambda: f"[{self.get_name()}] show_matching_rules({query})" )
         return self.work_collection().call('show_matching_rules', [query])
 
 
@@ -240,7 +467,7 @@ Usage examples :
                 axs byquery person.,be!=Be
                 axs byquery person.,be!=Be --parent_recursion+ , get_path
         """
-        logging.debug(f"[{self.get_name()}] byquery({query})")
+        kernel_trace.trace( lambda: f"[{self.get_name()}] byquery({query})" )
         return self.work_collection().call('byquery', [query, produce_if_not_found, parent_recursion])
 
 
@@ -259,3 +486,52 @@ if __name__ == '__main__':
                 ('meme', ['does not instagram her food', 'considerate'], {'person': 'Mary'}),
     ])
     print( result )
+
+
+    from argparse import Namespace
+    from param_source import ParamSource
+    from runnable import Runnable
+
+    recorder = Runnable(name='recorder', kernel=ak, own_data={"unused": 2}, own_functions=Namespace(
+        add=(lambda alpha, beta=20: alpha+beta),
+        add_recorded=(lambda alpha, beta=20, __record_entry__=None: __record_entry__),
+    ))
+    assert recorder.call('add', [1])==21, "A call that nobody asks the record of"
+    record_entry = recorder.call('add_recorded', [1], {"gamma": 3})
+    assert record_entry.own_data()['alpha']==1 and record_entry.own_data()['gamma']==3 and '_replay' in record_entry.own_data(), "The record is built when asked for"
+    assert '__result__' not in record_entry.own_data(), "The record does not contain itself as the result"
+
+
+    print('-'*40 + ' Benchmarking the resident size: ' + '-'*40)
+
+    def resident_kb():
+        "The current resident set size of this process in KiB (the peak one where /proc is not available)"
+        try:
+            with open('/proc/self/statm') as statm_fd:
+                return int( statm_fd.read().split()[1] ) * os.sysconf('SC_PAGE_SIZE') // 1024
+        except (OSError, ValueError):
+            import resource
+            return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+    start_kb        = resident_kb()
+    core_entries    = [ ak.bypath( dirpath ) for dirpath, _, filenames in os.walk( ak.kernel_path('core_collection') ) if Entry.FILENAME_parameters in filenames ]
+    for core_entry in core_entries:
+        core_entry.own_data()
+    core_kb         = resident_kb()
+
+    synthetic_entries = []
+    for i in range(10000):
+        synthetic_entry = Entry(name=f'synthetic_{i}', own_data={"number": i, "label": f"entry number {i}"}, own_functions=False, is_stored=False, kernel=ak)
+        synthetic_entry['label']
+        synthetic_entry.call('get', ['number'])
+        synthetic_entries.append( synthetic_entry )
+    synthetic_kb    = resident_kb()
+
+    per_entry_bytes = (synthetic_kb-core_kb)*1024/len(synthetic_entries)
+    print(f"The whole core_collection ({len(core_entries)} entries) takes {core_kb-start_kb} KiB, 10k synthetic entries (queried and called) take {synthetic_kb-core_kb} KiB, {per_entry_bytes:.0f} bytes each; {synthetic_kb} KiB in total")
+
+    queried_entry = Entry(name='queried', own_data={"number": 1}, own_functions=False, is_stored=False, kernel=ak)
+    queried_entry['number']
+    assert not any( hasattr(instance, '__dict__') for instance in ( ParamSource(name='plain'), recorder, queried_entry, synthetic_entries[0] ) ), "The entries should only have slots"
+    assert queried_entry.runtime_stack_cache is None and queried_entry.blocked_param_set is None, "Querying pure data should not allocate the bookkeeping containers"
+    assert synthetic_entries[0].blocked_param_set is None, "... and neither should calling an action on it"
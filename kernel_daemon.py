@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+""" An opt-in resident kernel that saves the CLI the startup costs (interpreter, imports, building the name table and the rule index).
+
+    The daemon keeps a warmed-up MicroKernel and listens on a Unix socket.
+    For every request it forks a child that adopts the client's stdin/stdout/stderr, current directory, environment and argv,
+    re-reads the kernel state that depends on the environment (such as AXS_CALL_STORE),
+    runs the pipeline and reports the exit code back, so the daemon itself always stays in its warmed-up state.
+    Before forking, the files that the warm state was built from are re-checked (by mtime and size),
+    and the state is rebuilt from scratch if any of them has changed.
+    A child whose client uses a different work_collection than the daemon starts from a cold state instead.
+
+    Each kernel checkout has its own default socket, so a daemon only ever serves the commands of its own kernel.
+
+    When the daemon is not running, the client falls back to in-process execution.
+
+Usage examples :
+                axs --daemon &                                      # start serving on the default socket
+                AXS_DAEMON_SOCKET=/tmp/axs.sock axs --daemon &      # ... or on a specific one
+                axs byname pip , available_versions                 # any command is forwarded while the daemon is up
+                axs --daemon-stop
+"""
+
+import array
+import hashlib
+import json
+import logging
+import os
+import socket
+import sys
+
+REPLY_run_in_process = b"-"     # the daemon declines to serve the request
+WARM_STATE_env_vars = ('AXS_WORK_COLLECTION', 'HOME')  # the environment variables the warm state has been built for
+
+
+def socket_path():
+    "The path of the Unix socket shared by the daemon and its clients, specific to the kernel's location unless AXS_DAEMON_SOCKET is set"
+
+    kernel_path_digest = hashlib.sha1( os.path.dirname( os.path.realpath(__file__) ).encode('utf-8', 'surrogateescape') ).hexdigest()[:12]
+    return os.getenv('AXS_DAEMON_SOCKET') or os.path.join(os.path.expanduser('~'), f'.axs_daemon_{kernel_path_digest}.sock')
+
+
+def warm_state_env():
+    "The values of the environment variables the warm state depends on"
+
+    return { env_var: os.getenv(env_var) for env_var in WARM_STATE_env_vars }
+
+
+def forward(argv, stop=False):
+    """Ask the running daemon to execute the command line on our behalf, passing it our stdin/stdout/stderr.
+        Returns the exit code, or None if there is no daemon to talk to (so the caller should run in-process).
+    """
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists( socket_path() ):
+        return None
+
+    client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client_socket.connect( socket_path() )
+    except OSError:
+        client_socket.close()
+        return None
+
+    request = { "argv": argv, "cwd": os.getcwd(), "env": dict(os.environ), "stop": stop }
+    with client_socket:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        client_socket.sendmsg( [ json.dumps(request).encode('utf-8') + b"\n" ], [ (socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [0, 1, 2])) ] )
+
+        reply = b""
+        while True:
+            chunk = client_socket.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+
+    if reply==REPLY_run_in_process:
+        return None
+
+    try:
+        return int(reply)
+    except ValueError:
+        return 1    # the child has died without reporting
+
+
+def receive_request(connection):
+    "Read one newline-terminated JSON request along with the file descriptors passed with it"
+
+    received_fds = array.array('i')
+    data, ancdata, _, _ = connection.recvmsg( 65536, socket.CMSG_LEN( 3 * received_fds.itemsize ) )
+    for cmsg_level, cmsg_type, cmsg_data in ancdata:
+        if cmsg_level==socket.SOL_SOCKET and cmsg_type==socket.SCM_RIGHTS:
+            received_fds.frombytes( cmsg_data[:len(cmsg_data) - (len(cmsg_data) % received_fds.itemsize)] )
+
+    while data and not data.endswith(b"\n"):
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+
+    return json.loads(data), list(received_fds)
+
+
+def warm_state_stamps(ak):
+    "Stamps of all the files the warm state depends on: the kernel's own sources and the data/code of every cached entry"
+
+    import ufun
+
+    stamped_paths = set( os.path.join(ak.kernel_path(), file_name) for file_name in os.listdir(ak.kernel_path()) if file_name.endswith('.py') or file_name=='axs' )
+    for entry in list(ak.entry_cache.values()):
+        if hasattr(entry, 'get_parameters_path') and entry.entry_path:
+            stamped_paths.add( entry.get_parameters_path() )
+            stamped_paths.add( os.path.join(entry.entry_path, entry.get_module_name()+'.py') )
+            if entry.own_data_cache and 'contained_entries' in entry.own_data_cache:
+                stamped_paths.add( os.path.join(entry.entry_path, entry.FILENAME_membership_journal) )
+
+    return { path: ufun.file_stamp(path) for path in stamped_paths }
+
+
+def warm_up(ak):
+    "Build the most frequently needed caches in advance, so that the forked children start from them"
+
+    try:
+        ak.name_table()
+        ak.rule_index()
+    except Exception as e:
+        logging.warning(f"[{ak.get_name()}] Could not fully warm up the daemon: {e.__class__.__name__}({e})")
+
+    return warm_state_stamps(ak)
+
+
+def run_child(request, client_fds, run_argv, warm_env):
+    """In the forked child: impersonate the client and run its command line, returning the exit code.
+        The warm state is dropped if the client's environment differs from warm_env, the one it has been built for.
+    """
+    from kernel import default_kernel as ak
+
+    for target_fd, client_fd in enumerate(client_fds):
+        os.dup2(client_fd, target_fd)
+        os.close(client_fd)
+
+    sys.stdout.reconfigure( line_buffering=os.isatty(1) )
+    os.chdir( request["cwd"] )
+    os.environ.clear()
+    os.environ.update( request["env"] )
+    sys.argv = [ sys.argv[0] ] + request["argv"]
+
+    if warm_state_env()!=warm_env:
+        ak.forget_cached_state()
+    ak.adopt_environment()
+
+    try:
+        run_argv( request["argv"] )
+        exit_code = 0
+    except SystemExit as e:
+        exit_code = e.code if type(e.code)==int else (0 if e.code is None else 1)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        exit_code = 1
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return exit_code
+
+
+def serve(run_argv):
+    """Serve the command lines forwarded by the clients until asked to stop.
+        run_argv(argv) is expected to execute a command line and print its result.
+    """
+    import ufun
+    from kernel import default_kernel as ak
+
+    listening_path = socket_path()
+    if os.path.exists(listening_path):
+        probe_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe_socket.connect(listening_path)
+            logging.error(f"[{ak.get_name()}] Another daemon is already listening on {listening_path}")
+            return 1
+        except OSError:
+            os.remove(listening_path)       # a leftover from a daemon that has not exited cleanly
+        finally:
+            probe_socket.close()
+
+    stamps      = warm_up(ak)
+    warm_env    = warm_state_env()
+
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server_socket.bind(listening_path)
+    server_socket.listen()
+    logging.info(f"[{ak.get_name()}] Serving on {listening_path} with {len(ak.entry_cache)} entries preloaded")
+
+    try:
+        while True:
+            connection, _ = server_socket.accept()
+
+            while True:                     # reap the finished children
+                try:
+                    child_pid, _ = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if not child_pid:
+                    break
+
+            try:
+                request, client_fds = receive_request(connection)
+            except (OSError, ValueError) as e:
+                logging.warning(f"[{ak.get_name()}] Dropping a malformed request: {e}")
+                connection.close()
+                continue
+
+            if request.get("stop"):
+                for client_fd in client_fds:
+                    os.close(client_fd)
+                connection.sendall(b"0")
+                connection.close()
+                break
+
+            changed_paths = [ path for path, stamp in stamps.items() if ufun.file_stamp(path)!=stamp ]
+            if any( os.path.dirname(path)==ak.kernel_path() for path in changed_paths ):
+                logging.warning(f"[{ak.get_name()}] The kernel's own code has changed, stopping the daemon")
+                for client_fd in client_fds:
+                    os.close(client_fd)
+                connection.sendall( REPLY_run_in_process )
+                connection.close()
+                break
+            elif changed_paths:
+                logging.info(f"[{ak.get_name()}] Some of the preloaded entries have changed on disk, rebuilding the warm state")
+                ak.forget_cached_state()
+                stamps = warm_up(ak)
+
+            child_pid = os.fork()
+            if child_pid==0:
+                server_socket.close()
+                exit_code = run_child(request, client_fds, run_argv, warm_env)
+                try:
+                    connection.sendall( str(exit_code).encode('utf-8') )
+                finally:
+                    os._exit(exit_code)
+            else:
+                for client_fd in client_fds:
+                    os.close(client_fd)
+                connection.close()
+    finally:
+        server_socket.close()
+        if os.path.exists(listening_path):
+            os.remove(listening_path)
+
+    return 0
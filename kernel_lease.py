@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+""" File-based leases that let concurrent processes (on one host or sharing a file system) agree on who produces an entry.
+
+    A lease is a small JSON file naming its holder (host, pid, what is being produced), created exclusively.
+    While the holder is busy, a heartbeat thread keeps touching the file.
+    The thread is stopped around every fork (of the scheduler's workers, say), so that no other thread runs while the process is forked.
+    A lease whose heartbeat has stopped (or whose holder process is known to be gone) is dead and can be reclaimed by anyone.
+    The others wait for a live lease to be released, up to a timeout.
+
+    The leases live in the .leases_axs directory of the collection being queried.
+    AXS_LEASE_TIMEOUT sets how long (in seconds) to wait for another producer, 3600 by default.
+
+Usage examples :
+                axs func kernel_lease.holder ~/work_collection/.leases_axs/0123456789abcdef.lease
+                AXS_LEASE_TIMEOUT=60 axs byquery downloaded,file_name=large.tar
+"""
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import kernel_trace
+
+try:
+    import fcntl
+except ImportError:             # no cross-process locking on Windows
+    fcntl = None
+
+DIRNAME_leases              = '.leases_axs'
+FILENAME_reclaim_lock       = '.reclaim.lock'
+LEASE_heartbeat_interval    = 5     # seconds between the touches of a held lease
+LEASE_expiry                = 30    # seconds of silence after which a lease is considered dead
+TOKEN_unleased              = 'unleased'    # returned when no lease can be created (say, in a read-only collection), so the caller goes on without one
+
+held_leases         = set()     # the lease paths held by this process
+heartbeat_thread    = None
+heartbeat_stop      = threading.Event()     # set to stop the heartbeat thread before a fork
+
+
+def start_heartbeat():
+    "Start the heartbeat thread, unless it is already running or there is nothing to touch"
+
+    global heartbeat_thread
+    if heartbeat_thread is None and held_leases:
+        heartbeat_thread = threading.Thread( target=heartbeat, name='lease_heartbeat', daemon=True )
+        heartbeat_thread.start()
+
+
+def stop_heartbeat():
+    "Stop the heartbeat thread (if running) and wait until it has finished"
+
+    global heartbeat_thread
+    running_thread = heartbeat_thread    # it may be clearing heartbeat_thread itself right now
+    if running_thread is not None:
+        heartbeat_stop.set()
+        running_thread.join()
+        heartbeat_thread = None
+        heartbeat_stop.clear()
+
+
+def forget_held_leases():
+    "A forked child does not inherit either its parent's leases or the heartbeat thread"
+
+    global heartbeat_thread
+    held_leases.clear()
+    heartbeat_thread = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork( before=stop_heartbeat, after_in_parent=start_heartbeat, after_in_child=forget_held_leases )
+
+
+def wait_timeout():
+    "How long to wait for another producer"
+
+    try:
+        return float( os.getenv('AXS_LEASE_TIMEOUT') or 3600 )
+    except ValueError:
+        return 3600.0
+
+
+def lease_path_for(conditions, directory):
+    "The path of the lease guarding the production for a query (the order of its conditions does not matter)"
+
+    canonical_query = json.dumps( sorted( str(condition) for condition in conditions if condition not in (None, "") ) )
+    return os.path.join( directory, DIRNAME_leases, hashlib.sha1( canonical_query.encode('utf-8') ).hexdigest()[:16]+'.lease' )
+
+
+def holder(lease_path):
+    """The description of the live holder of the lease, or None if the lease is free (or dead).
+
+Usage examples :
+                axs func kernel_lease.holder ~/work_collection/.leases_axs/0123456789abcdef.lease
+    """
+    try:
+        lease_stat = os.stat( lease_path )
+    except OSError:
+        return None
+
+    if time.time() - lease_stat.st_mtime > LEASE_expiry:
+        return None
+
+    try:
+        with open( lease_path, encoding='utf-8' ) as lease_fd:
+            holder_data = json.load( lease_fd )
+    except (OSError, ValueError):
+        return {}       # being written right now, so the holder is alive
+
+    if holder_data.get('host')==socket.gethostname() and holder_data.get('pid')!=os.getpid():
+        try:
+            os.kill( holder_data['pid'], 0 )
+        except ProcessLookupError:
+            return None
+        except (OSError, TypeError, KeyError):
+            pass        # exists, but is not ours to signal
+
+    return holder_data
+
+
+def heartbeat():
+    "Keep touching the leases held by this process, for as long as there are any"
+
+    global heartbeat_thread
+    while not heartbeat_stop.wait( LEASE_heartbeat_interval ):
+        if not held_leases:
+            heartbeat_thread = None
+            return
+        for lease_path in list(held_leases):
+            try:
+                os.utime( lease_path )
+            except OSError:
+                held_leases.discard( lease_path )   # reclaimed by someone else after a long stall
+
+
+def reclaim_if_dead(lease_path):
+    "Remove the lease if it is dead. The check and the removal are atomic with respect to the other reclaimers"
+
+    lock_path = os.path.join( os.path.dirname( lease_path ), FILENAME_reclaim_lock )
+    with open( lock_path, 'a' ) as lock_fd:
+        if fcntl:
+            fcntl.flock( lock_fd, fcntl.LOCK_EX )
+        try:
+            if os.path.exists( lease_path ) and holder( lease_path ) is None:
+                logging.warning(f"Reclaiming the dead lease {lease_path}")
+                os.remove( lease_path )
+        finally:
+            if fcntl:
+                fcntl.flock( lock_fd, fcntl.LOCK_UN )
+
+
+def acquire(lease_path, description):
+    """Try to take the lease. Returns the token of this holding if the lease is ours now, None if another live process holds it.
+        A dead lease is reclaimed on the way. If the lease cannot be created at all, TOKEN_unleased is returned.
+    """
+    token       = f"{socket.gethostname()}/{os.getpid()}/{time.time_ns()}"
+    holder_data = json.dumps( { "host": socket.gethostname(), "pid": os.getpid(), "token": token, "description": description } )
+
+    for _ in range(2):
+        try:
+            os.makedirs( os.path.dirname( lease_path ), exist_ok=True )
+            try:
+                lease_fd = os.open( lease_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644 )
+            except FileExistsError:
+                reclaim_if_dead( lease_path )
+                continue
+        except OSError as e:
+            logging.warning(f"Cannot create the lease {lease_path} ({e}), going on without one for {description}")
+            return TOKEN_unleased
+
+        try:
+            os.write( lease_fd, holder_data.encode('utf-8') )
+        finally:
+            os.close( lease_fd )
+
+        held_leases.add( lease_path )
+        start_heartbeat()
+
+        kernel_trace.trace( lambda: f"Acquired the lease {lease_path} for {description}" )
+        return token
+
+    return None
+
+
+def is_live(lease_path, token):
+    "Whether that particular holding of the lease (rather than a later one) is still going on"
+
+    holder_data = holder( lease_path )
+    return holder_data is not None and holder_data.get('token', token)==token
+
+
+def release(lease_path):
+    "Give the lease up (if it is ours)"
+
+    if lease_path in held_leases:
+        held_leases.discard( lease_path )
+        try:
+            os.remove( lease_path )
+        except OSError:
+            pass
+        kernel_trace.trace( lambda: f"Released the lease {lease_path}" )
+
+
+def wait_for_release(lease_path, timeout=None):
+    """Block until the lease is released or found dead.
+        Raises TimeoutError if its holder is still busy after the timeout.
+    """
+    timeout     = wait_timeout() if timeout is None else timeout
+    deadline    = time.time() + timeout
+    poll_delay  = 0.1
+    reported    = False
+
+    while True:
+        holder_data = holder( lease_path )
+        if holder_data is None:
+            return
+
+        if not reported:
+            logging.info(f"Waiting (up to {timeout:.0f}s) for {holder_data.get('description', 'another producer')} by pid={holder_data.get('pid')} on {holder_data.get('host')} ...")
+            reported = True
+
+        if time.time() >= deadline:
+            raise TimeoutError(f"Gave up after {timeout:.0f}s waiting for {holder_data.get('description', lease_path)} by pid={holder_data.get('pid')} on {holder_data.get('host')}. Set AXS_LEASE_TIMEOUT to wait longer")
+
+        time.sleep( min( poll_delay, max( deadline-time.time(), 0 ) ) )
+        poll_delay = min( poll_delay*2, 2.0 )
+
+
+if __name__ == '__main__':
+
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as lease_dir:
+        lease_path = lease_path_for( ["downloaded", "file_name=a.tar"], lease_dir )
+        assert lease_path==lease_path_for( ["file_name=a.tar", "downloaded", ""], lease_dir ), "The order of conditions should not matter"
+
+        token = acquire( lease_path, "test" )
+        assert token and holder( lease_path )["pid"]==os.getpid() and is_live( lease_path, token )
+
+        child_pid = os.fork()
+        if child_pid==0:
+            os._exit( 0 if not acquire( lease_path, "rival" ) else 1 )
+        assert os.waitpid( child_pid, 0 )[1]==0, "A live lease should not be taken by another process"
+
+        child_pid = os.fork()
+        if child_pid==0:
+            os._exit( 0 if threading.active_count()==1 and not held_leases else 1 )
+        assert os.waitpid( child_pid, 0 )[1]==0, "The heartbeat thread should not be running during a fork"
+        assert heartbeat_thread is not None and heartbeat_thread.is_alive(), "The heartbeat should resume in the parent after a fork"
+
+        release( lease_path )
+        assert holder( lease_path ) is None and not os.path.exists( lease_path ) and not is_live( lease_path, token )
+
+        child_pid = os.fork()
+        if child_pid==0:
+            acquire( lease_path, "doomed" )
+            os._exit( 0 )                       # dies holding the lease
+        os.waitpid( child_pid, 0 )
+        assert os.path.exists( lease_path ) and holder( lease_path ) is None, "The lease of a dead process should be dead"
+        wait_for_release( lease_path, timeout=1 )
+        new_token = acquire( lease_path, "reclaimer" )
+        assert new_token and not is_live( lease_path, token ), "A dead lease should be reclaimed, as a different holding"
+        release( lease_path )
+
+        old_time = time.time() - 2*LEASE_expiry
+        with open( lease_path, 'w' ) as lease_fd:
+            json.dump( { "host": "elsewhere", "pid": 1 }, lease_fd )
+        os.utime( lease_path, (old_time, old_time) )
+        assert holder( lease_path ) is None, "A lease with a stale heartbeat should be dead"
+        assert acquire( lease_path, "reclaimer" )
+        release( lease_path )
+
+        not_a_directory = os.path.join( lease_dir, 'not_a_directory' )
+        open( not_a_directory, 'w' ).close()
+        assert acquire( lease_path_for( ["unwritable"], not_a_directory ), "unwritable" )==TOKEN_unleased, "A lease that cannot be created should not stop the caller"
+
+    print("Leases: OK")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+""" A profiler for pipelines: records nested spans of the kernel's activity (pipelines, calls, nested calls and entry loading)
+    with the entry name, the action, the cache outcome, wall and CPU time.
+
+    The spans can be saved as a Chrome trace-event JSON file (open it in chrome://tracing or https://ui.perfetto.dev)
+    or summarized as a flat table of the hottest actions.
+    The instrumented methods are only wrapped while the profiler is enabled, so when it is disabled they run exactly as written.
+
+Usage examples :
+                axs --profile byquery shell_tool,can_python
+                AXS_PROFILE_PATH=/tmp/trace.json AXS_PROFILE_TOP=5 axs --profile byname pip , available_versions --package_name=numpy
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+enabled         = False
+completed_spans = []                    # in the order of completion
+open_spans      = threading.local()     # a stack of open spans per thread
+origin_time     = time.perf_counter()
+profiled_methods= []                    # (method, category, describe) registered by @profiled , in the order of definition
+
+
+def owner_class(method):
+    "The class a method has been defined in (at the top level of its module)"
+
+    owner = sys.modules[ method.__module__ ]
+    for name in method.__qualname__.split('.')[:-1]:
+        owner = getattr(owner, name)
+    return owner
+
+
+def start():
+    "Enable the profiler, forgetting all the spans recorded so far, and wrap the registered methods"
+
+    global enabled, origin_time
+    completed_spans.clear()
+    origin_time = time.perf_counter()
+    if not enabled:
+        for method, category, describe in profiled_methods:
+            setattr( owner_class(method), method.__name__, spanned(method, category, describe) )
+    enabled     = True
+
+
+def stop():
+    "Disable the profiler, keeping the spans recorded so far, and restore the registered methods as written"
+
+    global enabled
+    if enabled:
+        for method, _, _ in profiled_methods:
+            setattr( owner_class(method), method.__name__, method )
+    enabled = False
+
+
+def annotate(**details):
+    "Add details (such as the cache outcome) to the innermost open span of the current thread"
+
+    span_stack = getattr(open_spans, 'stack', None)
+    if span_stack:
+        span_stack[-1]["args"].update( details )
+
+
+def spanned(method, category, describe):
+    "Wrap a method so that its invocations are recorded as spans"
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        entry_name, action_name = describe(self, args, kwargs)
+        span_stack = getattr(open_spans, 'stack', None)
+        if span_stack is None:
+            span_stack = open_spans.stack = []
+
+        span = { "name": f"{entry_name}.{action_name}", "cat": category, "entry": entry_name, "action": action_name, "args": {},
+                 "children_time": 0.0, "start": time.perf_counter(), "cpu_start": time.thread_time() }
+        span_stack.append( span )
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            span_stack.pop()
+            span["wall"]    = time.perf_counter() - span["start"]
+            span["cpu"]     = time.thread_time() - span["cpu_start"]
+            span["tid"]     = threading.get_ident()
+            if span_stack:
+                span_stack[-1]["children_time"] += span["wall"]
+            completed_spans.append( span )
+
+    return wrapper
+
+
+def profiled(category, describe):
+    """Register a method (of a class defined at the top level of its module) so that its invocations are recorded as spans while the profiler is enabled.
+        The method itself is left as it is: start() replaces it with a wrapper in its class, stop() puts it back.
+        describe(self, args, kwargs) should return the (entry_name, action_name) pair for the span.
+    """
+    def decorator(method):
+        profiled_methods.append( (method, category, describe) )
+        return method
+
+    return decorator
+
+
+def chrome_trace():
+    "The recorded spans in Chrome's trace-event format"
+
+    pid = os.getpid()
+    trace_events = [ {
+        "name": span["name"], "cat": span["cat"], "ph": "X", "pid": pid, "tid": span["tid"],
+        "ts": (span["start"] - origin_time) * 1e6, "dur": span["wall"] * 1e6,
+        "args": dict( span["args"], entry=span["entry"], action=span["action"], cpu_ms=round(span["cpu"] * 1e3, 3) ),
+    } for span in completed_spans ]
+
+    return { "traceEvents": sorted(trace_events, key=lambda event: event["ts"]), "displayTimeUnit": "ms" }
+
+
+def save_chrome_trace(trace_path):
+    "Write the recorded spans into a file that can be loaded by chrome://tracing or Perfetto"
+
+    with open(trace_path, 'w') as trace_fd:
+        json.dump( chrome_trace(), trace_fd )
+    return trace_path
+
+
+def hottest_actions(top_n=20):
+    """Aggregate the recorded spans per entry.action and return the top_n rows sorted by self time (excluding nested spans):
+        [ (name, category, count, total_wall, self_wall, cpu, cache_hits), ... ]
+    """
+    rows = {}
+    for span in completed_spans:
+        row = rows.setdefault( span["name"], [ span["name"], span["cat"], 0, 0.0, 0.0, 0.0, 0 ] )
+        row[2] += 1
+        row[3] += span["wall"]
+        row[4] += span["wall"] - span["children_time"]
+        row[5] += span["cpu"]
+        row[6] += 1 if span["args"].get("cache") in ("hit", "store") else 0
+
+    return [ tuple(row) for row in sorted(rows.values(), key=lambda row: row[4], reverse=True)[:top_n] ]
+
+
+def format_hottest_actions(top_n=20):
+    "A human-readable table of the hottest actions"
+
+    lines = [ f"{'entry.action':60} {'category':9} {'count':>7} {'total_ms':>10} {'self_ms':>10} {'cpu_ms':>10} {'cached':>7}" ]
+    for name, category, count, total_wall, self_wall, cpu, cache_hits in hottest_actions(top_n):
+        lines.append( f"{name[:60]:60} {category:9} {count:7d} {total_wall*1e3:10.2f} {self_wall*1e3:10.2f} {cpu*1e3:10.2f} {cache_hits:7d}" )
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+
+    class Example:
+        name = 'example'
+
+        @profiled('call', lambda self, args, kwargs: (self.name, 'outer'))
+        def outer(self):
+            return self.inner() + self.inner()
+
+        @profiled('call', lambda self, args, kwargs: (self.name, 'inner'))
+        def inner(self):
+            annotate(cache="hit")
+            return sum(range(10000))
+
+    example = Example()
+    unwrapped_outer = Example.outer
+    assert example.outer()==2*sum(range(10000)) and completed_spans==[], "Nothing is recorded while disabled"
+
+    start()
+    assert Example.outer is not unwrapped_outer, "The methods are wrapped while enabled"
+    example.outer()
+    stop()
+    assert Example.outer is unwrapped_outer, "The methods are restored as written when disabled"
+
+    assert [ span["name"] for span in completed_spans ]==['example.inner', 'example.inner', 'example.outer'], "Spans are completed inside-out"
+    assert [ row[0] for row in hottest_actions() ][0]=='example.inner' and hottest_actions()[0][6]==2, "Aggregated per action with cache hits"
+    assert len(chrome_trace()["traceEvents"])==3 and chrome_trace()["traceEvents"][0]["name"]=='example.outer', "Events are ordered by their start"
+    print( format_hottest_actions() )
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+""" A planner that produces the independent dependencies of an action concurrently, before the action itself runs.
+
+    The parameters of an entry whose values are [ "^", "byquery", ... ] calls (or lists containing such calls, like python_deps)
+    are the "producer nodes". Every node depends on the other nodes whose parameters it references, directly or through
+    the parameters it references in turn (via get/dig/substitute anchors/exported names and so on).
+    The nodes are then evaluated in forked worker processes on a bounded pool, each node as soon as all its prerequisites are done.
+    The workers only leave their products on disk: the action itself runs as usual and simply finds them there.
+    A failed worker is not fatal: the node (and whatever depended on it) is left for the action to produce, reporting the error in-line.
+
+    The planning is opt-in per action, listed in the (inheritable) "parallel_producers_for" parameter.
+    The nodes whose products already exist are found by probing them in the parent (a byquery that does not produce), and are not forked for.
+    The pool size is set by AXS_JOBS (4 by default), AXS_JOBS=1 switches the planning off.
+
+    The same workers also apply pipelines to the entries matched by all_byquery --jobs=N (see map_in_workers()).
+
+Usage examples :
+                axs byname image_classification_using_onnxrt_py , run                   # "parallel_producers_for" is set in base_benchmark_program
+                AXS_JOBS=1 axs byname image_classification_using_onnxrt_py , run        # one after another, as before
+                axs func kernel_scheduler.plan --:=^:byname:image_classification_using_onnxrt_py
+                axs all_byquery git_repo ---='[["pull"]]' --jobs=8
+"""
+
+import json
+import logging
+import os
+import selectors
+import sys
+import time
+
+import kernel_trace
+import ufun
+from param_source import TEMPLATE_sub_regex
+
+in_worker       = False     # nested plans inside the workers would multiply the size of the pool
+
+
+def max_jobs():
+    "The size of the worker pool"
+
+    try:
+        return int( os.getenv('AXS_JOBS') or 4 )
+    except ValueError:
+        return 1
+
+
+def can_fork():
+    "Whether workers can be forked from this process (not on Windows, and not from another worker)"
+
+    return hasattr(os, 'fork') and not in_worker
+
+
+def can_schedule():
+    "Whether the planning should take place in this process at all"
+
+    return can_fork() and max_jobs()>1
+
+
+def is_producer_call(structure):
+    return type(structure)==list and len(structure)>2 and structure[0]=='^' and structure[1]=='byquery'
+
+
+def referenced_param_names(structure, known_names, found_names):
+    "Collect the names of known parameters mentioned anywhere in the structure: verbatim, as the head of a dotted key_path or inside #{anchors}#"
+
+    if type(structure)==str:
+        for candidate in [ structure ] + TEMPLATE_sub_regex.findall( structure ):
+            candidate = candidate.split('.')[0]
+            if candidate in known_names:
+                found_names.add( candidate )
+    elif type(structure)==list:
+        for element in structure:
+            referenced_param_names( element, known_names, found_names )
+    elif type(structure)==dict:
+        for key, value in structure.items():
+            referenced_param_names( key, known_names, found_names )
+            referenced_param_names( value, known_names, found_names )
+
+    return found_names
+
+
+def plan(__entry__):
+    """Find the producer nodes of the entry and their prerequisites (transitively), in the order of lookup:
+            [ ( node_name, param_name, index_or_None, producer_call, set_of_prerequisite_node_names ), ... ]
+    """
+    known_names = {}
+    for source in [ __entry__ ] + __entry__.linearised_ancestors():
+        for param_name in source.own_data():
+            if param_name[0]!='_' and param_name not in known_names:
+                known_names[param_name] = None
+
+    param_values = {}
+    def value_of(param_name):
+        if param_name not in param_values:
+            found_pair = next( __entry__.getitem_generator( param_name ), None )
+            param_values[param_name] = found_pair[1] if found_pair else None
+        return param_values[param_name]
+
+    nodes = []
+    nodes_by_param = {}
+    for param_name in known_names:
+        param_value = value_of( param_name )
+        if is_producer_call( param_value ):
+            node_list = [ (param_name, param_name, None, param_value) ]
+        elif type(param_value)==list and param_value[:1]!=['AS^IS']:
+            node_list = [ (f"{param_name}[{idx}]", param_name, idx, element) for idx, element in enumerate(param_value) if is_producer_call(element) ]
+        else:
+            node_list = []
+
+        nodes.extend( node_list )
+        if node_list:
+            nodes_by_param[param_name] = [ node[0] for node in node_list ]
+
+    planned_nodes = []
+    for node_name, param_name, idx, producer_call in nodes:
+        reached_names   = set()
+        names_to_visit  = referenced_param_names( producer_call, known_names, set() )
+        while names_to_visit:
+            reached_name = names_to_visit.pop()
+            if reached_name not in reached_names:
+                reached_names.add( reached_name )
+                if reached_name!=param_name:
+                    names_to_visit |= referenced_param_names( value_of(reached_name), known_names, set() )
+
+        prerequisites = set( other_node for reached_name in reached_names if reached_name!=param_name for other_node in nodes_by_param.get(reached_name, []) )
+        planned_nodes.append( (node_name, param_name, idx, producer_call, prerequisites) )
+
+    return planned_nodes
+
+
+def cached_data_stamps(ak):
+    "Stamps of the data files of all the stored entries cached by the kernel"
+
+    return { entry: entry.data_stamp( entry.get_parameters_path() ) for entry in list(ak.entry_cache.values()) if getattr(entry, 'entry_path', None) and entry.is_stored }
+
+
+def reload_changed_entries(ak, stamps):
+    "Pick up the changes that the workers have made to the cached entries (such as new members of the collections or removed entries)"
+
+    for entry, stamp in stamps.items():
+        new_stamp = entry.data_stamp( entry.get_parameters_path() )
+        if new_stamp!=stamp:
+            if new_stamp is None:
+                kernel_trace.trace( lambda: f"[{entry.get_name()}] has been removed by a worker, uncaching" )
+                ak.uncache( os.path.realpath( entry.get_path() ) )
+                entry.is_stored = False
+            else:
+                kernel_trace.trace( lambda: f"[{entry.get_name()}] has been changed by a worker, reloading" )
+                entry.reload()
+            stamps[entry] = new_stamp
+
+
+def fork_worker(work):
+    """Fork a worker process that runs work() and exits.
+        Returns the worker's pid and the descriptor to read its JSON-encoded outcome from:
+            [ true, result ]  or  [ false, error_message ]
+        The lease heartbeat thread (the only other thread) is stopped for the duration of the fork (see kernel_lease.stop_heartbeat()).
+    """
+    global in_worker
+    from stored_entry import flush_deferred_writes  # not at the top, as stored_entry depends on runnable, which depends on this module
+
+    flush_deferred_writes()     # the workers should find the data on disk up to date
+    read_fd, write_fd = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    worker_pid = os.fork()
+    if worker_pid==0:
+        in_worker   = True
+        exit_code   = 0
+        os.close( read_fd )
+        try:
+            outcome = [ True, work() ]
+            flush_deferred_writes()     # before the parent looks for the products
+        except BaseException as e:
+            import traceback
+            traceback.print_exc()
+            outcome     = [ False, f"{e.__class__.__name__}({e})" ]
+            exit_code   = 1
+        try:
+            encoded_outcome = json.dumps( outcome )
+        except (TypeError, ValueError) as e:
+            encoded_outcome = json.dumps( [ False, f"The result cannot be passed back: {e}" ] )
+            exit_code       = 1
+        try:
+            with os.fdopen( write_fd, 'w' ) as write_file:
+                write_file.write( encoded_outcome )
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit( exit_code )
+
+    os.close( write_fd )
+    return worker_pid, read_fd
+
+
+def wait_for_worker(running):
+    """Wait until any of the running workers { worker_pid: (read_fd, task_key, received_chunks) } finishes,
+        remove it from running and return its task_key and decoded outcome
+    """
+    with selectors.DefaultSelector() as selector:
+        for worker_pid, (read_fd, _, _) in running.items():
+            selector.register( read_fd, selectors.EVENT_READ, worker_pid )
+
+        while True:     # the outcomes are read as they come, so that no worker is blocked on a full pipe
+            for key, _ in selector.select():
+                worker_pid  = key.data
+                chunk       = os.read( key.fd, 65536 )
+                if chunk:
+                    running[worker_pid][2].append( chunk )
+                else:
+                    read_fd, task_key, received_chunks = running.pop( worker_pid )
+                    os.close( read_fd )
+                    os.waitpid( worker_pid, 0 )
+                    try:
+                        return task_key, json.loads( b"".join( received_chunks ) )
+                    except ValueError:
+                        return task_key, [ False, "The worker has died without reporting" ]
+
+
+def map_in_workers(work_function, items, jobs=None):
+    """Apply work_function to each of the items in forked workers, up to jobs at a time.
+        Returns the outcomes in the order of the items:  [ [ true, result ] or [ false, error_message ], ... ]
+        The results have to be JSON-serializable to make it back.
+    """
+    jobs        = jobs or max_jobs()
+    outcomes    = [ None ] * len(items)
+    running     = {}
+    next_idx    = 0
+
+    while next_idx<len(items) or running:
+        while next_idx<len(items) and len(running)<jobs:
+            worker_pid, read_fd = fork_worker( lambda item=items[next_idx]: work_function(item) )
+            running[worker_pid] = ( read_fd, next_idx, [] )
+            next_idx += 1
+
+        finished_idx, outcome = wait_for_worker( running )
+        outcomes[finished_idx] = outcome
+
+    return outcomes
+
+
+def evaluate_node(__entry__, planned_node):
+    "The work of a producer: evaluating the parameter (or the element of a list parameter), the products are left on disk"
+
+    _, param_name, idx, producer_call, _ = planned_node
+    if idx is None:
+        __entry__[param_name]
+    else:
+        __entry__.nested_calls( producer_call )
+
+
+def probe_node(__entry__, planned_node):
+    "Whether the product of the node already exists: the same byquery call is performed in this process, only without producing anything"
+
+    producer_call   = planned_node[3]
+    edit_dict       = producer_call[3] if len(producer_call)>3 else {}
+    if type(edit_dict)!=dict:
+        return False
+
+    try:
+        return __entry__.nested_calls( producer_call[:3] + [ dict(edit_dict, produce_if_not_found=False) ] + producer_call[4:] ) is not None
+    except Exception as e:
+        kernel_trace.trace( lambda: f"[{__entry__.get_name()}] Probing '{planned_node[0]}' has failed with {e.__class__.__name__}({e}), leaving it to the workers" )
+        return False
+
+
+def existing_nodes(__entry__, planned_nodes):
+    "The names of the nodes whose products already exist (a node is only probed once all its prerequisites are known to exist)"
+
+    existing    = set()
+    unprobed    = list( planned_nodes )
+    progressed  = True
+    while progressed:
+        progressed = False
+        for planned_node in list(unprobed):
+            if planned_node[4].issubset( existing ):
+                unprobed.remove( planned_node )
+                if probe_node( __entry__, planned_node ):
+                    existing.add( planned_node[0] )
+                    progressed = True
+
+    return existing
+
+
+def produce_concurrently(__entry__, jobs=None):
+    """Evaluate the producer nodes of the entry in worker processes, respecting their dependencies.
+        The nodes whose products already exist are found in this process first, so a warm run forks no workers at all.
+        Returns the list of node names that have been produced successfully (or found).
+    """
+    planned_nodes = plan( __entry__ )
+    if not any( a[0] not in b[4] and b[0] not in a[4] for a in planned_nodes for b in planned_nodes if a is not b ):
+        return []       # a chain (or less) gains nothing from running it elsewhere
+
+    produced        = list( existing_nodes( __entry__, planned_nodes ) )
+    missing_nodes   = [ planned_node for planned_node in planned_nodes if planned_node[0] not in produced ]
+    if not any( a[0] not in b[4] and b[0] not in a[4] for a in missing_nodes for b in missing_nodes if a is not b ):
+        return produced     # nothing (or just a chain) is left to produce
+
+    ak          = __entry__.get_kernel()
+    jobs        = jobs or max_jobs()
+    stamps      = cached_data_stamps( ak )
+    pending     = list( missing_nodes )
+    running     = {}
+    failed      = set()
+    start_time  = time.time()
+
+    logging.info(f"[{__entry__.get_name()}] Producing {len(missing_nodes)} dependencies with up to {jobs} workers: {[ node[0] for node in missing_nodes ]}")
+
+    while pending or running:
+        for planned_node in list(pending):
+            prerequisites = planned_node[4]
+            if prerequisites & failed:
+                pending.remove( planned_node )
+                failed.add( planned_node[0] )
+            elif len(running)<jobs and prerequisites.issubset( produced ):
+                pending.remove( planned_node )
+                worker_pid, read_fd = fork_worker( lambda planned_node=planned_node: evaluate_node( __entry__, planned_node ) )
+                running[worker_pid] = ( read_fd, planned_node, [] )
+
+        if not running:
+            break
+
+        planned_node, ( succeeded, details ) = wait_for_worker( running )
+        if succeeded:
+            produced.append( planned_node[0] )
+            reload_changed_entries( ak, stamps )    # the workers started from now on will see the products
+        else:
+            logging.warning(f"[{__entry__.get_name()}] The worker producing '{planned_node[0]}' has failed with {details}, leaving it to the action")
+            failed.add( planned_node[0] )
+
+    logging.info(f"[{__entry__.get_name()}] Produced {len(produced)-(len(planned_nodes)-len(missing_nodes))}/{len(missing_nodes)} dependencies in {time.time()-start_time:.2f}s")
+
+    return produced
+
+
+if __name__ == '__main__':
+
+    from runnable import Runnable
+
+    base = Runnable(name='base', own_data={
+        "model_name":       "resnet50",
+        "model_query":      [ "downloaded", [ "^^", "substitute", "model_name=#{model_name}#" ] ],
+        "model_entry":      [ "^", "byquery", [[ "^^", "get", "model_query" ]], {}, ["model_query"] ],
+        "dataset_name":     [ "^^", "dig", "model_entry.dataset_name" ],
+    })
+    derived = Runnable(name='derived', parent_objects=[ base ], own_data={
+        "images_entry":     [ "^", "byquery", [ "^^", "substitute", "preprocessed,dataset_name=#{dataset_name}#" ] ],
+        "python_deps":      [ "numpy_path", [ "^", "byquery", "python_package,package_name=numpy" ] ],
+        "_not_planned":     [ "^", "byquery", "hidden" ],
+    })
+
+    planned = { node_name: prerequisites for node_name, _, _, _, prerequisites in plan(derived) }
+    assert planned=={ "images_entry": {"model_entry"}, "python_deps[1]": set(), "model_entry": set() }, f"Unexpected plan: {planned}"
+    print(planned)
+
+    probed_nodes = []
+    def probe_node(__entry__, planned_node):
+        probed_nodes.append( planned_node[0] )
+        return planned_node[0]!="model_entry"
+
+    assert existing_nodes( derived, plan(derived) )=={ "python_deps[1]" } and "images_entry" not in probed_nodes, "A node is only probed once its prerequisites exist"
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+""" Pluggable backends that keep the data of a collection's entries somewhere other than one data_axs.json per entry directory.
+
+    A collection opts in by setting its entry_store parameter to the name of a backend ("sqlite" is the only one so far).
+    Its entries are then saved into the backend without directories of their own, unless they own files
+    (their directories exist at the time of saving), in which case they keep their directories and data_axs.json files as before.
+    Collections are never kept in a backend, as their membership journals need a directory.
+    A row of the backend is the entry's membership record, so the entries kept there are not listed in contained_entries .
+
+    A backend is a class constructed with the collection's path, providing:
+        load(entry_name)            -> the entry's data, or None if there is no such entry
+        load_many(entry_names)      -> { entry_name: data } for the ones that exist
+        save(entry_name, data)      within a transaction that lasts until commit()
+        remove(entry_name)          -> whether there was such an entry (also until commit())
+        contains(entry_name)
+        names()                     -> all the entry names, in the order of creation
+        matching_names(filter_list, also_names) -> the names of the entries that may match the pre-parsed query conditions
+                                       (see FilterPile in core_collection), together with also_names that exist, in the order of creation
+        commit()
+        store_path                  where the entries are kept
+        stamp_path                  the file whose stamp changes with every commit
+
+Usage examples :
+                axs fresh_entry , plant contained_entries '---={}' entry_store sqlite _parent_entries --,:=AS^IS:^:core_collection , save call_records
+                axs byname call_records , attached_entry ---='{"tags":["call_record"],"duration":12.5}' , save
+                axs byname call_records , all_byquery call_record,duration>10
+"""
+
+import json
+import os
+import sqlite3
+
+import kernel_trace
+
+PARAMNAME_entry_store   = 'entry_store'
+FILENAME_sqlite_store   = 'entries_axs.sqlite'
+SQLITE_busy_timeout     = 60    # seconds to wait for another process's write transaction
+SQLITE_wal_suffix       = '-wal'
+
+KIND_scalar             = 0     # the param's own value is indexed
+KIND_tags               = 1     # a list of strings, indexed in the tags table
+KIND_opaque             = 2     # anything else (or a value to be computed), only the name of the param is indexed
+
+open_stores             = {}    # ( backend_name, collection_path ) -> the backend object
+
+
+def store_for(collection):
+    "The backend keeping the entries of the given collection, or None if it keeps them in directories"
+
+    if collection is None:
+        return None
+
+    backend_name = collection.own_data().get( PARAMNAME_entry_store )
+    if not backend_name:
+        return None
+
+    store_key = ( backend_name, collection.get_path() )
+    if store_key not in open_stores:
+        if backend_name not in backends:
+            raise ValueError( f"Unknown {PARAMNAME_entry_store} '{backend_name}' of {collection.get_name()}, expected one of: {', '.join(backends)}" )
+        open_stores[store_key] = backends[backend_name]( collection.get_path() )
+
+    return open_stores[store_key]
+
+
+def index_kind(param_name, param_value):
+    "How the param is indexed, the same way as the index records of core_collection"
+
+    if param_value is None or type(param_value) in (str, int, float, bool):
+        return KIND_scalar
+    elif param_name=='tags' and type(param_value)==list and all(type(tag)==str for tag in param_value) and param_value[:1] not in (['^'], ['^^'], ['AS^IS']):
+        return KIND_tags
+    else:
+        return KIND_opaque
+
+
+def index_condition(key_path, op, val, comparison_lambda, split_key_path):
+    """Classify one pre-parsed query condition by how an index of the entries' own scalar params and tags can decide it:
+            ( 'tags', op, val )                 for op in 'tag+', 'tag-', '!:' on the tags
+            ( 'param', op, val, missing_ok )    for op in '.', '!.', '=', '!=', '<', '>', '<=', '>=' on a top-level param,
+                                                missing_ok being the outcome for an entry without this param
+        or None if only the proper matching can decide it (such as digging into a structure, or comparing with a list).
+    """
+    if len(split_key_path)!=1 or not key_path or key_path=='__entry__':
+        return None
+
+    if key_path=='tags' and op in ('tag+', ':', 'tag-', '!:'):
+        return ( 'tags', 'tag+' if op==':' else op, val )
+
+    comparable = type(val) in (str, int, float)
+    if op in ('.', '!.'):
+        pass
+    elif op in ('=', '?=') and comparable:
+        op = '='
+    elif op in ('!=', '<>', '!==') and comparable:
+        op = '!='
+    elif not (op in ('<', '>', '<=', '>=') and comparable):
+        return None
+
+    try:
+        missing_ok = bool( comparison_lambda( None ) )   # the same as what dig(safe=True) returns for a missing param
+    except TypeError:
+        missing_ok = True
+
+    return ( 'param', op, val, missing_ok )
+
+
+def condition_sql(*condition):
+    """Translate one pre-parsed query condition into an SQL condition on the name of a row of the entries table (with its parameters),
+        which is allowed to pass some entries that do not match (they are matched properly later), but not to lose any that do.
+        Returns None if the condition cannot be decided from the index.
+    """
+    decidable = index_condition( *condition )
+    if not decidable:
+        return None
+
+    if decidable[0]=='tags':
+        _, op, val  = decidable
+        tagged_sql  = "name IN (SELECT name FROM tags WHERE tag=?)"
+        if op=='tag+':
+            return f"({tagged_sql} OR name IN (SELECT name FROM params WHERE param='tags' AND kind={KIND_opaque}))", [ val ]
+        elif op=='tag-':
+            return f"NOT {tagged_sql}", [ val ]
+        else:
+            return f"(name IN (SELECT name FROM params WHERE param='tags' AND kind!={KIND_scalar}) AND NOT {tagged_sql})", [ val ]
+
+    _, op, val, missing_ok = decidable
+    key_path = condition[0]
+    if op=='.':
+        present_sql, present_params = "value IS NOT NULL", []
+    elif op=='!.':
+        present_sql, present_params = "value IS NULL", []
+    elif op=='=':
+        present_sql, present_params = "value=?", [ val ]
+    elif op=='!=':
+        present_sql, present_params = "value IS NOT ?", [ val ]
+    else:
+        incomparable_types = "'text','blob'" if type(val)!=str else "'integer','real'"     # Python would raise a TypeError, so let the proper matching deal with them
+        present_sql, present_params = f"(typeof(value) IN ({incomparable_types}) OR value{op}?)", [ val ]
+
+    indexed_sql = f"name IN (SELECT name FROM params WHERE param=? AND (kind!={KIND_scalar} OR {present_sql}))"
+    if missing_ok:
+        return f"(name NOT IN (SELECT name FROM params WHERE param=?) OR {indexed_sql})", [ key_path, key_path ] + present_params
+    else:
+        return indexed_sql, [ key_path ] + present_params
+
+
+class SQLiteStore:
+    """Keeps the data of a collection's entries as JSON in a single SQLite file (entries_axs.sqlite) inside the collection,
+        with the scalar params and the tags of each entry in indexed tables, so that queries are answered by SQL.
+        The file is in the write-ahead log mode, so a commit only appends to entries_axs.sqlite-wal (without syncing it).
+        This needs a local file system.
+    """
+
+    __slots__ = ('store_path', 'stamp_path', 'connection', 'connection_pid')
+
+    def __init__(self, collection_path):
+        self.store_path     = os.path.join( collection_path, FILENAME_sqlite_store )
+        self.stamp_path     = self.store_path + SQLITE_wal_suffix
+        self.connection     = None
+        self.connection_pid = None
+
+
+    def db(self):
+        "The connection, opened on first use (and reopened in a forked worker, which may not share its parent's)"
+
+        if self.connection_pid!=os.getpid():
+            self.connection = sqlite3.connect( self.store_path, timeout=SQLITE_busy_timeout )
+            self.connection_pid = os.getpid()
+            self.connection.executescript( """
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS entries (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS params (name TEXT NOT NULL, param TEXT NOT NULL, kind INTEGER NOT NULL, value, PRIMARY KEY (name, param)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS params_by_value ON params (param, value);
+                CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (tag, name)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS tags_by_name ON tags (name);
+            """ )
+            kernel_trace.trace( lambda: f"SQLiteStore: opened {self.store_path}" )
+
+        return self.connection
+
+
+    def load(self, entry_name):
+        row = self.db().execute( "SELECT data FROM entries WHERE name=?", (entry_name,) ).fetchone()
+        return json.loads( row[0] ) if row else None
+
+
+    def load_many(self, entry_names):
+        return { entry_name: json.loads( data ) for entry_name, data in self.db().execute( "SELECT name, data FROM entries WHERE name IN (SELECT value FROM json_each(?))", (json.dumps( list(entry_names) ),) ) }
+
+
+    def contains(self, entry_name):
+        return self.db().execute( "SELECT 1 FROM entries WHERE name=?", (entry_name,) ).fetchone() is not None
+
+
+    def names(self):
+        return [ entry_name for (entry_name,) in self.db().execute( "SELECT name FROM entries ORDER BY rowid" ) ]
+
+
+    def save(self, entry_name, data):
+        db = self.db()
+        db.execute( "INSERT INTO entries (name, data) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET data=excluded.data", (entry_name, json.dumps( data, separators=(',', ':') )) )     # an update keeps the place in the order of creation
+        db.execute( "DELETE FROM params WHERE name=?", (entry_name,) )
+        db.execute( "DELETE FROM tags WHERE name=?", (entry_name,) )
+
+        param_rows, tag_rows = [], []
+        for param_name, param_value in data.items():
+            kind = index_kind( param_name, param_value )
+            param_rows.append( (entry_name, param_name, kind, param_value if kind==KIND_scalar else None) )
+            if kind==KIND_tags:
+                tag_rows.extend( (tag, entry_name) for tag in set(param_value) )
+
+        db.executemany( "INSERT INTO params (name, param, kind, value) VALUES (?, ?, ?, ?)", param_rows )
+        db.executemany( "INSERT INTO tags (tag, name) VALUES (?, ?)", tag_rows )
+
+
+    def remove(self, entry_name):
+        db = self.db()
+        db.execute( "DELETE FROM params WHERE name=?", (entry_name,) )
+        db.execute( "DELETE FROM tags WHERE name=?", (entry_name,) )
+        return db.execute( "DELETE FROM entries WHERE name=?", (entry_name,) ).rowcount>0
+
+
+    def matching_names(self, filter_list=None, also_names=None):
+        where_clauses, where_params = [], []
+        for condition in filter_list or []:
+            translated = condition_sql( *condition )
+            if translated:
+                where_clauses.append( translated[0] )
+                where_params.extend( translated[1] )
+
+        where_sql = " AND ".join( where_clauses ) or "1"
+        if also_names:
+            where_sql = f"({where_sql}) OR name IN (SELECT value FROM json_each(?))"
+            where_params.append( json.dumps( list(also_names) ) )
+
+        kernel_trace.trace( lambda: f"SQLiteStore: querying {self.store_path} with {where_sql} {where_params}" )
+
+        return [ entry_name for (entry_name,) in self.db().execute( f"SELECT name FROM entries WHERE {where_sql} ORDER BY rowid", where_params ) ]
+
+
+    def commit(self):
+        if self.connection_pid==os.getpid():
+            self.connection.commit()
+
+
+backends = { 'sqlite': SQLiteStore }    # entry_store -> backend class
+
+
+if __name__ == '__main__':
+
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as collection_path:
+        store = SQLiteStore( collection_path )
+        store.save( "first",  { "tags": [ "record", "fast" ], "duration": 2, "host": "alpha" } )
+        store.save( "second", { "tags": [ "record" ], "duration": 12.5, "host": "beta", "extra": { "a": 1 } } )
+        store.save( "third",  { "tags": [ "^", "func", "tags_of_third" ], "duration": "n/a" } )
+        store.save( "fourth", { "tags": [ "note" ] } )
+        store.commit()
+        store.save( "first",  { "tags": [ "record", "fast" ], "duration": 3, "host": "alpha" } )
+
+        def matching(*filter_list):
+            return store.matching_names( [ (key_path, op, val, comparison_lambda, key_path.split('.')) for key_path, op, val, comparison_lambda in filter_list ] )
+
+        assert store.names()==[ "first", "second", "third", "fourth" ], "Updating an entry keeps its place"
+        assert store.load( "first" )["duration"]==3 and store.load( "fifth" ) is None and set( store.load_many( ["second", "fifth"] ) )=={ "second" }
+
+        assert matching( ("tags", "tag+", "record", None) )==[ "first", "second", "third" ], "Opaque tags cannot be ruled out"
+        assert matching( ("tags", "tag-", "record", None) )==[ "third", "fourth" ]
+        assert matching( ("duration", ">=", 3, lambda x: x!=None and x>=3) )==[ "first", "second", "third" ], "Incomparable values are left to the proper matching"
+        assert matching( ("duration", "<", 3, lambda x: x!=None and x<3) )==[ "third" ]
+        assert matching( ("host", "=", "beta", lambda x: x=="beta") )==[ "second" ]
+        assert matching( ("host", "!=", "beta", lambda x: x!="beta") )==[ "first", "third", "fourth" ], "A missing param is not equal to anything"
+        assert matching( ("host", "!.", None, lambda x: x is None) )==[ "third", "fourth" ]
+        assert matching( ("extra", ".", None, lambda x: x is not None), ("extra.a", "=", 1, lambda x: x==1) )==[ "second" ], "Digging is left to the proper matching"
+        assert matching( ("tags", "tag+", "record", None), ("duration", ">", 2.5, lambda x: x!=None and x>2.5), ("host", "=", "alpha", lambda x: x=="alpha") )==[ "first" ]
+
+        assert store.remove( "second" ) and not store.remove( "second" ) and not store.contains( "second" )
+        store.commit()
+        assert SQLiteStore( collection_path ).names()==[ "first", "third", "fourth" ], "Committed changes are seen by other connections"
+
+    print("Entry stores: OK")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+""" Zero-cost tracing for the kernel's hot paths (parameter access, calls, entry loading).
+
+    Debug messages in the hot paths are guarded by a single global flag that is checked before any formatting takes place:
+
+        if kernel_trace.enabled:
+            logging.debug(f"... {some_large_structure} ...")
+
+    so with tracing disabled none of the f-strings (and the reprs of whole dictionaries inside them) are ever built.
+    Off the hot paths (collection walks and queries, the call store, saving, leases, the scheduler, the store)
+    the messages are passed to trace() as lambdas instead, which is as lazy but saves the extra line:
+
+        kernel_trace.trace( lambda: f"... {some_large_structure} ..." )
+
+    The flag follows the root logger's level at import time; call refresh() after reconfiguring logging.
+
+Usage examples :
+                axs func kernel_trace.refresh
+                python3 kernel_trace.py         # run the self-test and the benchmark
+"""
+
+import logging
+
+enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+
+def refresh():
+    """Re-derive the flag from the current logging configuration (DEBUG level means tracing is on)
+
+Usage examples :
+                axs func kernel_trace.refresh
+    """
+    global enabled
+    enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+    return enabled
+
+
+def trace(make_message):
+    """Log a DEBUG message that is only built (by calling make_message) if tracing is enabled.
+        Convenient off the hot paths, where the guarded form would be too verbose.
+    """
+    if enabled:
+        logging.debug(make_message(), stacklevel=2)
+
+
+def untraced_module(module):
+    "Load a copy of a module with all the guarded debug messages stripped out - for benchmarking only"
+
+    import inspect
+    import re
+    import types
+
+    stripped_source = re.sub( r'^(\s*)if kernel_trace\.enabled:\n\s*logging\.debug\(.*\)[ \t]*(#.*)?$', r'\1pass', inspect.getsource(module), flags=re.MULTILINE )
+    untraced = types.ModuleType( module.__name__+'_untraced' )
+    exec( compile(stripped_source, module.__file__, 'exec'), untraced.__dict__ )
+    return untraced
+
+
+def benchmark_param_access(number_of_lookups=20000):
+    """Compare the throughput of parameter access with tracing disabled against a copy of ParamSource that has no tracing at all.
+        Returns the ratio of the two times (close to 1.0 means tracing is zero-cost when disabled).
+    """
+    import time
+    import param_source
+
+    def lookups_per_second(source_class):
+        large_data  = { f"key_{i}": [ i, { "nested": str(i) } ] for i in range(2000) }
+        grandparent = source_class(name='grandparent',  own_data=dict(large_data, deep_param="found"))
+        parent      = source_class(name='parent',       own_data=dict(large_data),  parent_objects=[grandparent])
+        child       = source_class(name='child',        own_data=dict(large_data),  parent_objects=[parent])
+
+        start_time = time.perf_counter()
+        for _ in range(number_of_lookups):
+            child['deep_param']
+        return number_of_lookups / (time.perf_counter() - start_time)
+
+    global enabled
+    saved_enabled, enabled = enabled, False
+    try:
+        untraced_class  = untraced_module(param_source).ParamSource
+        lookups_per_second(untraced_class)                  # warming up
+        untraced_rate   = lookups_per_second(untraced_class)
+        traced_rate     = lookups_per_second(param_source.ParamSource)
+    finally:
+        enabled = saved_enabled
+
+    print(f"Parameter access with tracing disabled: {traced_rate:.0f}/s , without any tracing: {untraced_rate:.0f}/s")
+    return untraced_rate / traced_rate
+
+
+def count_debug_messages(action):
+    "Run the action with the root logger at DEBUG level and return the number of debug messages it has logged"
+
+    class CountingHandler(logging.Handler):
+        def emit(self, record):
+            messages.append( record )
+
+    messages        = []
+    root_logger     = logging.getLogger()
+    handler         = CountingHandler( logging.DEBUG )
+    saved_level     = root_logger.level
+    root_logger.addHandler( handler )
+    root_logger.setLevel( logging.DEBUG )
+    try:
+        action()
+    finally:
+        root_logger.removeHandler( handler )
+        root_logger.setLevel( saved_level )
+
+    return len( messages )
+
+
+if __name__ == '__main__':
+
+    import kernel_trace     # the module the kernel checks, rather than this __main__ copy of it
+    import param_source
+
+    parent  = param_source.ParamSource(name='parent', own_data={ "deep_param": "found" })
+    child   = param_source.ParamSource(name='child', parent_objects=[parent])
+
+    kernel_trace.enabled = True
+    assert count_debug_messages( lambda: child['deep_param'] )>0, "Enabled tracing should log the parameter access"
+
+    kernel_trace.enabled = False
+    built_messages = []
+    assert count_debug_messages( lambda: child['deep_param'] )==0, "Disabled tracing should log nothing"
+    assert count_debug_messages( lambda: kernel_trace.trace( lambda: built_messages.append("a message") or "a message" ) )==0 and built_messages==[], "Disabled tracing should not even build the messages"
+
+    slowdown = benchmark_param_access()
+    print(f"Slowdown due to disabled tracing: {slowdown:.3f}")
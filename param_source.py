@@ -2,11 +2,39 @@
 
 import logging
 import re
-from copy import deepcopy
 
 
+import kernel_trace
 import ufun
 
+
+TEMPLATE_anchor_pattern     = '{}([\\w\\.]+){}'.format(re.escape('#{'), re.escape('}#'))
+TEMPLATE_full_regex         = re.compile(     TEMPLATE_anchor_pattern+'$' )
+TEMPLATE_sub_regex          = re.compile(     TEMPLATE_anchor_pattern     )
+TEMPLATE_cache_limit        = 4096
+compiled_templates          = {}    # template string -> its compiled form, shared by all ParamSources
+
+def compile_template(input_template):
+    """Parse a substitution template once and cache the result:
+        either the key_path (a str) if the template is made of exactly one anchor,
+        or a pair ( literals, key_paths ) with the literal segments surrounding the anchors (one more literal than anchors).
+    """
+    compiled_template = compiled_templates.get( input_template )
+    if compiled_template is None:
+        full_match = TEMPLATE_full_regex.match( input_template )
+        if full_match:
+            compiled_template = full_match.group(1)
+        else:
+            split_template      = TEMPLATE_sub_regex.split( input_template )    # alternating literals and key_paths
+            compiled_template   = ( split_template[0::2], split_template[1::2] )
+
+        if len(compiled_templates)>=TEMPLATE_cache_limit:
+            compiled_templates.clear()
+        compiled_templates[ input_template ] = compiled_template
+
+    return compiled_template
+
+
 class ParamSource:
     """ An object of ParamSource class is a non-persistent container of parameters
         that may optionally also have a parent object of the same class.
@@ -16,18 +44,32 @@ class ParamSource:
 
     PARAMNAME_parent_entries        = '_parent_entries'
 
+    lineage_generation              = 0     # bumped whenever loaded parents of any object are reset, invalidating all the linearised ancestries
+
+    # A call allocates a couple of these objects, so they are kept compact: no per-object __dict__,
+    # and the bookkeeping containers (runtime_stack_cache, blocked_param_set, value_tree_cache) stay None until first needed.
+    __slots__ = ('name', 'own_data_cache', 'own_data_digest_cache', 'value_tree_cache', 'parent_objects_cache',
+                 'lineage_cache', 'lineage_generation_cached', 'lineage_in_construction', 'runtime_stack_cache', 'blocked_param_set',
+                 'shared_values_owned', 'data_version')
+
     def __init__(self, name=None, own_data=None, parent_objects=None):
         "A trivial constructor"
 
         self.name                   = name
+        self.lineage_cache          = None
+        self.lineage_generation_cached = None
+        self.lineage_in_construction = False
         self.parent_objects         = parent_objects    # sic! The order of initializations is important; data-defined parents have a higher priority than code-assigned ones
-        self.runtime_stack_cache    = []
+        self.runtime_stack_cache    = None              # allocated by the first push
+        self.blocked_param_set      = None              # param_name -> set of the names of entries computing it, allocated by the first blocking
+        self.shared_values_owned    = None              # top_key -> ids of the containers copied so far from a value shared with a parent (see plant())
+        self.data_version           = 0                 # bumped by every change of own_data (see lineage_stamp())
+        self.forget_derived_data()
 
         self.set_own_data( own_data )
 
-        self.blocked_param_set      = {}
-
-        logging.debug(f"[{self.get_name()}] Initializing the ParamSource with own_data={self.own_data_cache}, inheriting from {'some parents' or 'no parents'}")
+        if kernel_trace.enabled:
+            logging.debug(f"[{self.get_name()}] Initializing the ParamSource with own_data={self.own_data_cache}, inheriting from {'some parents' or 'no parents'}")
 # FIXME: The following would cause infinite recursion (expecting cached entries before they actually end up in cache)
 #        logging.debug(f"[{self.get_name()}] Initializing the ParamSource with own_data={self.own_data_cache}, inheriting from {self.get_parents_names() or 'no parents'}")
 
@@ -38,6 +80,26 @@ class ParamSource:
         return (self.get_name() or 'Anonymous') + ':' + self.__class__.__name__ + ':'+ ufun.repr_dict(self.own_data(), [(self, "self")] )
 
 
+    def fingerprint(self):
+        """A short stringification of params used for building call_cache keys.
+            The digest of own_data is cached until it is changed via set_own_data(), plant() or __setitem__() (see forget_derived_data()),
+            so the cost does not depend on the size of the data.
+        """
+        if self.own_data_digest_cache is None:
+            self.own_data_digest_cache = 'cyclic'   # a placeholder in case the data refers back to us
+            self.own_data_digest_cache = ufun.structural_digest( self.own_data(), self )
+
+        return (self.get_name() or 'Anonymous') + ':' + self.__class__.__name__ + ':' + self.own_data_digest_cache
+
+
+    def forget_derived_data(self):
+        "Drop everything cached on the basis of own_data (its digest and the analysed values); to be called whenever own_data changes"
+
+        self.own_data_digest_cache  = None
+        self.value_tree_cache       = None  # param_name -> (value, its analysed form), allocated on demand
+        self.data_version          += 1
+
+
     def get_name(self):
         "Read-only access to the name"
 
@@ -46,11 +108,17 @@ class ParamSource:
 
     def set_own_data(self, mix_dict, topup=False):
 
+        self.forget_derived_data()
+
         if type(mix_dict)==dict:
             if (not topup or
                 not hasattr(self, "own_data_cache") or
                 self.own_data_cache is None) :
                     self.own_data_cache = {}
+                    self.shared_values_owned = None
+            elif self.shared_values_owned:
+                for key_path in mix_dict:
+                    self.shared_values_owned.pop( key_path, None )
 
             final_value_dict = self.own_data_cache
 
@@ -70,6 +138,7 @@ class ParamSource:
 
         else:
             self.own_data_cache = mix_dict
+            self.shared_values_owned = None
 
 
     def pure_data_loader(self):
@@ -103,18 +172,71 @@ Usage examples :
 
     def parents_loaded(self):
         if self.parent_objects==None:     # lazy-loading condition
-            logging.debug(f"[{self.get_name()}] Lazy-loading the parents...")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}] Lazy-loading the parents...")
             self.parent_objects = self.get(self.PARAMNAME_parent_entries, [])
             if None in self.parent_objects:
                 raise RuntimeError( f"Some of entry {self.get_name()}'s parents could not be loaded." ) # NB: part of the message should stay verbatim!
 
-            logging.debug(f"[{self.get_name()}] Parents loaded and cached.")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}] Parents loaded and cached.")
         else:
-            logging.debug(f"[{self.get_name()}] Parents have already been cached")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}] Parents have already been cached")
 
         return self.parent_objects
 
 
+    @property
+    def parent_objects(self):
+        "The list of parent objects, or None if it has not been (re)loaded yet"
+
+        return self.parent_objects_cache
+
+
+    @parent_objects.setter
+    def parent_objects(self, new_parent_objects):
+
+        if getattr(self, 'parent_objects_cache', None) is not None:     # resetting loaded parents may reshape the ancestry of any descendant
+            ParamSource.lineage_generation += 1
+
+        self.parent_objects_cache = new_parent_objects
+
+
+    def linearised_ancestors(self):
+        """The flat list of all the ancestors in the order their parameters are looked up:
+            depth-first, left to right, with repetitions kept (exactly the order of the recursive walk).
+            Cached until the loaded parents of any object are reset.
+
+Usage examples :
+                axs byname dont_be_like , linearised_ancestors
+        """
+        if self.lineage_cache is None or self.lineage_generation_cached!=ParamSource.lineage_generation:
+            if self.lineage_in_construction:
+                raise RuntimeError( f"Entry {self.get_name()} is its own ancestor, so its ancestry cannot be linearised" )
+
+            generation_before = ParamSource.lineage_generation
+            self.lineage_in_construction = True
+            try:
+                lineage = []
+                for parent_object in self.parents_loaded():
+                    lineage.append( parent_object )
+                    lineage.extend( parent_object.linearised_ancestors() )
+            finally:
+                self.lineage_in_construction = False
+
+            self.lineage_cache              = lineage
+            self.lineage_generation_cached  = generation_before
+
+        return self.lineage_cache
+
+
+    def lineage_stamp(self):
+        "A cheap token that changes whenever own_data of the object or of any of its ancestors changes, or the ancestry is reshaped"
+
+        return ( ParamSource.lineage_generation, self.data_version, *[ ancestor.data_version for ancestor in self.linearised_ancestors() ] )
+
+
     def get_parents_names(self):
         "Returns a string representation of the name list"
 
@@ -184,57 +306,94 @@ Usage examples :
 
         if new_stack_value is not None:
             self.runtime_stack_cache = new_stack_value
+        elif self.runtime_stack_cache is None:
+            self.runtime_stack_cache = []
 
         return self.runtime_stack_cache
 
 
-    def get_own_value_generator(self, param_name, asking_entry):
-        "Common part of accessing a parameter"
+    def get_own_value(self, param_name, asking_entry):
+        "Common part of accessing a parameter: returns a (self, value) pair if it is contained here (and not blocked), otherwise None"
 
         own_data = self.own_data()
         if param_name in own_data:
-            if asking_entry.get_name() in self.blocked_param_set.get(param_name, set()):
+            if self.blocked_param_set and asking_entry.get_name() in self.blocked_param_set.get(param_name, ()):
                 logging.warning(f"[{asking_entry.get_name()} -> {self.get_name()}] parameter '{param_name}' is contained here, but BLOCKED by this entry -- all blockers: {self.blocked_param_set[param_name]}")
             else:
                 param_value = own_data[param_name]
-                logging.debug(f"[{asking_entry.get_name()} -> {self.get_name()}]  parameter '{param_name}' is contained here, returning '{param_value}'")
-                yield (self, param_value)
+                if kernel_trace.enabled:
+                    logging.debug(f"[{asking_entry.get_name()} -> {self.get_name()}]  parameter '{param_name}' is contained here, returning '{param_value}'")
+                return (self, param_value)
         else:
-            logging.debug(f"[{asking_entry.get_name()} -> {self.get_name()}]  parameter '{param_name}' is not contained here, skipping further")
+            if kernel_trace.enabled:
+                logging.debug(f"[{asking_entry.get_name()} -> {self.get_name()}]  parameter '{param_name}' is not contained here, skipping further")
+
+        return None
+
+
+    def get_own_value_generator(self, param_name, asking_entry):
+
+        own_value_pair = self.get_own_value( param_name, asking_entry )
+        if own_value_pair:
+            yield own_value_pair
 
 
     def get_stack_value_generator(self, param_name, asking_entry):
 
-        for runtime_entry in self.runtime_stack():
+        for runtime_entry in self.runtime_stack_cache or ():     # not allocating the stack just to read it
             yield from runtime_entry.get_stack_value_generator( param_name, asking_entry )
 
         yield from self.get_own_value_generator( param_name, asking_entry )
 
 
     def getitem_generator(self, param_name, parent_recursion=None, asking_entry=None):
-        "Walk the potential sources of the parameter (runtime, own_data and the parents recursively)"
+        """Walk the potential sources of the parameter (runtime, own_data and the parents recursively).
+            Inheritable parameters are looked up in a flat loop over the linearised ancestors.
+        """
 
         asking_entry = asking_entry or self
-        logging.debug(f"[{self.get_name()}] Attempt to access parameter '{param_name}'...")
+        if kernel_trace.enabled:
+            logging.debug(f"[{self.get_name()}] Attempt to access parameter '{param_name}'...")
 
         yield from self.get_stack_value_generator( param_name, asking_entry )
 
         # trust the boolean value if it was defined,
         # otherwise the parameter's inheritability is encoded in its name:
         if parent_recursion if parent_recursion is not None else param_name[0]!='_':
-            for parent_object in self.parents_loaded():
-                if parent_object:
-                    logging.debug(f"[{self.get_name()}]  I don't have parameter '{param_name}', fallback to the parent '{parent_object.get_name()}'")
-                    try:
-                        yield from parent_object.getitem_generator(param_name, asking_entry=asking_entry)
-                    except StopIteration:
-                        logging.debug(f"[{self.get_name()}]  My parent '{parent_object.get_name()}'' did not know about '{param_name}'")
-                        pass
+            if param_name[0]=='_':
+                ancestors = self.parents_loaded()           # the parents' own copies of non-inheritable parameters, but not further
+            else:
+                try:
+                    ancestors = self.linearised_ancestors()
+                except RuntimeError:
+                    if kernel_trace.enabled:
+                        logging.debug(f"[{self.get_name()}]  The ancestry cannot be linearised, walking the parents recursively")
+                    yield from self.recursive_parents_generator( param_name, asking_entry )
+                    return
+
+            for ancestor in ancestors:
+                if ancestor.runtime_stack_cache:
+                    yield from ancestor.get_stack_value_generator( param_name, asking_entry )
                 else:
-                    raise RuntimeError( f"Some of entry {self.get_name()}'s parents could not be loaded, so their values cannot be inherited." ) # NB: part of the message should stay verbatim!
+                    own_value_pair = ancestor.get_own_value( param_name, asking_entry )
+                    if own_value_pair:
+                        yield own_value_pair
 
         else:
-            logging.debug(f"[{self.get_name()}]  No parent recursion for '{param_name}', skipping further")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}]  No parent recursion for '{param_name}', skipping further")
+
+
+    def recursive_parents_generator(self, param_name, asking_entry):
+        "The lazy fallback for broken or cyclic ancestries: parents are only loaded when reached, so the errors surface where they used to"
+
+        for parent_object in self.parents_loaded():
+            if parent_object:
+                if kernel_trace.enabled:
+                    logging.debug(f"[{self.get_name()}]  I don't have parameter '{param_name}', fallback to the parent '{parent_object.get_name()}'")
+                yield from parent_object.getitem_generator(param_name, asking_entry=asking_entry)
+            else:
+                raise RuntimeError( f"Some of entry {self.get_name()}'s parents could not be loaded, so their values cannot be inherited." ) # NB: part of the message should stay verbatim!
 
 
     def get_data_pile(self, param_name):
@@ -252,7 +411,8 @@ Usage examples :
         try:
             return next( self.getitem_generator( str(param_name), parent_recursion ) )[1]
         except StopIteration:
-            logging.debug(f"[{self.get_name()}]  I don't have parameter '{param_name}', and neither do the parents - raising KeyError")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}]  I don't have parameter '{param_name}', and neither do the parents - raising KeyError")
             raise KeyError(param_name)
 
 
@@ -307,25 +467,22 @@ Usage examples :
                 axs byname derived_map , substitute '#{first}#, #{third}# und #{fifth}#' --first=Erste
                 axs byname counting_collection , byname castellano , substitute '#{number_mapping.3}# + #{number_mapping.5}# = #{number_mapping.8}#'
         """
-        pre_pattern     = '{}([\\w\\.]+){}'.format(re.escape('#{'), re.escape('}#'))
-        full_pattern    = re.compile(     pre_pattern+'$' )
-        sub_pattern     = re.compile( '('+pre_pattern+')' )
-
         def scalar_substitute(input_template):
 
-            full_match = re.match(full_pattern, input_template)
-            if full_match:                          # input_template is made of exactly one anchor
-                key_path = full_match.group(1)
-                return self.dig( key_path, safe=True )         # output type is determined by the value
-            else:
-                output_string = input_template
+            if '#{' not in input_template:          # cheap pre-check: no anchors at all
+                return input_template
 
-                for sub_match in re.finditer(sub_pattern, input_template):  # input_template may contain 0 or more anchors
-                    expression, key_path = sub_match.group(1), sub_match.group(2)
-                    param_value  = self.dig( key_path, safe=True )
-                    output_string = output_string.replace(expression, str(param_value) )    # fit the output into a string
+            compiled_template = compile_template( input_template )
+            if type(compiled_template)==str:        # input_template is made of exactly one anchor
+                return self.dig( compiled_template, safe=True )        # output type is determined by the value
+            else:
+                literals, key_paths = compiled_template             # input_template may contain 0 or more anchors
+                output_parts = [ literals[0] ]
+                for key_path, literal in zip(key_paths, literals[1:]):
+                    output_parts.append( str( self.dig( key_path, safe=True ) ) )   # fit the output into a string
+                    output_parts.append( literal )
 
-                return output_string
+                return ''.join( output_parts )
 
         def substitute_once(input_structure):
             # Structural recursion:
@@ -359,7 +516,8 @@ Usage examples :
         try:
             return self.__getitem__(param_name)
         except KeyError:
-            logging.debug(f"[{self.get_name()}] caught KeyError: parameter '{param_name}' is missing, returning the default value '{default_value}'")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}] caught KeyError: parameter '{param_name}' is missing, returning the default value '{default_value}'")
             return default_value
 
 
@@ -377,6 +535,9 @@ Usage examples :
 
         param_name = str(param_name)
         self.own_data()[param_name] = param_value
+        self.forget_derived_data()
+        if self.shared_values_owned:
+            self.shared_values_owned.pop( param_name, None )
 
         if param_name==self.PARAMNAME_parent_entries:   # magic request to reload the parents
             self.parent_objects = None
@@ -411,13 +572,24 @@ Usage examples :
             if type(key_path)!=list:
                 key_path = key_path.split('.')
 
-            # pre-clone if necessary:
+            top_key = key_path[0]
+            if top_key.endswith('+'):
+                top_key = top_key[:-1]      # trim it off
+
+            # pre-clone if necessary. Copy-on-write: only the top container is copied now, the rest of the value stays shared
+            # (with the parent, typically) until a later key_path descends into it:
             if (len(key_path)>1 or key_path[-1].endswith('+')) and (key_path[0] not in self.own_data()):
-                top_key = key_path[0]
-                if top_key.endswith('+'):
-                    top_key = top_key[:-1]      # trim it off
-                self.__setitem__( top_key, deepcopy( self.__getitem__(top_key, perform_nested_calls=False) ) )
+                shared_value = self.__getitem__(top_key, perform_nested_calls=False)
+                if type(shared_value) in (list, dict):
+                    owned_value = type(shared_value)(shared_value)
+                    self.__setitem__( top_key, owned_value )
+                    if self.shared_values_owned is None:
+                        self.shared_values_owned = {}
+                    self.shared_values_owned[ top_key ] = { id(owned_value) }
+                else:
+                    self.__setitem__( top_key, shared_value )
 
+            owned_ids = self.shared_values_owned.get( top_key ) if self.shared_values_owned else None
 
             struct_ptr = self.own_data()
 
@@ -437,6 +609,9 @@ Usage examples :
                     struct_ptr[key_syllable] = {}               # explicit dict vivification
 
                 if key_idx<last_idx:
+                    if owned_ids is not None and type(struct_ptr[key_syllable]) in (list, dict) and id(struct_ptr[key_syllable]) not in owned_ids:
+                        struct_ptr[key_syllable] = type(struct_ptr[key_syllable])(struct_ptr[key_syllable])     # copy on write
+                        owned_ids.add( id(struct_ptr[key_syllable]) )
                     struct_ptr = struct_ptr[key_syllable]       # iterative descent
                 elif pluck:
                     struct_ptr.pop(key_syllable)
@@ -449,6 +624,8 @@ Usage examples :
             if key_path == [ self.PARAMNAME_parent_entries ]:   # magic request to reload the parents
                 self.parent_objects = None
 
+        self.forget_derived_data()
+
         return self
 
 
@@ -486,6 +663,7 @@ Usage examples :
 if __name__ == '__main__':
 
     logging.basicConfig(level=logging.DEBUG, format="%(levelname)s:%(funcName)s %(message)s")
+    kernel_trace.refresh()
 
     print('-'*20 + ' Dictionary-like data access: ' + '-'*20)
 
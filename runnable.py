@@ -1,15 +1,124 @@
 #!/usr/bin/env python3
 
 import inspect
+import itertools
 import logging
+import os
 import re
 import sys
+import uuid
 from copy import deepcopy
 
 import function_access
+import kernel_profile
+import kernel_scheduler
+import kernel_trace
 import ufun
 from param_source import ParamSource
 
+SCALAR_types    = (str, int, float, bool, type(None))
+
+def is_flat(structure):
+    "Whether a shallow copy of the structure is as good as a deep one (it is a scalar, or a list or a dict of scalars)"
+
+    if type(structure) in SCALAR_types:
+        return True
+    elif type(structure) in (list, dict):
+        return all( type(element) in SCALAR_types for element in (structure.values() if type(structure)==dict else structure) )
+    else:
+        return False
+
+
+def copied_containers(structure):
+    "A copy of all the lists and dicts the structure is made of (the scalars and other objects are shared)"
+
+    if type(structure)==list:
+        return [ copied_containers(element) for element in structure ]
+    elif type(structure)==dict:
+        return { key: copied_containers(value) for key, value in structure.items() }
+    else:
+        return structure
+
+
+class CallRecord:
+    """The facts of a local_call (who called what with which parameters, and what it returned), kept compact.
+        The full call record Entry is only built when __record_entry__ (or a pipeline label bound to the call) is actually read,
+        since most records are never looked at or saved.
+    """
+
+    __slots__ = ('caller', 'action_name', 'rt_call_specific', 'captured_mapping', 'prepared', 'result', 'record_entry', 'record_id')
+
+    NO_RESULT       = object()
+    id_prefix       = uuid.uuid4().hex     # keeps the fingerprints unique across processes, as the generated names of the records used to be
+    id_counter      = itertools.count()
+
+    def __init__(self, caller, action_name, rt_call_specific):
+        self.caller             = caller
+        self.action_name        = action_name
+        self.rt_call_specific   = rt_call_specific
+        self.captured_mapping   = {}        # filled in by function_access.prep() and merged into the own_data of the record
+        self.prepared           = False
+        self.result             = self.NO_RESULT
+        self.record_entry       = None
+        self.record_id          = next(self.id_counter)
+
+
+    def fingerprint(self):
+        return f"CallRecord:{self.id_prefix}:{self.record_id}"
+
+
+    def mark_prepared(self):
+        "The mapping has been captured: if the record has already been built, it can be completed now"
+
+        self.prepared = True
+        if self.record_entry is not None:
+            self.complete()
+
+
+    def set_result(self, result):
+        self.result = result
+        if self.record_entry is not None and result is not self.record_entry:
+            self.record_entry['__result__'] = result    # only visible if save()d after execution (not all application cases)
+
+
+    def complete(self):
+        "Add the captured mapping, the parameters that were given but not needed by the call, and the recipe to replay it"
+
+        captured_mapping = self.record_entry.own_data()
+        captured_mapping.update( self.captured_mapping )
+
+        # adding all key-value pairs that were mentioned in the edit_dict, but not needed by the call(), to make sure they also get recorded
+        missing_filter_keys = set(self.rt_call_specific.own_data()) - set(captured_mapping.keys()) - {'__entry__', '__record_entry__'}
+        for mfk in missing_filter_keys:
+            captured_mapping[mfk] = self.rt_call_specific[mfk]
+
+        for a in ('__entry__', '__record_entry__'):
+            if a in captured_mapping:
+                del captured_mapping[a]
+
+        captured_mapping["_replay"] = [ "^^", "execute", [
+            [ [ "get_kernel" ] ] +
+            ( [ self.caller.pickle_one()[1:] ] if hasattr(self.caller, 'pickle_one') else [] ) +
+            [ [ self.action_name ] ]    # assuming all parameters have been properly recorded (scattered around) the record and are thus available
+        ] ]
+
+        if self.result is not self.NO_RESULT and self.result is not self.record_entry:
+            captured_mapping['__result__'] = self.result
+
+        self.record_entry.forget_derived_data()
+
+
+    def entry(self):
+        "Build (once) the call record Entry around the captured mapping"
+
+        if self.record_entry is None:
+            ak = self.caller.get_kernel()
+            self.record_entry = ak.fresh_entry(container=ak.record_container(), generated_name_prefix=f"generated_by_{self.caller.get_name()}_on_{self.action_name}_")
+            if self.prepared:
+                self.complete()
+
+        return self.record_entry
+
 
 class Runnable(ParamSource):
     """An object of Runnable class is a non-persistent container of parameters (inherited) and code (own)
@@ -20,16 +129,22 @@ class Runnable(ParamSource):
 
     pipeline_counter                = 0
     ESCAPE_do_not_process           = 'AS^IS'
+    PARAMNAME_persistent_calls      = 'persistent_calls'
+    PARAMNAME_parallel_producers_for = 'parallel_producers_for'
+
+    __slots__ = ('own_functions_cache', 'kernel', 'call_cache', 'action_sets_cache')
 
     def __init__(self, own_functions=None, kernel=None, **kwargs):
         "Accept setting own_functions and kernel in addition to parent's parameters"
 
         self.own_functions_cache    = own_functions
         self.kernel                 = kernel
-        self.call_cache             = {}
+        self.call_cache             = None  # allocated by the first cached call
+        self.action_sets_cache      = None  # param_name -> (lineage_stamp, set of action names), allocated on demand (see action_set())
 
         super().__init__(**kwargs)
-        logging.debug(f"[{self.get_name()}] Initializing the Runnable with {self.list_own_functions() if self.own_functions_cache else 'no'} pre-loaded functions and kernel={self.kernel}")
+        if kernel_trace.enabled:
+            logging.debug(f"[{self.get_name()}] Initializing the Runnable with {self.list_own_functions() if self.own_functions_cache else 'no'} pre-loaded functions and kernel={self.kernel}")
 
 
     def get_kernel(self):
@@ -47,6 +162,12 @@ class Runnable(ParamSource):
         return self.own_functions_cache or False
 
 
+    def code_fingerprint(self):
+        "Placeholder for a digest of the code loaded by subclasses from the file system (in-memory functions do not contribute)"
+
+        return ''
+
+
     def list_own_functions(self):
         """A lightweight method to list all own methods of an entry
 
@@ -78,19 +199,22 @@ Usage examples :
     def reach_action(self, action_name, _ancestry_path=None):
         "First try to reach for a Runnable's function (externally loaded code), if unavailable - try Runnable's method instead."
 
-        logging.debug(f"[{self.get_name()}] reach_action({action_name}) ...")
+        if kernel_trace.enabled:
+            logging.debug(f"[{self.get_name()}] reach_action({action_name}) ...")
         if _ancestry_path == None:  # if we have to initialize it internally, the value will be lost to the caller
             _ancestry_path = []
 
         function_object, ancestry_path = self.reach_function( action_name )
         if function_object:
-            logging.debug(f"[{self.get_name()}] reach_action({action_name}) was found as a function")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}] reach_action({action_name}) was found as a function")
 
             _ancestry_path.extend( ancestry_path )
             return function_object
 
         elif hasattr(self, action_name):
-            logging.debug(f"[{self.get_name()}] reach_action({action_name}) was found as a class method")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}] reach_action({action_name}) was found as a class method")
 
             return getattr(self, action_name)
         else:
@@ -206,7 +330,8 @@ Usage examples :
         """Lazy parameter access: returns the parameter value from self or the closest parent,
             automatically executing nested_calls on the result.
         """
-        logging.debug(f"[{self.get_name()}]  Looking for [{param_name}]...")
+        if kernel_trace.enabled:
+            logging.debug(f"[{self.get_name()}]  Looking for [{param_name}]...")
 
         if param_name=='__entry__':
             return self
@@ -216,29 +341,44 @@ Usage examples :
             value_source_entry, unprocessed_value   = next(getitem_gen)
 
         except StopIteration:
-            logging.debug(f"[{self.get_name()}]  I don't have parameter '{param_name}', and neither do the parents - raising KeyError")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}]  I don't have parameter '{param_name}', and neither do the parents - raising KeyError")
             raise KeyError(param_name)
 
-        if perform_nested_calls:
-            if param_name not in value_source_entry.blocked_param_set:
-                value_source_entry.blocked_param_set[param_name] = set()
+        value_tree = value_source_entry.compiled_value(param_name, unprocessed_value) if perform_nested_calls else None
 
-            value_source_entry.blocked_param_set[param_name].add(self.get_name())
+        if value_tree is not None:  # pure data has nothing to compute, and so nothing to block
+            blocked_param_set = value_source_entry.blocked_param_set
+            if blocked_param_set is None:
+                blocked_param_set = value_source_entry.blocked_param_set = {}
+            if param_name not in blocked_param_set:
+                blocked_param_set[param_name] = set()
 
-            logging.debug(f"[{self.get_name()}]  BLOCKING '{param_name}' in order to compute nested_calls on {unprocessed_value} ...")
+            blocked_param_set[param_name].add(self.get_name())
+
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}]  BLOCKING '{param_name}' in order to compute nested_calls on {unprocessed_value} ...")
             try:
-                param_value = self.nested_calls(unprocessed_value)
+                param_value = self.nested_calls(unprocessed_value, value_tree)
             except Exception as e:
-                logging.debug(f"[{self.get_name()}]  unBLOCKING '{param_name}' after attempt to compute nested_calls on {unprocessed_value} ...")
-                del value_source_entry.blocked_param_set[param_name]
+                if kernel_trace.enabled:
+                    logging.debug(f"[{self.get_name()}]  unBLOCKING '{param_name}' after attempt to compute nested_calls on {unprocessed_value} ...")
+                del blocked_param_set[param_name]
                 raise e
-            logging.debug(f"[{self.get_name()}]  unBLOCKING '{param_name}' after computing nested_calls on {unprocessed_value} ...")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}]  unBLOCKING '{param_name}' after computing nested_calls on {unprocessed_value} ...")
 
-            value_source_entry.blocked_param_set[param_name].remove(self.get_name())
+            blocked_param_set[param_name].remove(self.get_name())
+            if not blocked_param_set[param_name]:
+                del blocked_param_set[param_name]
         else:
             param_value = unprocessed_value
 
-        logging.debug(f"[{self.get_name()}]  Got {param_name}={param_value}")
+        if type(param_value)==CallRecord:
+            param_value = param_value.entry()   # the record is only built when somebody actually wants it
+
+        if kernel_trace.enabled:
+            logging.debug(f"[{self.get_name()}]  Got {param_name}={param_value}")
 
         return param_value
 
@@ -264,6 +404,44 @@ Usage examples :
             return self.local_call( action_path, *the_pos_rest, **the_named_rest )
 
 
+    def call_cache_key(self, action_name, pos_params=None, edit_dict=None):
+        """Build the key under which the result of a call is cached: the call itself and the fingerprints of the runtime stack entries.
+            Entries contribute their cached fingerprints, so the cost does not depend on the size of their data.
+        """
+        cache_tail = '\n\t+'.join([s.fingerprint() for s in self.runtime_stack()])
+        return f"{action_name}.{ufun.structural_digest(pos_params)}/{ufun.structural_digest(edit_dict)}\n\t+{cache_tail}"
+
+
+    def action_set(self, param_name):
+        """The set of action names listed in an inheritable parameter (such as "persistent_calls"),
+            cached until own_data of the entry or of any of its ancestors changes.
+
+Usage examples :
+                axs byname base_imagenet_experiment , action_set persistent_calls
+        """
+        lineage_stamp = self.lineage_stamp()
+        if self.action_sets_cache is None:
+            self.action_sets_cache = {}
+
+        stamp_and_set = self.action_sets_cache.get( param_name )
+        if stamp_and_set is None or stamp_and_set[0]!=lineage_stamp:
+            stamp_and_set = self.action_sets_cache[ param_name ] = ( lineage_stamp, frozenset( self.get( param_name ) or [] ) )
+
+        return stamp_and_set[1]
+
+
+    def persistent_call_key(self, action_name, joint_arg_tuple, optional_arg_dict):
+        """The key under which the result of a call is stored across processes: the action, the code of the entry and all its ancestors,
+            the resolved arguments the action is fed with and the stamps of the files named by them (given as absolute paths),
+            so that the stored result goes stale as soon as any of them changes.
+        """
+        named_args          = { arg_name: arg_value for arg_name, arg_value in optional_arg_dict.items() if arg_name!='__record_entry__' }
+        file_stamps         = [ ufun.file_stamp( arg_value ) for arg_value in itertools.chain( joint_arg_tuple, named_args.values() ) if type(arg_value)==str and os.path.isabs( arg_value ) ]
+        code_fingerprints   = [ ancestor.code_fingerprint() for ancestor, _ in self.parent_generator() ]
+        return ufun.structural_digest( [ action_name, code_fingerprints, list(joint_arg_tuple), named_args, file_stamps ] )
+
+
+    @kernel_profile.profiled('call', lambda self, args, kwargs: (self.get_name(), args[0] if args else kwargs.get('action_name')))
     def local_call(self, action_name, pos_params=None, edit_dict=None, export_params=None, deterministic=True, call_record_entry_ptr=None, nested_context=None, slice_relative_to=None):
         """Call a given function or method of a given entry and feed it
             with arguments from the current object optionally overridden by a given edit_dict
@@ -274,19 +452,34 @@ Usage examples :
                 axs mi: fresh_entry , plant alpha 10  beta 20  formula --:='AS^IS:^^:substitute:#{alpha}#-#{beta}#' , get formula
                 axs mi: fresh_entry , plant alpha 10  beta 20  formula --:='AS^IS:^^:substitute:#{alpha}#-#{beta}#' , get formula , get mi , get formula
                 axs mi: fresh_entry , plant alpha 10  beta 20  formula --:='AS^IS:^^:substitute:#{alpha}#-#{beta}#' , get formula , get mi , get formula --alpha=100
+
+            The actions listed in the (inheritable) "persistent_calls" parameter additionally have their JSON-able results
+            kept in the kernel's call_store across processes, until their resolved arguments, the files named by them
+            or the code of the entry or its ancestors change:
+                axs byname base_imagenet_experiment , get class_names
+                axs call_store bypass , , byname base_imagenet_experiment , get class_names
+
+            Before the actions listed in the (inheritable) "parallel_producers_for" parameter, the independent byquery dependencies
+            of the entry are produced concurrently (see kernel_scheduler.py).
         """
 
-        logging.debug(f'[{self.get_name()}]  calling action "{action_name}" with pos_params={pos_params} and edit_dict={edit_dict} ...')
+        if kernel_trace.enabled:
+            logging.debug(f'[{self.get_name()}]  calling action "{action_name}" with pos_params={pos_params} and edit_dict={edit_dict} ...')
 
-        cache_tail = '\n\t+'.join([repr(s) for s in self.runtime_stack()])
-        cache_key = f"{action_name}.{pos_params}/{ufun.repr_dict(edit_dict)}\n\t+{cache_tail}"
+        cache_key = self.call_cache_key(action_name, pos_params, edit_dict)
 
-        if deterministic and (cache_key in self.call_cache):
+        if deterministic and self.call_cache and (cache_key in self.call_cache):
             cached_value = self.call_cache[cache_key]
-            logging.debug(f"[{self.get_name()}]  Call '{cache_key}' is FOUND IN CACHE, returning {cached_value}")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}]  Call '{cache_key}' is FOUND IN CACHE, returning {cached_value}")
+            if kernel_profile.enabled:
+                kernel_profile.annotate(cache="hit")
             return cached_value
         else:
-            logging.debug(f"[{self.get_name()}]  Call '{cache_key}' NOT TAKEN from cache, have to run...")
+            if kernel_trace.enabled:
+                logging.debug(f"[{self.get_name()}]  Call '{cache_key}' NOT TAKEN from cache, have to run...")
+            if kernel_profile.enabled:
+                kernel_profile.annotate(cache="miss")
 
 
         ak = self.get_kernel()
@@ -317,12 +510,15 @@ Usage examples :
         # FIXME: this is a candidate for deletion. Be sure to seriously test the hell out of it
         rt_call_specific.own_data( self.nested_calls( rt_call_specific.own_data() ) )   # perform the delayed interpretation of expressions
 
+        if ak and action_name in self.action_set(self.PARAMNAME_parallel_producers_for) and kernel_scheduler.can_schedule():
+            kernel_scheduler.produce_concurrently( rt_call_specific )       # the independent byquery dependencies of the action are produced in advance
+
         if ak:
-            call_record_entry   = ak.fresh_entry(container=ak.record_container(), generated_name_prefix=f"generated_by_{self.get_name()}_on_{action_name}_")
-            captured_mapping    = call_record_entry.own_data()  # retain the pointer to perform modifications later
+            call_record         = CallRecord(self, action_name, rt_call_specific)
+            captured_mapping    = call_record.captured_mapping  # retain the pointer to perform modifications later
         else:
             captured_mapping    = None  # request not to capture the mapping
-            call_record_entry   = None  # to please a testing edge case
+            call_record         = None  # to please a testing edge case
 
         if pos_params is None:
             pos_params = []                                 # allow pos_params to be missing
@@ -339,95 +535,151 @@ Usage examples :
             joint_arg_tuple     = pos_params
             optional_arg_dict   = rt_call_specific.own_data()
         else:
-            rt_call_specific['__record_entry__'] = call_record_entry    # the order is important: first nested_calls() (potentially blocked by {"AS^IS": {}}  then add __record_entry__
+            rt_call_specific['__record_entry__'] = call_record          # the order is important: first nested_calls() (potentially blocked by {"AS^IS": {}}  then add __record_entry__
             action_object, joint_arg_tuple, optional_arg_dict   = function_access.prep(action_object, pos_params, self, captured_mapping)
 
 
         if ak:
-            # adding all key-value pairs that were mentioned in the edit_dict, but not needed by the call(), to make sure they also get recorded
-            missing_filter_keys = set(rt_call_specific.own_data()) - set(captured_mapping.keys())
-            for mfk in missing_filter_keys:
-                call_record_entry[mfk] = rt_call_specific[mfk]
-
-            for a in ('__entry__', '__record_entry__'):
-                if a in captured_mapping:
-                    del captured_mapping[a]
-
-            call_record_entry["_replay"] = [ "^^", "execute", [
-                [ [ "get_kernel" ] ] +
-                ( [ self.pickle_one()[1:] ] if hasattr(self, 'pickle_one') else [] ) +
-                [ [ action_name ] ]     # assuming all parameters have been properly recorded (scattered around) call_record_entry and are thus available
-            ] ]
+            call_record.mark_prepared()                     # the rest of the record is only filled in if it gets built
 
             if call_record_entry_ptr is not None:           # making it available to the pipeline
-                call_record_entry_ptr.append( call_record_entry )
+                call_record_entry_ptr.append( call_record )
 
 
-        result          = function_access.feed(action_object, joint_arg_tuple, optional_arg_dict)
+        persistent_key  = None
+        found_stored    = False
+        if deterministic and ak and ak.call_store_mode!='bypass' and action_name in self.action_set(self.PARAMNAME_persistent_calls):
+            persistent_key = self.persistent_call_key(action_name, joint_arg_tuple, optional_arg_dict)
+            if ak.call_store_mode=='on':
+                found_stored, result = ak.call_store_load(persistent_key)
+                if found_stored:
+                    if kernel_trace.enabled:
+                        logging.debug(f"[{self.get_name()}]  Call '{cache_key}' is FOUND IN CALL STORE, returning {result}")
+                    if kernel_profile.enabled:
+                        kernel_profile.annotate(cache="store")
+
+        if not found_stored:
+            result      = function_access.feed(action_object, joint_arg_tuple, optional_arg_dict)
 
         self.runtime_stack().pop()
 
-        if ak and result!=call_record_entry :
-            call_record_entry['__result__'] = result    # only visible if save()d after execution (not all application cases)
+        if ak:
+            call_record.set_result( result )
 
-        logging.debug(f'[{self.get_name()}]  called action "{action_name}" with {pos_params}, got {result}')
+        if kernel_trace.enabled:
+            logging.debug(f'[{self.get_name()}]  called action "{action_name}" with {pos_params}, got {result}')
+        if self.call_cache is None:
+            self.call_cache = {}
         self.call_cache[cache_key] = result
 
+        if persistent_key and not found_stored:
+            ak.call_store_save(persistent_key, result, f"{self.get_name()}.{action_name}")
+
         return result
 
 
-    def nested_calls(self, unprocessed_struct):
-        """Walk over the structure and perform any nested calls found in it.
-            Can be quite expensive for large structures, but ok for a prototype.
+    @classmethod
+    def compile_nested_calls(cls, input_structure):
+        """Analyse the structure once, returning None if it is pure data (contains no calls or escapes),
+            or a tree that leads only to the nodes that need evaluation:
+                ( '^^' | '^' , call_structure )
+                ( 'AS^IS' , escaped_value , whether_it_is_flat )
+                ( '[]' | '{}' , container , [ (index_or_key, subtree), ... ] )
+
+Usage examples :
+                axs compile_nested_calls ---='{"pure": [1, 2, 3], "impure": ["^^", "get", "alpha"]}'
+        """
+        if type(input_structure)==list and len(input_structure):
+            head = input_structure[0]
+            if head=='^^' or head=='^':
+                return ( head, input_structure )
+            elif head==cls.ESCAPE_do_not_process:
+                escaped_value = input_structure[1:]                                                     # drop the escape symbol, keeping the rest of the substructure intact
+                return ( cls.ESCAPE_do_not_process, escaped_value, is_flat( escaped_value ) )
+            else:
+                subtrees = [ (idx, subtree) for idx, subtree in enumerate( map(cls.compile_nested_calls, input_structure) ) if subtree is not None ]
+                return ( '[]', input_structure, subtrees ) if subtrees else None
+        elif type(input_structure)==dict:
+            if cls.ESCAPE_do_not_process in input_structure:
+                escaped_value = input_structure[cls.ESCAPE_do_not_process]                              # follow just this one key (keeping the value intact), NB: all other keys of the dict are ignored
+                return ( cls.ESCAPE_do_not_process, escaped_value, is_flat( escaped_value ) )
+            else:
+                subtrees = [ (k, subtree) for k, subtree in zip( input_structure, map(cls.compile_nested_calls, input_structure.values()) ) if subtree is not None ]
+                return ( '{}', input_structure, subtrees ) if subtrees else None                 # only values are substituted
+        else:
+            return None
+
+
+    def compiled_value(self, param_name, unprocessed_value):
+        """The analysed form of own parameter's value, cached until own_data changes.
+            Only the changes made through the entry (plant(), __setitem__, set_own_data() and so on) are noticed, not editing own_data() in place.
+        """
+
+        if self.value_tree_cache is None:
+            self.value_tree_cache = {}
+
+        value_and_tree = self.value_tree_cache.get( param_name )
+        if value_and_tree is None or value_and_tree[0] is not unprocessed_value:
+            value_and_tree = self.value_tree_cache[ param_name ] = ( unprocessed_value, self.compile_nested_calls( unprocessed_value ) )
+
+        return value_and_tree[1]
+
+
+    @kernel_profile.profiled('nested', lambda self, args, kwargs: (self.get_name(), 'nested_calls'))
+    def nested_calls(self, unprocessed_struct, value_tree=False):
+        """Perform any nested calls found in the structure.
+            Unless value_tree (the result of compile_nested_calls() on the same structure) is given, the structure is analysed first.
+            Pure data is returned as it is, otherwise only the branches leading to calls and escapes are evaluated,
+            but all the containers of the result are copies, so that editing the result does not edit the entry.
 
 Usage examples :
                 axs noop  --:='^^:substitute:#{alpha}#-#{beta}#' --alpha=11 --beta=22
                 axs noop  --:='AS^IS:^^:substitute:#{alpha}#-#{beta}#'
                 axs nested_calls  --:='AS^IS:^^:substitute:#{alpha}#-#{beta}#' --alpha=11 --beta=22
         """
+        if value_tree is False:
+            value_tree = self.compile_nested_calls(unprocessed_struct)
 
-        side_effects_count = 0
-
-        def nested_calls_rec(input_structure):
-            nonlocal side_effects_count
-
-            if type(input_structure)==list and len(input_structure):
-                head = input_structure[0]
-                if head=='^^':
-                    side_effects_count += 1
-                    try:
-                        return self.call( *input_structure[1:], slice_relative_to=self )
-                    except Exception as e:
-                        as_part = f"\nas part of\n\t{unprocessed_struct}" if input_structure!=unprocessed_struct else ""
-                        logging.error(f"[{self.get_name()}] While computing\n\t{input_structure}{as_part}\nthe following exception was raised:\n\t{e.__class__.__name__}({e})\n"+ ("="*120) )
-                        raise e
-                elif head=='^':
-                    side_effects_count += 1
-                    try:
-                        return self.get_kernel().call( *input_structure[1:], slice_relative_to=self )
-                    except Exception as e:
-                        as_part = f" as part of {unprocessed_struct}" if input_structure!=unprocessed_struct else ""
-                        print("-"*120 + f"\n[{self.get_name()}] While computing {input_structure}{as_part} the following exception was raised:\n\t{e.__class__.__name__}({e})\n"+ "="*120, file=sys.stderr)
-                        raise e
-                elif head==self.ESCAPE_do_not_process:
-                    side_effects_count += 1                                                         # it is only a "side effect" for the purposes of our GC-facilitating decision making below
-                    return deepcopy( input_structure[1:] )                                          # drop the escape symbol, keeping the rest of the substructure intact
-                else:
-                    return [ nested_calls_rec(elem) for elem in input_structure ]                   # list elements are substituted
-            elif type(input_structure)==dict:
-                if self.ESCAPE_do_not_process in input_structure:
-                    side_effects_count += 1                                                         # it is only a "side effect" for the purposes of our GC-facilitating decision making below
-                    return deepcopy( input_structure[self.ESCAPE_do_not_process] )                  # follow just this one key (keeping the value intact), NB: all other keys of the dict are ignored
+        def evaluate(tree):
+            kind = tree[0]
+            if kind=='^^':
+                input_structure = tree[1]
+                try:
+                    return self.call( *input_structure[1:], slice_relative_to=self )
+                except Exception as e:
+                    as_part = f"\nas part of\n\t{unprocessed_struct}" if input_structure!=unprocessed_struct else ""
+                    logging.error(f"[{self.get_name()}] While computing\n\t{input_structure}{as_part}\nthe following exception was raised:\n\t{e.__class__.__name__}({e})\n"+ ("="*120) )
+                    raise e
+            elif kind=='^':
+                input_structure = tree[1]
+                try:
+                    return self.get_kernel().call( *input_structure[1:], slice_relative_to=self )
+                except Exception as e:
+                    as_part = f" as part of {unprocessed_struct}" if input_structure!=unprocessed_struct else ""
+                    print("-"*120 + f"\n[{self.get_name()}] While computing {input_structure}{as_part} the following exception was raised:\n\t{e.__class__.__name__}({e})\n"+ "="*120, file=sys.stderr)
+                    raise e
+            elif kind==self.ESCAPE_do_not_process:     # a private copy, so that editing the result does not edit the entry
+                escaped_value = tree[1]
+                if not tree[2]:
+                    return deepcopy( escaped_value )
+                elif type(escaped_value) in (list, dict):
+                    return type(escaped_value)(escaped_value)
                 else:
-                    return { k : nested_calls_rec(input_structure[k]) for k in input_structure }    # only values are substituted
+                    return escaped_value
             else:
-                return input_structure
-
-        processed_struct = nested_calls_rec(unprocessed_struct)
+                container   = tree[1]
+                if kind=='[]':
+                    processed = [ copied_containers(element) for element in container ]
+                else:
+                    processed = { key: copied_containers(value) for key, value in container.items() }
+                for idx_or_key, subtree in tree[2]:
+                    processed[idx_or_key] = evaluate(subtree)
+                return processed
 
-        return processed_struct if side_effects_count else unprocessed_struct                   # keeping the original if unchanged should help with GC
+        return unprocessed_struct if value_tree is None else evaluate(value_tree)   # keeping the original if unchanged should help with GC
 
 
+    @kernel_profile.profiled('pipeline', lambda self, args, kwargs: (self.get_name(), 'execute'))
     def execute(self, pipeline, pipeline_wide_data=None):
         """Execute a parsed pipeline (a chain of calls that starts from the kernel object).
             Whenever a result returned by a function is NOT an Runnable, the execution resets back to the kernel object.
@@ -569,8 +821,10 @@ Usage examples :
                 axs byquery python_package,package_name=numpy , use , func numpy.arange 7                       # if we need our own specific numpy
                 axs byquery python_package,package_name=numpy , use , func numpy.exp2 --,=0,1,2,3,4,5,6,7,8     # same, passing a list
         """
-        if '.' in func_name:                                            # an imported "dotted" function (can be several dots deep)
+        if func_name.startswith('.'):                                   # a method of self
             func_object = self.attr(func_name)
+        elif '.' in func_name:                                          # an imported "dotted" function (can be several dots deep), resolved once
+            func_object = function_access.resolve_dotted_name(func_name, self.attr)
         else:                                                           # a built-in function
             func_object = __builtins__[func_name]
 
@@ -627,6 +881,7 @@ def plus_one(number):
 if __name__ == '__main__':
 
     logging.basicConfig(level=logging.DEBUG, format="%(levelname)s:%(funcName)s %(message)s")
+    kernel_trace.refresh()
 
     print('-'*40 + ' Creating a hierarchy of Runnables: ' + '-'*40)
 
@@ -682,3 +937,51 @@ if __name__ == '__main__':
         print(f"child.call('nonexistent')={child.call('nonexistent')}\n")
     except NameError as e:
         assert str(e)=="could not find the action 'nonexistent' neither among the ancestors (child, dad, granddad, mum) nor in the Runnable class"
+
+    print('-'*40 + ' Testing call_cache_key(): ' + '-'*40)
+
+    import timeit
+
+    def cache_key_time(list_size, repetitions=200):
+        "Time computing a cache key while an entry with a list of list_size elements is passed around"
+
+        dataset         = Runnable(name='dataset', own_data={ "input_file_list": [ f"ILSVRC2012_val_{i:08}.JPEG" for i in range(list_size) ] })
+        consumer        = Runnable(name='consumer')
+        rt_call_specific= Runnable(name='rt_call_specific')
+        consumer.runtime_stack( [ rt_call_specific ] )
+
+        def one_key():
+            rt_call_specific.set_own_data( { "dataset": dataset } )     # a fresh per-call entry has no fingerprint yet
+            return consumer.call_cache_key( 'get', [ 'dataset' ], { "dataset": dataset } )
+
+        first_key = one_key()   # the dataset's own fingerprint is computed only once
+        dataset.own_data()["input_file_list"].append( "edited_behind_its_back.JPEG" )     # only walking the data again would notice this
+        assert one_key()==first_key, "call_cache_key() should use the cached fingerprints of the entries involved rather than walk their data"
+
+        return min( timeit.repeat(one_key, number=repetitions, repeat=3) ) / repetitions
+
+    small_time, large_time = cache_key_time(10), cache_key_time(50000)
+    print(f"call_cache_key() takes {small_time*1e6:.1f}us with a 10-element entry and {large_time*1e6:.1f}us with a 50000-element entry")
+
+    print('-'*40 + ' Testing copy-on-write plant(): ' + '-'*40)
+
+    base        = Runnable(name='base', own_data={ "big": { f"k{i}": { "v": i, "l": [i, i] } for i in range(50000) }, "escaped": { "AS^IS": { "a": [1, 2] } } })
+    derived     = Runnable(name='derived', parent_objects=[ base ])
+    sibling     = Runnable(name='sibling', parent_objects=[ base ])
+
+    derived.plant('big.k7.v', -7, 'big.k9.l+', 99, 'big.k9.l.0', -9)
+    sibling.plant('big.k9.l.1', 0)
+
+    assert base['big']['k7']=={"v": 7, "l": [7, 7]} and base['big']['k9']=={"v": 9, "l": [9, 9]}, "The parent's value should not change"
+    assert derived['big']['k7']['v']==-7 and derived['big']['k9']['l']==[-9, 9, 99] and sibling['big']['k9']['l']==[9, 0]
+    assert derived['big']['k8'] is base['big']['k8'], "The branches not planted into should be shared"
+
+    escaped_copy = derived['escaped']
+    escaped_copy['a'].append(3)
+    assert derived['escaped']=={ "a": [1, 2] }, "Editing an escaped value should not edit the entry"
+
+    base['mixed'] = { "pure": { "l": [1, 2] }, "computed": [ "^^", "get", "escaped" ] }
+    mixed_copy = derived['mixed']
+    mixed_copy['pure']['l'].append(3)
+    assert derived['mixed']=={ "pure": { "l": [1, 2] }, "computed": { "a": [1, 2] } }, "Editing a computed value should not edit the entry"
+    assert base.own_data()['mixed']['pure']=={ "l": [1, 2] }
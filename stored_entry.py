@@ -1,21 +1,120 @@
 #!/usr/bin/env python3
 
+import atexit
+import hashlib
 import importlib.util
+import json
 import logging
 import os
+import shutil
 import sys
 import uuid
 
+import kernel_store
+import kernel_trace
 import ufun
 from runnable import Runnable
 
 
+code_digest_cache = {}  # file_path -> (file_stamp, digest) , shared by all the Entries loaded by the process
+deferred_writes   = {}  # key (the path to be written) -> the function writing it , in the order of deferral
+prefetched_data   = {}  # parameters_path -> the data read in advance by a cold-start loader (see MicroKernel.encache_prefetched()), until the entry loads it
+flushing_deferred = False  # whether the deferred writes are being performed, which are then also synced to the disk
+sidecar_origins   = {}  # id(value loaded from a sidecar) -> (that value, the sidecar's path, the digest of its contents) , to link rather than copy the value when it is saved elsewhere
+SIDECAR_origins_limit = 16  # only the most recently loaded values are remembered, so the others can be garbage-collected
+
+
+def write_behind():
+    "Whether the writes of the already stored entries are deferred until the next sync point (AXS_WRITE_BEHIND=1)"
+
+    return os.getenv('AXS_WRITE_BEHIND', '') not in ('', '0')
+
+
+def defer_write(key, write_function):
+    "Schedule a write for the next sync point, superseding any write still pending for the same key"
+
+    deferred_writes[key] = write_function
+
+
+def discard_deferred_write(key):
+    "Cancel a pending write (for example, if the entry has been removed meanwhile)"
+
+    return deferred_writes.pop(key, None) is not None
+
+
+def flush_deferred_writes():
+    """Perform all the pending writes in the order they were first deferred, returning their number.
+        Called at the sync points: the end of a pipeline, before forking workers or running shell commands, on exit.
+    """
+    global flushing_deferred
+
+    flushed = 0
+    flushing_before, flushing_deferred = flushing_deferred, True
+    try:
+        while deferred_writes:
+            key = next(iter(deferred_writes))
+            deferred_writes.pop(key)()
+            flushed += 1
+    finally:
+        flushing_deferred = flushing_before
+
+    if flushed and kernel_trace.enabled:
+        logging.debug(f"Flushed {flushed} deferred writes")
+    return flushed
+
+atexit.register( flush_deferred_writes )
+
+
+def commit_entry_store(store):
+    "Commit the changes made to a collection's store (see kernel_store) at once, or at the next sync point in the write-behind mode"
+
+    if write_behind():
+        defer_write( store.store_path, store.commit )
+    else:
+        store.commit()
+
+
+def sidecar_contents(value):
+    "The file suffix and the contents of a sidecar holding a large list: one string per line if possible, compact JSON otherwise"
+
+    if all( type(element)==str and '\n' not in element for element in value ):
+        return '.sidecar_axs.txt', ( '\n'.join(value) + '\n' ).encode('utf-8', 'surrogateescape')
+    else:
+        return '.sidecar_axs.json', json.dumps( value, separators=(',', ':') ).encode('utf-8')
+
+
+def parse_sidecar(sidecar_path, contents):
+    "The inverse of sidecar_contents()"
+
+    if sidecar_path.endswith('.txt'):
+        return contents.decode('utf-8', 'surrogateescape')[:-1].split('\n')
+    else:
+        return json.loads( contents )
+
+
+def remember_sidecar_origin(value, sidecar_path, digest):
+    "Remember which sidecar a large value has come from, forgetting the least recently remembered value beyond SIDECAR_origins_limit"
+
+    sidecar_origins.pop( id(value), None )
+    if len(sidecar_origins)>=SIDECAR_origins_limit:
+        sidecar_origins.pop( next(iter(sidecar_origins)) )
+    sidecar_origins[ id(value) ] = ( value, sidecar_path, digest )
+
+
 class Entry(Runnable):
     "An Entry is a Runnable stored in the file system"
 
     FILENAME_parameters     = 'data_axs.json'
+    FILENAME_membership_journal = 'membership_axs.jsonl'    # attach/detach records appended since data_axs.json was last written
     MODULENAME_functions    = 'code_axs'     # the actual filename ends in .py
     PREFIX_gen_entryname    = 'generated_entry_'
+    ESCAPE_sidecar          = 'SIDECAR^'     # { "SIDECAR^": file_name } in data_axs.json stands for a large value kept in that file of the entry
+    SIDECAR_min_length      = 1000           # lists at least this long are saved into sidecars
+    PARAMNAME_sidecar_params = 'sidecar_params' # the names of the entry's own list parameters that may be saved into sidecars (set by the entry's producer)
+    PARAMNAME_fan_out_levels = 'fan_out_levels'  # a collection with this set keeps its new entries under hashed subdirectories
+    PARAMNAME_own_directory = 'own_directory'   # an entry with this (inheritable) parameter set is never kept in its collection's store, as it exposes the paths of its files (see base_experiment)
+
+    __slots__ = ('generated_name_prefix', 'container_object', 'entry_path', 'parameters_path', 'module_name', 'is_stored')
 
     def __init__(self, entry_path=None, parameters_path=None, module_name=None, container=None, generated_name_prefix=None, is_stored=None, **kwargs):
         "Accept setting entry_path in addition to parent's parameters"
@@ -30,11 +129,12 @@ class Entry(Runnable):
 
         self.parameters_path        = parameters_path
         self.module_name            = module_name or self.MODULENAME_functions
-        self.is_stored              = is_stored if type(is_stored)==bool else os.path.exists(entry_path)
+        self.is_stored              = is_stored if type(is_stored)==bool else os.path.exists(entry_path) or self.kept_in_store( os.path.basename(entry_path) )
 
         super().__init__(**kwargs)
 
-        logging.debug(f"[{self.get_name()}] Initializing the Entry with entry_path={self.entry_path}, parameters_path={self.parameters_path}, module_name={self.module_name}, generated_name_prefix={self.generated_name_prefix}")
+        if kernel_trace.enabled:
+            logging.debug(f"[{self.get_name()}] Initializing the Entry with entry_path={self.entry_path}, parameters_path={self.parameters_path}, module_name={self.module_name}, generated_name_prefix={self.generated_name_prefix}")
 
 
     def generate_name(self, prefix=''):
@@ -58,8 +158,8 @@ Usage examples :
         if os.path.isabs( new_path ):           # absolute path
             self.entry_path = new_path
 
-        elif self.container_object:             # relative to container
-            self.entry_path = os.path.join( self.container_object.get_path( new_path ) )
+        elif self.container_object:             # relative to container (under its hashed subdirectories if it has them)
+            self.entry_path = os.path.join( self.container_object.get_path( self.container_object.fanned_out_path( new_path ) ) )
 
         else:                                   # relative to cwd
             self.entry_path = os.path.realpath( new_path )
@@ -121,6 +221,24 @@ Usage examples :
         return abs_path
 
 
+    def fanned_out_path(self, entry_name, fan_out_levels=None):
+        """The path of a new entry relative to this collection: either the entry_name itself,
+            or the entry_name under fan_out_levels of subdirectories named after its hash (ab/cd/entry_name),
+            which keeps the directories small in very large collections. The levels default to the collection's own fan_out_levels.
+
+Usage examples :
+                axs work_collection , fanned_out_path generated_entry_0123456789 --fan_out_levels=2
+        """
+        if fan_out_levels is None:
+            fan_out_levels = self.own_data().get( self.PARAMNAME_fan_out_levels ) or 0
+
+        if not fan_out_levels or os.path.sep in entry_name:
+            return entry_name
+
+        name_digest = hashlib.sha1( entry_name.encode('utf-8') ).hexdigest()
+        return os.path.join( *[ name_digest[2*level:2*level+2] for level in range(fan_out_levels) ], entry_name )
+
+
     def trim_path(self, input_path):
         """Transform path to relative-to-entry if inside entry, or absolute if outside
         """
@@ -164,10 +282,51 @@ Usage examples :
         return self.parameters_path or self.get_path( self.FILENAME_parameters )
 
 
+    @classmethod
+    def data_stamp(cls, parameters_path):
+        """A cheap fingerprint of the stored data: data_axs.json together with the membership journal next to it (if there is one),
+            or None if the data file is missing.
+
+Usage examples :
+                axs func stored_entry.Entry.data_stamp core_collection/data_axs.json
+        """
+        parameters_stamp = ufun.file_stamp( parameters_path )
+        if parameters_stamp and os.path.basename( parameters_path )==cls.FILENAME_parameters:
+            journal_stamp = ufun.file_stamp( os.path.join( os.path.dirname( parameters_path ), cls.FILENAME_membership_journal ) )
+            if journal_stamp:
+                return parameters_stamp + journal_stamp
+
+        return parameters_stamp
+
+
     def get_module_name(self):
         return self.module_name
 
 
+    def code_fingerprint(self):
+        """A digest of the contents of the entry's code file (empty if there is none).
+            It is only recomputed when the file's stamp changes.
+
+Usage examples :
+                axs byname shell , code_fingerprint
+        """
+        if self.entry_path is None:
+            return ''
+
+        file_path   = os.path.join( self.entry_path, self.get_module_name()+'.py' )
+        stamp       = ufun.file_stamp( file_path )
+        if stamp is None:
+            return ''
+
+        cached_stamp, digest = code_digest_cache.get( file_path, (None, None) )
+        if cached_stamp!=stamp:
+            with open( file_path, 'rb' ) as code_fd:
+                digest = hashlib.blake2b( code_fd.read(), digest_size=16 ).hexdigest()
+            code_digest_cache[ file_path ] = (stamp, digest)
+
+        return digest
+
+
     def get_container(self):
         return self.container_object
 
@@ -195,6 +354,10 @@ Usage examples :
         if container:
             container.call('add_entry_path', [self.get_path(''), self.get_name()] )
 
+            ak = self.get_kernel()
+            if ak:
+                ak.name_table_add( self, container )
+
         return self
 
 
@@ -204,6 +367,11 @@ Usage examples :
         container = self.get_container()
         if container:
             container.call("remove_entry_name", self.get_name() )
+
+            ak = self.get_kernel()
+            if ak:
+                ak.name_table_discard( self, container )
+
             self.container_object = None
         else:
             logging.warning(f"[{self.get_name()}] was not attached to a container")
@@ -211,14 +379,150 @@ Usage examples :
         return self
 
 
+    def data_store(self):
+        "The backend keeping the entry's data if its collection has one (see kernel_store), otherwise None"
+
+        return None if self.parameters_path else kernel_store.store_for( self.container_object )
+
+
+    def kept_in_store(self, entry_name=None):
+        "Whether the entry's data is kept in its collection's store rather than in its own directory"
+
+        store = self.data_store()
+        return bool( store and store.contains( entry_name or self.get_name() ) )
+
+
     def pure_data_loader(self):
-        "Returns the dictionary loaded or the (stringifiable) exception object"
+        "Returns the dictionary loaded (with the membership journal replayed on top) or the (stringifiable) exception object"
 
         parameters_path = self.get_parameters_path()
+        loaded_data     = prefetched_data.pop( parameters_path, None )
+        if loaded_data is None:
+            store = self.data_store()
+            if store:
+                loaded_data = store.load( self.get_name() )     # None if it is one of the collection's entries that own files
+        if loaded_data is None:
+            try:
+                loaded_data = ufun.load_json( parameters_path )
+            except OSError as e:
+                return e
+
+        if type(loaded_data)==dict and 'contained_entries' in loaded_data and self.entry_path and not self.parameters_path:
+            self.replay_membership_journal( loaded_data )   # only the collections may have a journal, so the others are spared a failing open()
+
+        return loaded_data
+
+
+    def get_own_value(self, param_name, asking_entry):
+        "Also loads the value from its sidecar when it is first asked for"
+
+        own_value_pair = super().get_own_value(param_name, asking_entry)
+        if own_value_pair and type(own_value_pair[1])==dict and self.ESCAPE_sidecar in own_value_pair[1]:
+            own_value_pair = (self, self.load_sidecar(param_name))
+
+        return own_value_pair
+
+
+    def load_sidecar(self, param_name):
+        """Load a large parameter from its sidecar file, replacing the reference in own_data
+
+Usage examples :
+                axs byquery preprocessed,dataset_name=imagenet , load_sidecar input_file_list
+        """
+        param_value = self.own_data()[param_name]
+        if type(param_value)!=dict or self.ESCAPE_sidecar not in param_value:
+            return param_value      # already loaded
+
+        sidecar_path = os.path.join( self.entry_path, param_value[self.ESCAPE_sidecar] )
         try:
-            return ufun.load_json( parameters_path )
+            with open( sidecar_path, 'rb' ) as sidecar_fd:
+                contents = sidecar_fd.read()
         except OSError as e:
-            return e
+            logging.error(f"[{self.get_name()}] Could not load parameter '{param_name}' from its sidecar {sidecar_path}: {e}")
+            raise
+
+        param_value = parse_sidecar( sidecar_path, contents )
+        remember_sidecar_origin( param_value, sidecar_path, hashlib.sha1( contents ).hexdigest() )
+        self.own_data_cache[ param_name ] = param_value     # no need to forget the derived data, as the value has not changed
+
+        kernel_trace.trace( lambda: f"[{self.get_name()}] Loaded {len(param_value)} elements of '{param_name}' from {sidecar_path}" )
+
+        return param_value
+
+
+    def load_sidecars(self):
+        "Load all the parameters that are still kept in their sidecar files"
+
+        for param_name, param_value in list( self.own_data().items() ):
+            if type(param_value)==dict and self.ESCAPE_sidecar in param_value:
+                self.load_sidecar( param_name )
+
+
+    def externalise_large_values(self, data_dict):
+        """Move the large lists named in the entry's own sidecar_params out of the (pickled) own_data into sidecar files,
+            returning the data with the references in their place.
+            The other parameters stay in data_axs.json, as scripts may read them from there directly.
+            A value that has been loaded from a sidecar unchanged is hard-linked rather than copied (only written if it has changed).
+        """
+        if self.parameters_path or not self.entry_path:
+            return data_dict        # an ad-hoc .json entry has no directory of its own
+
+        own_data            = self.own_data()
+        sidecar_params      = own_data.get( self.PARAMNAME_sidecar_params ) or []
+        externalised_dict   = data_dict
+        for param_name in sidecar_params:
+            param_value = own_data.get( param_name )
+            if type(param_value)!=list or len(param_value)<self.SIDECAR_min_length or param_name.startswith("_") or os.path.sep in param_name:
+                continue
+
+            suffix, contents    = sidecar_contents( data_dict[param_name] )
+            sidecar_name        = param_name + suffix
+            sidecar_path        = os.path.join( self.entry_path, sidecar_name )
+            digest              = hashlib.sha1( contents ).hexdigest()
+
+            origin = sidecar_origins.get( id(param_value) )
+            if origin and origin[0] is param_value and origin[2]==digest and os.path.exists( origin[1] ):
+                if os.path.realpath( origin[1] )!=os.path.realpath( sidecar_path ):
+                    link_path = f"{sidecar_path}.{os.getpid()}.tmp"
+                    try:
+                        os.link( origin[1], link_path )
+                    except OSError:
+                        shutil.copyfile( origin[1], link_path )     # no hard links across file systems
+                    os.replace( link_path, sidecar_path )
+            else:
+                ufun.save_bytes( contents, sidecar_path, durable=flushing_deferred )
+                remember_sidecar_origin( param_value, sidecar_path, digest )
+
+            if externalised_dict is data_dict:
+                externalised_dict = dict(data_dict)
+            externalised_dict[ param_name ] = { self.ESCAPE_sidecar: sidecar_name }
+
+        return externalised_dict
+
+
+    def replay_membership_journal(self, data_dict):
+        """Apply the attach ("+") and detach ("-") records of the membership journal (if there is one) to the contained_entries of the data.
+            The records are idempotent, so replaying them over a data_axs.json that already includes some of them is harmless.
+        """
+        try:
+            with open( os.path.join( self.entry_path, self.FILENAME_membership_journal ), encoding='utf-8' ) as journal_fd:
+                journal_lines = journal_fd.readlines()
+        except OSError:
+            return data_dict
+
+        contained_entries = data_dict.setdefault( 'contained_entries', {} )
+        for journal_line in journal_lines:
+            try:
+                operation, entry_name, *rel_path = json.loads( journal_line )
+            except ValueError:
+                continue    # the incomplete last line of a crashed writer
+
+            if operation=='+':
+                contained_entries[entry_name] = rel_path[0]
+            elif operation=='-':
+                contained_entries.pop( entry_name, None )
+
+        return data_dict
 
 
     def own_functions(self):
@@ -251,7 +555,7 @@ Usage examples :
                     self.own_functions_cache = False
 
             else:
-                logging.debug(f"[{self.get_name()}] The entry does not have a path, so no functions either")
+                kernel_trace.trace( lambda: f"[{self.get_name()}] The entry does not have a path, so no functions either" )
                 self.own_functions_cache = False
 
         return self.own_functions_cache
@@ -262,9 +566,16 @@ Usage examples :
 
             Useful when another axs process is allowed to update entries and we need to pick up the changes.
         """
+        if self.entry_path or self.parameters_path:
+            pending_write = deferred_writes.pop( self.get_parameters_path(), None )
+            if pending_write:
+                pending_write()     # rather than lose the changes
+
         self.own_data_cache         = None
-        self.call_cache             = {}
+        self.shared_values_owned    = None
+        self.call_cache             = None
         self.own_functions_cache    = None
+        self.forget_derived_data()
 
         return self
 
@@ -298,6 +609,8 @@ Usage examples :
         """
 
         if new_path:
+            if self.entry_path and new_path!=self.get_path():
+                self.load_sidecars()    # to be written (or linked) into the new directory, as their references are relative
             self.set_path( new_path )
             self.is_stored = False
         else:
@@ -307,6 +620,12 @@ Usage examples :
 
         if ("__completed" in own_data) or ("__query" in own_data) or (completed is not None):
             self["__completed"] = completed or False
+            if completed and "__lease" in own_data:
+                self.pluck( "__lease" )     # only an incomplete entry needs to tell who is producing it
+
+        store = self.data_store()
+        if store and ('contained_entries' not in own_data) and not os.path.isdir( self.get_path() ) and not self.get( self.PARAMNAME_own_directory ):
+            return self.save_into_store( store, on_collision )
 
         parameters_path        = self.get_parameters_path()
         parameters_dirname, parameters_basename = os.path.split( parameters_path )
@@ -341,9 +660,13 @@ Usage examples :
             else:
                 os.makedirs( parameters_dirname )
 
-        json_string = ufun.save_json( self.pickle_struct(own_data), parameters_path, indent=4 )
+        if self.is_stored and write_behind() and os.path.exists( parameters_path ):
+            defer_write( parameters_path, lambda: self.write_parameters( parameters_path ) )   # the data as it will be by then
+        else:
+            self.write_parameters( parameters_path )        # a new entry is written at once, so that it is never attached without its data
 
-        logging.info(f"[{self.get_name()}] parameters {json_string} saved to '{parameters_path}'")
+        if store and store.remove( self.get_name() ):       # it has got a directory of its own since it was last saved
+            commit_entry_store( store )
 
         self.call('attach')
 
@@ -355,19 +678,78 @@ Usage examples :
         return self
 
 
+    def save_into_store(self, store, on_collision):
+        "The part of save() for an entry kept in its collection's store (see kernel_store) rather than in a directory of its own"
+
+        entry_name = self.get_name()
+        if not self.is_stored and store.contains( entry_name ):   # unexpected collision
+
+            if on_collision in ("force", "ignore"):
+                logging.warning(f"[{entry_name}] Saving over an existing entry of the collection's store in --on_collision=force mode")
+
+            elif on_collision=="timestamp":
+                self.set_path( entry_name + '_' + ufun.generate_current_timestamp(fs_safe=True) )
+                logging.warning(f"[{entry_name}] Collision when saving into the collection's store, switching to {self.get_name()} in --on_collision=timestamp mode")
+                if store.contains( self.get_name() ):
+                    raise FileExistsError( f"Cannot save {entry_name} or {self.get_name()} as both are in the collection's store. Please investigate or use --on_collision=force to override" )
+
+            else: # elif on_collision=="raise":
+                raise FileExistsError( f"Cannot save {entry_name} as the collection's store already has it. Use --on_collision=force to override" )
+
+        store.save( self.get_name(), self.pickle_struct( self.own_data() ) )
+        commit_entry_store( store )
+        logging.info(f"[{self.get_name()}] parameters saved to '{store.store_path}'")
+
+        self.call('attach')
+
+        ak = self.get_kernel()
+        if ak:
+            ak.encache( self.get_path(), self )
+        self.is_stored  = True
+
+        return self
+
+
+    def write_parameters(self, parameters_path):
+        """Write the entry's own_data into its parameters file (the actual writing part of save).
+            A stored collection is written by its code (see write_collection_data() of the core_collection),
+            so that the entries attached or detached by other processes since it was loaded are not lost.
+        """
+        if self.is_stored and 'contained_entries' in self.own_data() and not self.parameters_path and os.path.exists( parameters_path ) and self.reach_function('write_collection_data')[0]:
+            self.call('write_collection_data', [parameters_path], deterministic=False)
+        else:
+            self.write_data_file( parameters_path )
+
+
+    def write_data_file(self, parameters_path, durable=None):
+        "Write the entry's own_data into its parameters file as it is (synced to the disk if durable, by default only when flushing the deferred writes)"
+
+        durable = flushing_deferred if durable is None else durable
+        json_string = ufun.save_json( self.externalise_large_values( self.pickle_struct(self.own_data()) ), parameters_path, indent=4, atomic=True, durable=durable )  # concurrent readers never see a half-written file
+
+        logging.info(f"[{self.get_name()}] parameters {json_string} saved to '{parameters_path}'")
+
+
     def remove(self):
         """Delete the entry from the file system (keeping the memory shadow)
 
 Usage examples :
                 axs byname hebrew_letters , remove
         """
-        self.call('detach')
+        container = self.container_object
+        in_store  = self.kept_in_store()
+        self.call('detach')         # which also removes the entry's data from the collection's store
 
         if self.is_stored:
+            discard_deferred_write( self.get_parameters_path() )
             entry_path = self.parameters_path or self.entry_path
-            ufun.rmdir( entry_path )
+            if not in_store or os.path.lexists( entry_path ):    # an entry kept in the store may have no directory
+                ufun.rmdir( entry_path )
             logging.info(f"[{self.get_name()}] {entry_path} removed from the filesystem")
 
+            if container and not self.parameters_path and container.own_data().get( self.PARAMNAME_fan_out_levels ):
+                ufun.remove_empty_dirs( os.path.dirname( entry_path ), container.get_path() )   # the hashed subdirectories left empty
+
             ak = self.get_kernel()
             if ak:
                 ak.uncache( entry_path )
@@ -381,6 +763,7 @@ Usage examples :
 if __name__ == '__main__':
 
     logging.basicConfig(level=logging.DEBUG, format="%(levelname)s:%(funcName)s %(message)s")
+    kernel_trace.refresh()
 
     print('-'*40 + ' Entry direct creation and storing: ' + '-'*40)
 
@@ -408,4 +791,42 @@ if __name__ == '__main__':
     base_ordinals.save()
     assert base_ordinals["4"]=="four", "Accessing inherited (added) parameter of a stored object"
 
+    os.environ['AXS_WRITE_BEHIND'] = '1'
+    base_ordinals["9"]="nine"
+    base_ordinals.save()
+    assert "9" not in ufun.load_json( base_ordinals.get_parameters_path() ), "Saving a stored entry in the write-behind mode is deferred"
+    assert flush_deferred_writes()==1 and ufun.load_json( base_ordinals.get_parameters_path() )["9"]=="nine", "... until the sync point"
+    del os.environ['AXS_WRITE_BEHIND']
+
+    print('-'*40 + ' Fan-out layout of collections: ' + '-'*40)
+
+    fanned_collection = Entry(entry_path='fanned_collection', own_data={ "contained_entries": {}, Entry.PARAMNAME_fan_out_levels: 2 }, is_stored=False)
+    fanned_entry = Entry(entry_path='generated_entry_42', container=fanned_collection, is_stored=False)
+    assert fanned_collection.trim_path( fanned_entry.get_path() )==os.path.join( '33', '9e', 'generated_entry_42' ), "A new entry is placed under hashed subdirectories"
+    assert fanned_entry.get_name()=="generated_entry_42" and fanned_collection.fanned_out_path( 'generated_entry_42', 0 )=='generated_entry_42'
+
+    print('-'*40 + ' Large parameters in sidecars: ' + '-'*40)
+
+    base_ordinals["many"] = [ f"ordinal_{i}" for i in range(Entry.SIDECAR_min_length) ]
+    base_ordinals["also_many"] = base_ordinals["many"][:]
+    base_ordinals[Entry.PARAMNAME_sidecar_params] = [ "many" ]
+    base_ordinals.save()
+    assert type(ufun.load_json( base_ordinals.get_parameters_path() )["also_many"])==list, "Only the parameters named in sidecar_params go into sidecars"
+    assert ufun.load_json( base_ordinals.get_parameters_path() )["many"]=={ Entry.ESCAPE_sidecar: "many.sidecar_axs.txt" }, "A large list is saved into a sidecar"
+    base_ordinals.reload()
+    assert type(base_ordinals.own_data()["many"])==dict, "... which is not loaded with the rest of the data"
+    assert derived_ordinals["many"][7]=="ordinal_7" and type(base_ordinals.own_data()["many"])==list, "... but when the parameter is first read"
+
+    derived_ordinals["many"] = base_ordinals["many"]
+    derived_ordinals[Entry.PARAMNAME_sidecar_params] = [ "many" ]
+    derived_ordinals.save()
+    assert os.path.samefile( base_ordinals.get_path("many.sidecar_axs.txt"), derived_ordinals.get_path("many.sidecar_axs.txt") ), "An unchanged sidecar value is linked rather than copied"
+
+    derived_ordinals.reload()
+    assert type(derived_ordinals.own_data()["many"])==dict
+    derived_ordinals.save( 'moved_ordinals' )
+    assert Entry(entry_path='moved_ordinals')["many"][7]=="ordinal_7", "A sidecar not loaded yet is still saved along with the entry into another directory"
+    assert os.path.samefile( base_ordinals.get_path("many.sidecar_axs.txt"), derived_ordinals.get_path("many.sidecar_axs.txt") ), "... (linked rather than copied)"
+    shutil.rmtree( 'moved_ordinals' )
+
     # FIXME: add examples entries with code, and call that code
@@ -4,6 +4,7 @@
 
 import datetime
 import errno
+import hashlib
 import json
 import os
 import re
@@ -28,8 +29,11 @@ Usage examples :
         return data_structure
 
 
-def save_json(data_structure, json_file_path, indent=None):
+def save_json(data_structure, json_file_path, indent=None, atomic=False, durable=False):
     """Store a data structure in a JSON file.
+        With --atomic the data is first written into a temporary file that then replaces the target,
+        so that concurrent readers never see a half-written file.
+        With --durable the temporary file is also synced before the rename, so that neither does a crash.
 
 Usage examples :
                 axs func ufun.save_json ---='{"hello":"world"}' hello.json
@@ -37,12 +41,48 @@ Usage examples :
     """
     json_string   = json.dumps( data_structure , indent=indent)
 
-    with open(json_file_path, "w") as json_fd:
+    write_path = f"{json_file_path}.{os.getpid()}.tmp" if atomic else json_file_path
+
+    with open(write_path, "w") as json_fd:
         json_fd.write( json_string+"\n" )
+        if atomic and durable:
+            json_fd.flush()
+            os.fsync( json_fd.fileno() )    # the new contents are durable before the rename makes them visible
+
+    if atomic:
+        os.replace( write_path, json_file_path )
 
     return json_string
 
 
+def save_bytes(contents, file_path, durable=False):
+    "Atomically (and optionally durably, see save_json) store the given bytes in a file"
+
+    write_path = f"{file_path}.{os.getpid()}.tmp"
+
+    with open(write_path, "wb") as write_fd:
+        write_fd.write( contents )
+        if durable:
+            write_fd.flush()
+            os.fsync( write_fd.fileno() )
+
+    os.replace( write_path, file_path )
+
+
+def file_stamp(file_path):
+    """Return a cheap fingerprint of a file (its modification time in nanoseconds and size) or None if it is missing.
+        Used for checking whether cached data derived from the file is still valid.
+
+Usage examples :
+                axs func ufun.file_stamp core_collection/data_axs.json
+    """
+    try:
+        stat_result = os.stat( file_path )
+        return [ stat_result.st_mtime_ns, stat_result.st_size ]
+    except OSError:
+        return None
+
+
 def rematch(input_string, regex, grab=1):
     """Find a substring matching a given regular expression and return it
 
@@ -114,6 +154,19 @@ Usage examples :
         os.remove( dir_path )
 
 
+def remove_empty_dirs(dir_path, top_dir):
+    "Remove the directory and then its parents for as long as they are empty, stopping short of top_dir"
+
+    top_dir     = os.path.realpath( top_dir )
+    dir_path    = os.path.realpath( dir_path )
+    while dir_path.startswith( top_dir + os.path.sep ):
+        try:
+            os.rmdir( dir_path )
+        except OSError:
+            break
+        dir_path = os.path.dirname( dir_path )
+
+
 def move_dir_contents_from_to(source_dir, dest_dir):
 
     all_filenames = os.listdir(source_dir)
@@ -183,6 +236,31 @@ def repr_dict(d, exception_pairs=None):
     return ('{' + (','.join([ repr(k)+':'+safe_value(d[k]) for k in sorted(d.keys()) ])) + '}') if type(d)==dict else repr(d)
 
 
+def structural_digest(data_structure, self_object=None):
+    """A short digest of a data structure, suitable for building cache keys.
+        Nested objects that can fingerprint() themselves (such as Entries) contribute their cached fingerprints
+        instead of being serialized in full; references to self_object are replaced by a constant.
+        Note that tuples are not distinguished from lists, and non-string dictionary keys from their string forms.
+
+Usage examples :
+                axs func ufun.structural_digest ---='{"alpha": [10, 20], "beta": "gamma"}'
+    """
+    def stand_in(obj):
+        if obj is self_object:
+            return "\0self"
+        elif hasattr(obj, 'fingerprint'):
+            return "\0" + obj.fingerprint()
+        else:
+            return "\0" + repr(obj)
+
+    try:
+        serialized = json.dumps( data_structure, sort_keys=True, default=stand_in )
+    except (TypeError, ValueError):     # keys that cannot be sorted or circular references
+        serialized = repr( data_structure )
+
+    return hashlib.blake2b( serialized.encode('utf-8', 'surrogatepass'), digest_size=16 ).hexdigest()
+
+
 def generate_current_timestamp(time_format=None, fs_safe=True):
     """Generate the current timestamp in a readable format
 